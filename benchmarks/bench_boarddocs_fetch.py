@@ -0,0 +1,116 @@
+import time
+import threading
+import requests
+from parsers import board_docs_parser
+try:
+	from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+	from SocketServer import ThreadingMixIn
+	from urlparse import urlparse, parse_qs
+except ImportError:
+	from http.server import HTTPServer, BaseHTTPRequestHandler
+	from socketserver import ThreadingMixIn
+	from urllib.parse import urlparse, parse_qs
+
+'''
+Benchmark for fetching BoardDocs agenda items, run against a local stand-in for the BoardDocs server.
+Compares one-at-a-time requests.get calls with the pooled, concurrent fetchAgendaItems,
+and checks that every item comes back intact even when the server fails some requests the first time.
+Run from the repo root with: python -m benchmarks.bench_boarddocs_fetch
+'''
+
+NUM_ITEMS = 150
+
+# simulated server round-trip time in seconds
+SERVER_LATENCY = 0.1
+
+def main():
+
+	server = startStandInServer()
+	port = server.server_address[1]
+	board_docs_parser.BOARDDOCS_URL = 'http://127.0.0.1:%d/ca/%%s/Board.nsf/%%s' % port
+
+	item_ids = ["ITEM%03d" % i for i in range(NUM_ITEMS)]
+	item_url = board_docs_parser.BOARDDOCS_URL % ('test', 'LT-GetAgendaItem')
+
+	# serial fetch with a fresh connection per item, as the parser used to do
+	start = time.time()
+	serial_pages = dict()
+	for item_id in item_ids:
+		r = requests.get(item_url, params={'open': '', 'id': item_id})
+		serial_pages[item_id] = r.content
+	serial_time = time.time() - start
+
+	# pooled concurrent fetch
+	StandInHandler.failed_once = set()
+	start = time.time()
+	pooled_pages = board_docs_parser.fetchAgendaItems('test', item_ids)
+	pooled_time = time.time() - start
+
+	for item_id in item_ids:
+		assert pooled_pages[item_id] == itemPage(item_id), "item %s came back wrong" % item_id
+
+	print("%d items: serial %.2fs, pooled %.2fs (%.1fx), %d requests retried after a 503" % (NUM_ITEMS, serial_time, pooled_time, serial_time / pooled_time, len(StandInHandler.failed_once)))
+
+	server.shutdown()
+
+
+
+'''
+itemPage
+========
+The html the stand-in server returns for an agenda item.
+'''
+def itemPage(item_id):
+	return ('<html><body><div id="ai-name">1.1 Item %s</div><div key="publicbody">Details for %s</div></body></html>' % (item_id, item_id)).encode('utf-8')
+
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+	# every tenth item fails with a 503 the first time it is requested
+	failed_once = set()
+
+	def do_GET(self):
+		time.sleep(SERVER_LATENCY)
+		item_id = parse_qs(urlparse(self.path).query).get('id', [''])[0]
+
+		if item_id.endswith('0') and item_id not in StandInHandler.failed_once:
+			StandInHandler.failed_once.add(item_id)
+			self.send_response(503)
+			self.end_headers()
+			return
+
+		body = itemPage(item_id)
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/html')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+
+
+'''
+startStandInServer
+==================
+Start the stand-in server on a free local port in a background thread.
+Returns the server.
+'''
+def startStandInServer():
+	server = ThreadedHTTPServer(('127.0.0.1', 0), StandInHandler)
+	server_thread = threading.Thread(target=server.serve_forever)
+	server_thread.daemon = True
+	server_thread.start()
+	return server
+
+
+
+if __name__ == '__main__':
+	main()
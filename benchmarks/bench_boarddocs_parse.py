@@ -0,0 +1,149 @@
+import re
+import sys
+import glob
+import json
+import time
+import pickle
+from scrapers import http_cache
+from parsers import board_docs_parser
+
+'''
+Benchmark for the lxml BoardDocs parse engine against the BeautifulSoup one, on saved pages:
+the test agenda and item pages in docs/*/data/, every BoardDocs page in the http cache, and variants of the saved
+item page that exercise the edge cases (no recommendation, labels in a tail or a comment, whitespace, non-ascii text).
+Checks that both engines build identical JSON for every page, then times them over many pages.
+(docs/east_side_uhsd/data/test_meetings_html.p is a pickled, empty meetings list rather than an agenda or item page, so it isn't used.)
+Run from the repo root with: python -m benchmarks.bench_boarddocs_parse [repeats]
+'''
+
+def main():
+
+	repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+	outline_pages, item_pages = loadSavedPages()
+	item_pages.extend(buildItemVariants(item_pages[0]))
+	outline_pages.extend(buildOutlineVariants(outline_pages[0]))
+
+	# both engines must agree on every page
+	for agenda_html in outline_pages:
+		assert serialize(board_docs_parser.parseOutlineSoup(agenda_html)) == serialize(board_docs_parser.parseOutlineHTML(agenda_html))
+	for item_html in item_pages:
+		assert serialize(board_docs_parser.parseItemSoup("agency", "ITEM", item_html)) == serialize(board_docs_parser.parseItemHTML("agency", "ITEM", item_html))
+	print("%d agenda pages and %d item pages parse identically" % (len(outline_pages), len(item_pages)))
+
+	print("")
+	print("%8s %8s %12s %12s %8s" % ("pages", "parsed", "soup (s)", "lxml (s)", "speedup"))
+	for page_type, parse_soup, parse_lxml, pages in [ \
+		("agenda", board_docs_parser.parseOutlineSoup, board_docs_parser.parseOutlineHTML, outline_pages), \
+		("item", lambda html: board_docs_parser.parseItemSoup("agency", "ITEM", html), lambda html: board_docs_parser.parseItemHTML("agency", "ITEM", html), item_pages)]:
+
+		soup_time = timeParser(parse_soup, pages, repeats)
+		lxml_time = timeParser(parse_lxml, pages, repeats)
+		print("%8s %8d %12.3f %12.3f %7.1fx" % (page_type, len(pages) * repeats, soup_time, lxml_time, soup_time / max(lxml_time, 1e-9)))
+
+
+
+'''
+loadSavedPages
+==============
+Load the saved agenda and item pages: the pickled test pages, and the BoardDocs responses in the http cache.
+Returns a list of agenda page html and a list of item page html.
+'''
+def loadSavedPages():
+	outline_pages = list()
+	item_pages = list()
+
+	for filepath in sorted(glob.glob("docs/*/data/test_agenda_html.p")):
+		with open(filepath, 'rb') as page_file:
+			outline_pages.append(pickle.load(page_file))
+	for filepath in sorted(glob.glob("docs/*/data/test_agenda_item_html.p")):
+		with open(filepath, 'rb') as page_file:
+			item_pages.append(pickle.load(page_file))
+
+	for entry in http_cache.loadIndex().values():
+		if entry['url'].endswith("/LT-GetAgenda") or entry['url'].endswith("/LT-GetAgendaItem"):
+			with open(http_cache.bodyFilepath(entry['body_hash']), 'rb') as body_file:
+				body = body_file.read()
+			if entry['url'].endswith("/LT-GetAgenda"):
+				outline_pages.append(body)
+			else:
+				item_pages.append(body)
+
+	return outline_pages, item_pages
+
+
+
+'''
+buildItemVariants
+=================
+Given an item page, build variants of it that exercise the edge cases of the engines.
+Returns a list of item page html.
+'''
+def buildItemVariants(item_html):
+	variants = list()
+
+	# no recommended action
+	variants.append(item_html.replace('<div class="leftcol">Recommended Action</div>', ''))
+
+	# the first "Type" is a tail after an inline tag, and the item name has a comment and a nested tag
+	variants.append(item_html.replace('<h2>Agenda Item Details</h2>', '<h2>Agenda Item Details</h2><p><b>Note:</b> Type is below</p><div>after <i>the</i> note</div>') \
+		.replace('<span class="agendanumber"> </span>24.', '<span class="agendanumber"> </span><!-- number -->24.<b> </b>'))
+
+	# a label in a comment, and whitespace in a pre in the details
+	variants.append(item_html.replace('<br><br>', '<!-- Recommended Action --><div>from a comment</div><br><br>', 1) \
+		.replace('<strong>Background and Analysis:</strong>', '<strong>Background and Analysis:</strong><pre>\n\t  </pre>'))
+
+	# non-ascii text, as utf-8 bytes
+	variants.append(item_html.replace('Classified Service', u'Classified Service \u2013 Caf\u00e9').encode('utf-8'))
+
+	return variants
+
+
+
+'''
+buildOutlineVariants
+====================
+Given an agenda page, build variants of it that exercise the edge cases of the engines, and a long agenda.
+Returns a list of agenda page html.
+'''
+def buildOutlineVariants(agenda_html):
+	variants = list()
+
+	# section names wrapped in another tag, or split by a comment (which .string treats as two strings)
+	variants.append(re.sub(r'(<span class="category-name">)([^<]*)(</span>)', r'\1<b>\2</b>\3', agenda_html, count=2))
+	variants.append(agenda_html.replace('<span class="category-name">', '<span class="category-name"><!-- name -->', 1))
+
+	# a much longer agenda, repeating the sections (the numbering div that starts the page has no class, so it can't follow an item)
+	numbering, sections = re.match(r'(\s*<div[^>]*id="agenda-numbering".*?</div>)?(.*)', agenda_html, re.S).groups()
+	variants.append((numbering or '') + sections * 10)
+
+	return variants
+
+
+
+'''
+timeParser
+==========
+Parse each page repeats times with the given parser. Returns the total time taken.
+'''
+def timeParser(parse, pages, repeats):
+	start = time.time()
+	for repeat in range(repeats):
+		for page_html in pages:
+			parse(page_html)
+	return time.time() - start
+
+
+
+'''
+serialize
+=========
+Serialize parsed output the same way it's written out.
+'''
+def serialize(parsed):
+	return json.dumps(parsed, sort_keys = True, indent = 4, ensure_ascii=True)
+
+
+
+if __name__ == '__main__':
+	main()
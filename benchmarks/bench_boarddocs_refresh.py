@@ -0,0 +1,224 @@
+import os
+import sys
+import glob
+import json
+import time
+import pickle
+import shutil
+import datetime
+import tempfile
+import threading
+from scrapers import fetch, http_cache
+from parsers import board_docs_parser
+try:
+	from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+	from SocketServer import ThreadingMixIn
+	from urlparse import urlparse, parse_qs
+except ImportError:
+	from http.server import HTTPServer, BaseHTTPRequestHandler
+	from socketserver import ThreadingMixIn
+	from urllib.parse import urlparse, parse_qs
+
+'''
+Benchmark for refreshing BoardDocs agendas with change detection, against a local stand-in for the BoardDocs server
+that serves the saved agenda page and copies of the saved item page. Counts the requests it takes to parse the agenda,
+to reparse it (through the http cache, with its normal TTL), and to check it for amendments when nothing changed and when
+a few items were amended, and checks that the refreshed JSON has the amended items and matches a full reparse of the amended agenda.
+Runs in a scratch directory, so docs/ and the http cache aren't touched.
+Run from the repo root with: python -m benchmarks.bench_boarddocs_refresh [amended items]
+'''
+
+AGENCY = "bench_agency"
+
+def main():
+
+	num_amended = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+
+	with open(glob.glob("docs/*/data/test_agenda_html.p")[0], 'rb') as page_file:
+		StandInHandler.agenda_page = toBytes(pickle.load(page_file))
+	with open(glob.glob("docs/*/data/test_agenda_item_html.p")[0], 'rb') as page_file:
+		StandInHandler.item_template = toBytes(pickle.load(page_file))
+
+	server = startStandInServer()
+	board_docs_parser.BOARDDOCS_URL = 'http://127.0.0.1:%d/ca/%%s/Board.nsf/%%s' % server.server_address[1]
+
+	# the agenda page is checked back with the server on every refresh, as it would be an hour later
+	# (the stand-in sends no validators, so that's a full fetch). item pages go through the cache as they normally would
+	board_docs_parser.REFRESH_MAX_AGE = 0
+
+	working_directory = os.getcwd()
+	scratch_directory = tempfile.mkdtemp()
+	try:
+		os.chdir(scratch_directory)
+		http_cache.CACHE_DIR = os.path.join(scratch_directory, "docs/.http_cache")
+		os.makedirs("docs/" + AGENCY + "/structured_agendas")
+		writeAgendaList()
+
+		print("%32s %10s %10s" % ("run", "requests", "time (s)"))
+
+		runParse("first parse", False, False)
+		runParse("full reparse", True, False)
+		runParse("refresh, unchanged", False, True)
+
+		# amend a few items, which changes their entries in the outline and their pages
+		item_ids = [item_id for section in board_docs_parser.parseOutlineHTML(StandInHandler.agenda_page) for item_id in section['item_ids']]
+		for item_id in item_ids[:num_amended]:
+			StandInHandler.amendItem(item_id)
+
+		runParse("refresh, %d items amended" % num_amended, False, True)
+		refreshed_json = readStructuredAgenda()
+
+		runParse("full reparse, amended", True, False)
+		assert countAmendedItems(refreshed_json) == num_amended, "refreshed agenda is missing amended items"
+		assert refreshed_json == readStructuredAgenda(), "refreshed agenda differs from a full reparse"
+		print("")
+		print("the refreshed agenda has the %d amended items, and matches a full reparse of the amended agenda" % num_amended)
+
+	finally:
+		http_cache.writeIndexToDisk()
+		os.chdir(working_directory)
+		shutil.rmtree(scratch_directory)
+		server.shutdown()
+
+
+
+'''
+runParse
+========
+Parse the agenda list, optionally marking the agenda unparsed first, and print the requests and time it took.
+The parser's own output is hidden.
+'''
+def runParse(run_name, reparse, detect_changes):
+	if reparse:
+		agenda_list = board_docs_parser.loadAgendaList(AGENCY)
+		agenda_list[0]['parsed'] = False
+		board_docs_parser.writeAgendaListToDisk(AGENCY, agenda_list)
+
+	start_requests = fetch.getCounters().get('http_requests', 0)
+	start = time.time()
+
+	stdout = sys.stdout
+	sys.stdout = open(os.devnull, 'w')
+	try:
+		board_docs_parser.parseAgendas(AGENCY, "bench", detect_changes)
+	finally:
+		sys.stdout.close()
+		sys.stdout = stdout
+
+	print("%32s %10d %10.2f" % (run_name, fetch.getCounters().get('http_requests', 0) - start_requests, time.time() - start))
+
+
+
+'''
+writeAgendaList
+===============
+Write out an agenda list with one unparsed agenda, meeting today.
+'''
+def writeAgendaList():
+	board_docs_parser.writeAgendaListToDisk(AGENCY, [{
+		"agency": AGENCY,
+		"boarddocs_id": "AGENDA",
+		"meeting_date": datetime.date.today().strftime("%m-%d-%Y"),
+		"meeting_title": "Regular Meeting",
+		"meeting_title_raw": "Regular Meeting",
+		"parsed": False
+	}])
+
+
+
+'''
+readStructuredAgenda
+====================
+Read the structured agenda JSON the parser wrote out.
+'''
+def readStructuredAgenda():
+	with open(glob.glob("docs/" + AGENCY + "/structured_agendas/*_agenda.json")[0]) as structured_file:
+		return structured_file.read()
+
+
+
+'''
+countAmendedItems
+=================
+Count the items in a structured agenda's JSON that have the amended text from the stand-in's item pages.
+'''
+def countAmendedItems(agenda_json):
+	return len([item for section in json.loads(agenda_json)['meeting_sections'] for item in section['items'] \
+		if "Amended Resolution Authorizing" in json.dumps(item)])
+
+
+
+'''
+toBytes
+=======
+The saved pages were pickled as byte strings; return one as bytes.
+'''
+def toBytes(page):
+	if not isinstance(page, bytes):
+		page = page.encode('latin-1')
+	return page
+
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+	agenda_page = None
+	item_template = None
+	amended_items = set()
+
+	def do_GET(self):
+		page_name = urlparse(self.path).path.rsplit('/', 1)[-1]
+		if page_name == 'LT-GetAgenda':
+			body = StandInHandler.agenda_page
+		else:
+			body = StandInHandler.itemPage(parse_qs(urlparse(self.path).query).get('id', [''])[0])
+
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/html')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+	# copy of the saved item page for an item
+	@staticmethod
+	def itemPage(item_id):
+		body = StandInHandler.item_template.replace(b'A8BVUE826DDC', item_id.encode('ascii'))
+		if item_id in StandInHandler.amended_items:
+			body = body.replace(b'Resolution Authorizing', b'Amended Resolution Authorizing')
+		return body
+
+	# retitle an item in the agenda page, and change its item page
+	@staticmethod
+	def amendItem(item_id):
+		StandInHandler.amended_items.add(item_id)
+		item_start = StandInHandler.agenda_page.index(b'id="' + item_id.encode('ascii') + b'"')
+		title_start = StandInHandler.agenda_page.index(b'<span class="title">', item_start) + len(b'<span class="title">')
+		StandInHandler.agenda_page = StandInHandler.agenda_page[:title_start] + b'Amended ' + StandInHandler.agenda_page[title_start:]
+
+
+
+'''
+startStandInServer
+==================
+Start the stand-in server on a free local port in a background thread.
+Returns the server.
+'''
+def startStandInServer():
+	server = ThreadedHTTPServer(('127.0.0.1', 0), StandInHandler)
+	server_thread = threading.Thread(target=server.serve_forever)
+	server_thread.daemon = True
+	server_thread.start()
+	return server
+
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,151 @@
+import sys
+import time
+import resource
+import multiprocessing
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn import feature_extraction, ensemble
+from sklearn.feature_extraction.text import CountVectorizer
+from parsers.line_classifier import prepDatasets, buildTrainingDataset, buildTrainingMatrix, buildSparseColumns, convertFeaturesToDummyVariables, NON_FEATURE_COLS, DTM_PARAMS
+
+'''
+Memory benchmark comparing the dense and sparse feature matrices built from an agency's training lines,
+and the sparse matrix built from the training files a chunk at a time (which never loads them as one dataframe).
+Each path runs in a fresh process so peak RSS isn't shared between them.
+Then compares building just the structural feature block (the columns of the lines themselves) through a dense array
+and column by column, on the training lines repeated up to a large classify batch.
+Run from the repo root with: python -m benchmarks.bench_feature_memory [agency] [batch lines]
+'''
+
+CLASSES_LIST = ["meeting_heading", "section_heading", "item_heading", "item_text", "other_text"]
+
+def main():
+
+	agency = sys.argv[1] if len(sys.argv) > 1 else "east_side_uhsd"
+	batch_lines = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+	training_directory = "docs/" + agency + "/training_lines/"
+
+	print("%8s %10s %14s %16s %12s %12s" % ("path", "shape", "matrix (MB)", "peak RSS (MB)", "prep (s)", "fit (s)"))
+	for path_name in ["dense", "sparse", "chunked"]:
+		pool = multiprocessing.Pool(1)
+		result = pool.apply(runPath, (path_name, training_directory))
+		pool.close()
+		pool.join()
+
+		print("%8s %10s %14.1f %16.1f %12.2f %12.2f" % ((path_name, "%dx%d" % result['shape']) + (result['matrix_mb'], result['peak_rss_mb'], result['prep_time'], result['fit_time'])))
+
+	print("")
+	print("%8s %14s %14s %18s %12s" % ("block", "shape", "matrix (MB)", "added peak (MB)", "build (s)"))
+	for block_name in ["dense", "columns"]:
+		pool = multiprocessing.Pool(1)
+		result = pool.apply(runBlock, (block_name, training_directory, batch_lines))
+		pool.close()
+		pool.join()
+
+		print("%8s %14s %14.1f %18.1f %12.2f" % (block_name, "%dx%d" % result['shape'], result['matrix_mb'], result['added_peak_mb'], result['build_time']))
+
+
+
+'''
+runPath
+=======
+Build the feature matrix using the named path and fit a random forest on it.
+Returns a dict of measurements.
+'''
+def runPath(path_name, training_directory):
+
+	if path_name != "chunked":
+		training_df = buildTrainingDataset(training_directory)
+
+	start = time.time()
+	if path_name == "chunked":
+		model_pieces = {'vect': CountVectorizer(**DTM_PARAMS), 'encoder': feature_extraction.DictVectorizer(sparse=True)}
+		datasets, model_pieces = buildTrainingMatrix(training_directory, model_pieces, CLASSES_LIST)
+		X, y = datasets[0], datasets[1]
+		matrix_bytes = X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+	elif path_name == "dense":
+		X, y = prepDenseDatasets(training_df, CLASSES_LIST)
+		matrix_bytes = X.nbytes
+	else:
+		model_pieces = {'vect': CountVectorizer(**DTM_PARAMS), 'encoder': feature_extraction.DictVectorizer(sparse=True)}
+		datasets, model_pieces = prepDatasets(model_pieces, training_df, CLASSES_LIST, True)
+		X, y = datasets[0], datasets[1]
+		matrix_bytes = X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+	prep_time = time.time() - start
+
+	start = time.time()
+	rf = ensemble.RandomForestClassifier(n_estimators=30, n_jobs=1, class_weight="balanced")
+	rf.fit(X, y)
+	fit_time = time.time() - start
+
+	return {'shape': X.shape, 'matrix_mb': matrix_bytes / (1024.0 * 1024.0), 'peak_rss_mb': getPeakRSS(), 'prep_time': prep_time, 'fit_time': fit_time}
+
+
+
+'''
+runBlock
+========
+Build the structural feature block of the training lines, repeated up to batch_lines, using the named path:
+the old dense array converted to CSR, or prepDatasets' column-by-column build.
+Returns a dict of measurements, with the growth in peak RSS while building it.
+'''
+def runBlock(block_name, training_directory, batch_lines):
+
+	training_df = buildTrainingDataset(training_directory)
+	training_df = pd.concat([training_df] * int(np.ceil(batch_lines / float(len(training_df)))), ignore_index=True)[:batch_lines]
+	feature_cols = [col for col in training_df.columns if col not in NON_FEATURE_COLS + CLASSES_LIST]
+	start_peak_rss_mb = getPeakRSS()
+
+	start = time.time()
+	if block_name == "dense":
+		X = sparse.csr_matrix(training_df[feature_cols].values)
+	else:
+		X = buildSparseColumns(training_df, feature_cols)
+	build_time = time.time() - start
+
+	matrix_bytes = X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+	return {'shape': X.shape, 'matrix_mb': matrix_bytes / (1024.0 * 1024.0), 'added_peak_mb': getPeakRSS() - start_peak_rss_mb, 'build_time': build_time}
+
+
+
+'''
+getPeakRSS
+==========
+Return this process's peak RSS so far, in MB.
+'''
+def getPeakRSS():
+	# ru_maxrss is in KB on linux and bytes on mac
+	peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return peak_rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak_rss / 1024.0
+
+
+
+'''
+prepDenseDatasets
+=================
+The original dense feature assembly: dense dummies and a dense copy of the DTM, concatenated with numpy.
+Returns the feature array and the outcome series.
+'''
+def prepDenseDatasets(df, y_cols):
+
+	x_array = df.drop([col for col in NON_FEATURE_COLS + y_cols if col in df.columns], axis=1).values
+
+	model_pieces = {'encoder': feature_extraction.DictVectorizer(sparse=False)}
+	feature_dummies, model_pieces = convertFeaturesToDummyVariables(df, model_pieces, True)
+	x_array = np.concatenate((x_array, feature_dummies), axis=1)
+
+	df['text'].fillna('', inplace=True)
+	counts_matrix = CountVectorizer(**DTM_PARAMS).fit_transform(df['text'])
+	x_array = np.concatenate((x_array, counts_matrix.toarray()), axis=1)
+
+	df['line_class'] = None
+	for y_col_name in y_cols:
+		df.loc[(df[y_col_name]==1),'line_class'] = y_col_name
+
+	return x_array, df['line_class']
+
+
+
+if __name__ == '__main__':
+	main()
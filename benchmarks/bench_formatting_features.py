@@ -0,0 +1,99 @@
+import os
+import re
+import sys
+import time
+import pdfplumber
+import pandas as pd
+from parsers.pdf_parser import extractPageLines, addDocumentFeatures
+
+'''
+Benchmark comparing the per-line formatting feature extraction with the vectorized, whole-document version,
+on the PDFs in docs/*/raw_pdfs. Checks that both produce the same features.
+Run from the repo root with: python -m benchmarks.bench_formatting_features [max_pdfs]
+'''
+
+def main():
+
+	max_pdfs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+	pdf_filepaths = list()
+	for agency in sorted(os.listdir("docs")):
+		pdf_dir = "docs/" + agency + "/raw_pdfs/"
+		if os.path.isdir(pdf_dir):
+			pdf_filepaths += [(agency, pdf_dir + filename) for filename in sorted(os.listdir(pdf_dir)) if filename.endswith(".pdf")]
+	pdf_filepaths = pdf_filepaths[:max_pdfs]
+
+	per_line_time = 0
+	vectorized_time = 0
+	num_lines = 0
+	for agency, filepath in pdf_filepaths:
+
+		# extract the raw lines once, outside the timings
+		with pdfplumber.open(filepath) as pdf:
+			raw_lines = extractPageLines(pdf, range(len(pdf.pages)), agency, "")
+		if len(raw_lines) == 0:
+			continue
+		num_lines += len(raw_lines)
+
+		start = time.time()
+		per_line_df = pd.DataFrame(addFeaturesPerLine([dict(line) for line in raw_lines]))
+		per_line_time += time.time() - start
+
+		start = time.time()
+		vectorized_df = addDocumentFeatures([dict(line) for line in raw_lines], agency)
+		vectorized_time += time.time() - start
+
+		# both approaches must give the same features
+		per_line_df = per_line_df[sorted(per_line_df.columns)]
+		assert list(per_line_df.columns) == list(vectorized_df.columns), filepath
+		assert per_line_df.astype(str).values.tolist() == vectorized_df.astype(str).values.tolist(), filepath
+
+	print("%d PDFs, %d lines" % (len(pdf_filepaths), num_lines))
+	print("per line:   %.3fs (%.0f lines/s)" % (per_line_time, num_lines / max(per_line_time, 1e-9)))
+	print("vectorized: %.3fs (%.0f lines/s)" % (vectorized_time, num_lines / max(vectorized_time, 1e-9)))
+
+
+
+'''
+addFeaturesPerLine
+==================
+The original feature extraction: regexes compiled and tested one line at a time,
+followed by separate passes for font names, font styles, and indentation buckets.
+Returns the list of line dicts.
+'''
+def addFeaturesPerLine(lines):
+
+	for line in lines:
+		line['text'] = line['text'].strip()
+		line['uppercase'] = 1 if line['text'].isupper() else 0
+		line['starts_with_number'] = 1 if re.compile(r'\d{1,3}\.?\s+').match(line['text']) is not None else 0
+		line['starts_with_subnumber'] = 1 if re.compile(r'\d+[\.]\d+\s+').match(line['text']) is not None else 0
+		line['starts_with_roman_numeral'] = 1 if re.compile(r'(XC|XL|L?X{0,3})(IX|IV|V?I{0,3})\.\s+').match(line['text']) is not None else 0
+		line['starts_with_enum_letter'] = 1 if re.compile(r'[(]?[A-Za-z][).]?\s+').match(line['text']) is not None else 0
+		line['includes_time'] = 1 if re.compile(r'[aA|pP].?[mM].?').search(line['text']) is not None else 0
+
+	for line in lines:
+		font = line['font_name']
+		if '+' in font:
+			font = font.split('+')[-1]
+		line['font_name'] = re.sub(r'MT', '', font)
+
+	for line in lines:
+		line['font_bold'] = 1 if 'bold' in line['font_name'].lower() else 0
+		line['font_italic'] = 1 if 'italic' in line['font_name'].lower() else 0
+
+	ranked_left_indents = sorted(set([line['left_inset'] for line in lines]))
+	for line in lines:
+		for bucket in range(6):
+			line['indent_bucket_%d' % bucket] = 0
+		if line['left_inset'] in ranked_left_indents[:5]:
+			line['indent_bucket_%d' % ranked_left_indents.index(line['left_inset'])] = 1
+		else:
+			line['indent_bucket_5'] = 1
+
+	return lines
+
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,81 @@
+import random
+import time
+from operator import itemgetter
+from parsers.pdf_parser import groupCharsIntoLines, charInsideRect
+
+'''
+Benchmark for the single-pass line grouping in pdf_parser.
+Run from the repo root with: python -m benchmarks.bench_line_grouping
+'''
+
+def main():
+
+	print("%10s %10s %12s %12s %8s" % ("chars", "lines", "rescan (s)", "1-pass (s)", "speedup"))
+
+	for num_chars in [1000, 5000, 20000, 50000]:
+		sorted_chars = sorted(buildSyntheticChars(num_chars), key=itemgetter('top', 'x0'))
+		y_tol = 2
+		rect_index = (list(), list())
+
+		start = time.time()
+		rescan_lines = groupCharsByRescan(sorted_chars, rect_index, y_tol)
+		rescan_time = time.time() - start
+
+		start = time.time()
+		single_pass_lines = list(groupCharsIntoLines(sorted_chars, rect_index, y_tol))
+		single_pass_time = time.time() - start
+
+		# both approaches must find the same lines with the same chars
+		assert rescan_lines == single_pass_lines
+
+		print("%10d %10d %12.4f %12.4f %7.1fx" % (num_chars, len(single_pass_lines), rescan_time, single_pass_time, rescan_time / max(single_pass_time, 1e-9)))
+
+
+
+'''
+buildSyntheticChars
+===================
+Build a list of char dicts laid out like a dense agenda page,
+with ~80 chars per line and a little vertical jitter within each line.
+Returns the list in random order.
+'''
+def buildSyntheticChars(num_chars):
+	random.seed(num_chars)
+	chars = list()
+	for i in range(num_chars):
+		line_num = i // 80
+		char_num = i % 80
+		top = line_num * 12.0 + random.choice([0.0, 0.0, 0.5, 1.0])
+		chars.append({'text': random.choice('abcdefghij '), 'top': top, 'bottom': top + 10.0, 'x0': 40.0 + char_num * 6.0, 'fontname': 'Arial', 'size': 10.0})
+
+	random.shuffle(chars)
+	return chars
+
+
+
+'''
+groupCharsByRescan
+==================
+The original grouping approach, which rescans every char on the page each time a new line is found.
+Returns a list of (first char, line chars) tuples.
+'''
+def groupCharsByRescan(sorted_chars, rect_index, y_tol):
+	lines = list()
+	current_y_pos = 0
+
+	for char in sorted_chars:
+		cur_y_min = current_y_pos - y_tol
+		cur_y_max = current_y_pos + y_tol
+
+		if cur_y_min >= char['top'] or char['top'] >= cur_y_max:
+			if not charInsideRect(char, rect_index):
+				lines_char_objs = [c for c in sorted_chars if c['top'] <= (char['top']+y_tol) and c['top'] >= (char['top']-y_tol)]
+				lines.append((char, lines_char_objs))
+				current_y_pos = char['top']
+
+	return lines
+
+
+
+if __name__ == '__main__':
+	main()
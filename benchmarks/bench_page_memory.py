@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+import resource
+import multiprocessing
+import pdfplumber
+from parsers.pdf_parser import extractPageLines, buildPageGeometry, cropHeaderAndFooter, getLinesWithFormatting
+
+'''
+Memory benchmark for releasing each page's parsed objects as the PDF is read, against keeping every page cached.
+Parses the longest agendas of an agency, each path in a fresh process so peak RSS isn't shared between them.
+Run from the repo root with: python -m benchmarks.bench_page_memory [agency] [num_pdfs]
+'''
+
+def main():
+
+	agency = sys.argv[1] if len(sys.argv) > 1 else "cupertino_usd"
+	num_pdfs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+	# the longest pdfs show the growth best
+	pdf_directory = "docs/" + agency + "/raw_pdfs/"
+	filepaths = [pdf_directory + filename for filename in os.listdir(pdf_directory) if filename.endswith(".pdf")]
+	filepaths = sorted(filepaths, key=os.path.getsize, reverse=True)[:num_pdfs]
+
+	print("%40s %8s %8s %16s %16s %10s %10s" % ("pdf", "pages", "lines", "cached RSS (MB)", "release RSS (MB)", "cached (s)", "release (s)"))
+	for filepath in filepaths:
+		results = dict()
+		for path_name in ["cached", "release"]:
+			pool = multiprocessing.Pool(1)
+			results[path_name] = pool.apply(runPath, (path_name, filepath, agency))
+			pool.close()
+			pool.join()
+
+		# both paths must extract the same lines
+		assert results['cached']['lines'] == results['release']['lines']
+
+		print("%40s %8d %8d %16.1f %16.1f %10.2f %10.2f" % (os.path.basename(filepath), results['release']['num_pages'], len(results['release']['lines']), \
+			results['cached']['peak_rss_mb'], results['release']['peak_rss_mb'], results['cached']['time'], results['release']['time']))
+
+
+
+'''
+runPath
+=======
+Extract the lines of a pdf using the named path.
+Returns a dict of measurements.
+'''
+def runPath(path_name, filepath, agency):
+	start = time.time()
+	with pdfplumber.open(filepath) as pdf:
+		page_indexes = range(len(pdf.pages))
+		if path_name == "release":
+			lines = extractPageLines(pdf, page_indexes, agency, "bench")
+		else:
+			lines = extractPageLinesCached(pdf, page_indexes, agency, "bench")
+
+	# ru_maxrss is in kilobytes on linux, bytes on mac
+	peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	peak_rss_mb = peak_rss / 1024.0 ** (2 if sys.platform == 'darwin' else 1)
+
+	return {'num_pages': len(page_indexes), 'lines': lines, 'peak_rss_mb': peak_rss_mb, 'time': time.time() - start}
+
+
+
+'''
+extractPageLinesCached
+======================
+The original extraction, which leaves every parsed page cached on the open PDF.
+Returns the lines from all of the pages, in page order.
+'''
+def extractPageLinesCached(pdf, page_indexes, agency, date):
+	lines = list()
+	for page_index in page_indexes:
+		page = pdf.pages[page_index]
+		geometry = buildPageGeometry(page)
+		page = cropHeaderAndFooter(page, page_index, geometry)
+		lines += getLinesWithFormatting(page, page_index, agency, date, geometry)
+	return lines
+
+
+
+if __name__ == '__main__':
+	main()
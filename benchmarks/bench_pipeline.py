@@ -0,0 +1,294 @@
+import os
+import sys
+import glob
+import json
+import pickle
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+import instrumentation
+from scrapers import http_cache
+from parsers import line_store
+from parsers.pdf_parser import extractLinesFromPDF
+from parsers.line_classifier import trainModel, readTrainingFile, classifyLines, CLASSES_LIST
+from parsers.line_structurer import loadLines, convertLinesToJSON, cleanExtractJSON
+from parsers.board_docs_parser import parseAgendaOutline, parseAgendaItem
+
+'''
+End-to-end benchmark of the pipeline stages over the saved corpus in docs/, run offline:
+parsing PDFs into lines, training the line classifier, classifying parsed lines, structuring classed lines,
+and parsing saved BoardDocs pages. Each stage runs in a fresh process under instrumentation.stageTimer,
+and reports its throughput and peak RSS. Nothing is written to docs/.
+
+Results are compared with the baselines in BASELINES_FILEPATH, and the run fails (exits 1) if any stage's
+throughput falls, or its peak RSS grows, by more than REGRESSION_TOLERANCE. Baselines are machine-specific,
+so record them on the machine that checks them, with --update-baselines.
+Run from the repo root with: python -m benchmarks.bench_pipeline [--update-baselines] [--stages a,b] [--max-agendas N]
+'''
+
+# where the baselines are kept
+BASELINES_FILEPATH = "benchmarks/baselines.json"
+
+# how far a stage can fall behind its baseline before the run fails
+REGRESSION_TOLERANCE = 0.2
+
+# stages in pipeline order
+STAGES = ['extract_lines', 'train_model', 'classify_lines', 'structure_lines', 'boarddocs_parse']
+
+# times to parse each saved BoardDocs page, since there are only a couple of them
+BOARDDOCS_REPEATS = 20
+
+def main():
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--update-baselines", action="store_true", help="record this run as the new baselines")
+	parser.add_argument("--stages", default=",".join(STAGES), help="comma-separated stages to run")
+	parser.add_argument("--max-agendas", type=int, default=5, help="agendas per agency for the per-agenda stages")
+	args = parser.parse_args()
+
+	stages = [stage for stage in args.stages.split(",") if stage]
+	for stage in stages:
+		if stage not in STAGES:
+			parser.error("unknown stage %s (expected one of %s)" % (stage, ", ".join(STAGES)))
+
+	results = dict()
+	print("%16s %8s %10s %10s %14s %16s" % ("stage", "units", "count", "wall (s)", "units/s", "peak RSS (MB)"))
+	for stage in stages:
+		pool = multiprocessing.Pool(1)
+		result = pool.apply(runStage, (stage, args.max_agendas))
+		pool.close()
+		pool.join()
+
+		if result is None:
+			print("%16s (no saved inputs, skipped)" % stage)
+			continue
+
+		results[stage] = result
+		print("%16s %8s %10d %10.2f %14.1f %16.1f" % (stage, result['unit'], result['count'], result['wall_s'], result['throughput'], result['peak_rss_mb']))
+
+	if args.update_baselines:
+		baselines = loadBaselines()
+		baselines.update(results)
+		with open(BASELINES_FILEPATH, 'w') as outfile:
+			json.dump(baselines, outfile, sort_keys = True, indent = 4)
+		print("Baselines written to %s" % BASELINES_FILEPATH)
+		return
+
+	regressions = compareToBaselines(results, loadBaselines())
+	if regressions:
+		print("")
+		for regression in regressions:
+			print("REGRESSION: %s" % regression)
+		sys.exit(1)
+
+
+
+'''
+runStage
+========
+Run one stage over the saved corpus in this process, with no network access, and measure it with stageTimer.
+Returns a dict with the unit counted, the count, the wall time, the throughput, and the peak RSS,
+or None if there are no saved inputs for the stage.
+'''
+def runStage(stage, max_agendas):
+
+	# never go to the network, and keep the timing records out of the pipeline's metrics file
+	http_cache.setOfflineMode(True)
+	output_directory = tempfile.mkdtemp()
+	instrumentation.METRICS_FILEPATH = os.path.join(output_directory, "metrics.jsonl")
+
+	try:
+		stage_function, unit = STAGE_FUNCTIONS[stage]
+		inputs = findStageInputs(stage, max_agendas)
+		if not inputs:
+			return None
+
+		# anything the stage needs that isn't part of it, like a trained model, is built before the timer starts
+		if stage in STAGE_SETUP_FUNCTIONS:
+			inputs = STAGE_SETUP_FUNCTIONS[stage](inputs)
+
+		with instrumentation.stageTimer('benchmark', stage) as record:
+			stage_function(inputs, output_directory)
+	finally:
+		shutil.rmtree(output_directory)
+
+	count = record['counts'].get(unit, 0)
+	return {'unit': unit, 'count': count, 'wall_s': record['wall_s'], 'cpu_s': record['cpu_s'], \
+		'throughput': count / max(record['wall_s'], 1e-9), 'peak_rss_mb': record['peak_rss_mb']}
+
+
+
+'''
+findStageInputs
+===============
+Given a stage, find its saved inputs in docs/, taking up to max_agendas agendas per agency for the per-agenda stages.
+Returns a list of input filepaths, or of (training directory, filepaths) tuples for the classifier.
+'''
+def findStageInputs(stage, max_agendas):
+
+	if stage == 'extract_lines':
+		return [filepath for agency_directory in sorted(glob.glob("docs/*/raw_pdfs/")) \
+			for filepath in sorted(glob.glob(agency_directory + "*.pdf"))[:max_agendas]]
+
+	elif stage == 'train_model':
+		return sorted(glob.glob("docs/*/training_lines/"))
+
+	elif stage == 'classify_lines':
+		inputs = list()
+		for training_directory in sorted(glob.glob("docs/*/training_lines/")):
+			agency_directory = os.path.dirname(os.path.dirname(training_directory))
+			filepaths = sorted(glob.glob(agency_directory + "/parsed_lines/*_parsed_lines.*"))[:max_agendas]
+			if filepaths:
+				inputs.append((training_directory, filepaths))
+		return inputs
+
+	elif stage == 'structure_lines':
+		return [filepath for agency_directory in sorted(glob.glob("docs/*/classed_lines/")) \
+			for filepath in sorted(glob.glob(agency_directory + "*_classed_lines.*"))[:max_agendas]]
+
+	elif stage == 'boarddocs_parse':
+		return sorted(glob.glob("docs/*/data/test_agenda_html.p") + glob.glob("docs/*/data/test_agenda_item_html.p"))
+
+
+
+'''
+The stages. Each takes its inputs and a scratch directory for anything it writes,
+and adds the units it processed to the running stage with instrumentation.addCount.
+The classifier is benchmarked with a model trained on its agency's own training lines.
+'''
+def benchExtractLines(filepaths, output_directory):
+	for filepath in filepaths:
+		agency, date = parsePDFFilename(filepath)
+		extractLinesFromPDF(filepath, agency, date)
+
+
+def countTrainingLines(training_directories):
+	return [(training_directory, sum(len(readTrainingFile(filepath, ['line_id'])) for filepath in glob.glob(training_directory + "*.csv"))) \
+		for training_directory in training_directories]
+
+
+def benchTrainModel(inputs, output_directory):
+	for training_directory, num_lines in inputs:
+		trainModel(training_directory, CLASSES_LIST, False)
+		instrumentation.addCount('lines', num_lines)
+
+
+def trainClassifiers(inputs):
+	return [(trainModel(training_directory, CLASSES_LIST, False), filepaths) for training_directory, filepaths in inputs]
+
+
+def benchClassifyLines(inputs, output_directory):
+	for model_pieces, filepaths in inputs:
+		for filepath in filepaths:
+			output_filepath = os.path.join(output_directory, os.path.basename(filepath).rsplit(".", 1)[0] + ".npz")
+			classifyLines(model_pieces, filepath, output_filepath, CLASSES_LIST)
+			instrumentation.addCount('lines', len(line_store.readLines(output_filepath, ['line_class'])))
+
+
+def benchStructureLines(filepaths, output_directory):
+	for filepath in filepaths:
+		agency = filepath.split("/")[1]
+		date = os.path.basename(filepath)[len(agency) + 1:].split("_classed_lines")[0]
+		lines = loadLines(agency, date)
+		json_agenda = cleanExtractJSON(convertLinesToJSON(agency, date, lines))
+		json.dumps(json_agenda, sort_keys = True, indent = 4, ensure_ascii=True)
+		instrumentation.addCount('lines', len(lines))
+
+
+def benchBoardDocsParse(filepaths, output_directory):
+	for filepath in filepaths:
+		agency = filepath.split("/")[1]
+		with open(filepath, 'rb') as page_file:
+			page_html = pickle.load(page_file)
+
+		for repeat in range(BOARDDOCS_REPEATS):
+			if filepath.endswith("test_agenda_html.p"):
+				parseAgendaOutline(agency, None, None, page_html)
+			else:
+				parseAgendaItem(agency, None, None, page_html)
+			instrumentation.addCount('pages')
+
+
+STAGE_FUNCTIONS = {
+	'extract_lines': (benchExtractLines, 'pages'),
+	'train_model': (benchTrainModel, 'lines'),
+	'classify_lines': (benchClassifyLines, 'lines'),
+	'structure_lines': (benchStructureLines, 'lines'),
+	'boarddocs_parse': (benchBoardDocsParse, 'pages'),
+}
+
+STAGE_SETUP_FUNCTIONS = {
+	'train_model': countTrainingLines,
+	'classify_lines': trainClassifiers,
+}
+
+
+
+'''
+parsePDFFilename
+================
+Given the path of a raw PDF, named like agency_date.pdf, return the agency and the date.
+'''
+def parsePDFFilename(filepath):
+	agency = filepath.split("/")[1]
+	date = os.path.basename(filepath)[len(agency) + 1:-len(".pdf")]
+	return agency, date
+
+
+
+'''
+loadBaselines
+=============
+Load the saved baselines, or an empty dict if there aren't any yet.
+'''
+def loadBaselines():
+	if not os.path.exists(BASELINES_FILEPATH):
+		return dict()
+	with open(BASELINES_FILEPATH) as infile:
+		return json.load(infile)
+
+
+
+'''
+compareToBaselines
+==================
+Given this run's results and the baselines, compare every stage that has a baseline over the same inputs.
+Returns a list of descriptions of the stages that regressed.
+'''
+def compareToBaselines(results, baselines):
+
+	if not baselines:
+		print("")
+		print("No baselines in %s yet; record them with --update-baselines" % BASELINES_FILEPATH)
+		return list()
+
+	regressions = list()
+	print("")
+	print("%16s %16s %16s" % ("stage", "throughput", "peak RSS"))
+	for stage in STAGES:
+		if stage not in results or stage not in baselines:
+			continue
+		result = results[stage]
+		baseline = baselines[stage]
+
+		# a different corpus (or --max-agendas) isn't comparable
+		if result['unit'] != baseline['unit'] or result['count'] != baseline['count']:
+			print("%16s baseline covers %d %s, this run %d; not compared" % (stage, baseline['count'], baseline['unit'], result['count']))
+			continue
+
+		throughput_change = result['throughput'] / max(baseline['throughput'], 1e-9) - 1
+		rss_change = result['peak_rss_mb'] / max(baseline['peak_rss_mb'], 1e-9) - 1
+		print("%16s %+15.1f%% %+15.1f%%" % (stage, throughput_change * 100, rss_change * 100))
+
+		if throughput_change < -REGRESSION_TOLERANCE:
+			regressions.append("%s throughput %.1f %s/s, baseline %.1f" % (stage, result['throughput'], result['unit'], baseline['throughput']))
+		if rss_change > REGRESSION_TOLERANCE:
+			regressions.append("%s peak RSS %.1f MB, baseline %.1f" % (stage, result['peak_rss_mb'], baseline['peak_rss_mb']))
+
+	return regressions
+
+
+
+if __name__ == '__main__':
+	main()
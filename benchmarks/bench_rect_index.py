@@ -0,0 +1,150 @@
+import random
+import time
+from parsers.pdf_parser import buildPageGeometry, findHeaderAndFooter, buildRectIndex, charInsideRect
+
+'''
+Benchmark for the page geometry index used by the header/footer crop and the rect exclusion in pdf_parser,
+on synthetic table-heavy pages with many drawn lines and rects.
+Run from the repo root with: python -m benchmarks.bench_rect_index
+'''
+
+PAGE_WIDTH = 612.0
+PAGE_HEIGHT = 792.0
+
+def main():
+
+	print("%8s %8s %8s %12s %12s %8s" % ("rects", "chars", "pages", "scan (s)", "index (s)", "speedup"))
+
+	num_pages = 20
+	for num_rects in [10, 100, 500, 2000]:
+		pages = [buildSyntheticPage(num_rects, page_index) for page_index in range(num_pages)]
+
+		start = time.time()
+		scan_results = [cropAndExcludeByScan(page, page_index) for page_index, page in enumerate(pages)]
+		scan_time = time.time() - start
+
+		start = time.time()
+		index_results = [cropAndExcludeByIndex(page, page_index) for page_index, page in enumerate(pages)]
+		index_time = time.time() - start
+
+		# both approaches must crop the same margins and exclude the same chars
+		assert scan_results == index_results
+
+		print("%8d %8d %8d %12.4f %12.4f %7.1fx" % (num_rects, len(pages[0].chars), num_pages, scan_time, index_time, scan_time / max(index_time, 1e-9)))
+
+
+
+'''
+SyntheticPage
+=============
+Stands in for a pdfplumber page, with just the attributes the crop and the rect exclusion read.
+'''
+class SyntheticPage(object):
+	def __init__(self, lines, rects, chars):
+		self.width = PAGE_WIDTH
+		self.height = PAGE_HEIGHT
+		self.lines = lines
+		self.rects = rects
+		self.chars = chars
+
+
+
+'''
+buildSyntheticPage
+==================
+Build a page laid out like a table-heavy agenda: a rule under the header and above the footer,
+a grid of table cells (some wide rows, some narrow cells), and a line of chars every 12 points.
+Returns the page.
+'''
+def buildSyntheticPage(num_rects, seed):
+	random.seed(seed * 10000 + num_rects)
+
+	lines = [{'top': 60.0, 'bottom': 60.0, 'y0': PAGE_HEIGHT - 60.0, 'y1': PAGE_HEIGHT - 60.0}, \
+		{'top': PAGE_HEIGHT - 50.0, 'bottom': PAGE_HEIGHT - 50.0, 'y0': 50.0, 'y1': 50.0}]
+
+	rects = list()
+	for i in range(num_rects):
+		top = random.uniform(0, PAGE_HEIGHT - 20)
+		height = random.choice([8.0, 12.0, 40.0, 120.0])
+		x0 = random.uniform(0, 200)
+		width = random.choice([40.0, 120.0, 400.0])
+		rects.append({'x0': x0, 'x1': x0 + width, 'top': top, 'bottom': top + height, 'width': width, 'height': height})
+
+	chars = list()
+	for line_num in range(int(PAGE_HEIGHT // 12)):
+		top = line_num * 12.0 + random.choice([0.0, 0.5])
+		for char_num in range(80):
+			chars.append({'top': top, 'bottom': top + 10.0, 'x0': 40.0 + char_num * 6.0})
+
+	return SyntheticPage(lines, rects, chars)
+
+
+
+'''
+cropAndExcludeByScan
+====================
+The original approach: walk every line and rect for the crop, clip and filter every rect again
+after cropping, then test each char against each excluded rect.
+Returns the crop margins and the flags of which chars are excluded.
+'''
+def cropAndExcludeByScan(page, page_index):
+
+	header_height = 30
+	max_header_height = page.height / 2 if page_index == 0 else 100
+	topmost_line_dist_from_top = page.height
+	rects = [rect for rect in page.rects if (rect['width'] > page.width/2) and (rect['height'] > page.height / 10)]
+	for line in page.lines + rects:
+		if line['bottom'] < topmost_line_dist_from_top:
+			topmost_line_dist_from_top = line['bottom']
+			if line['bottom'] < max_header_height:
+				header_height = line['bottom']
+
+	footer_height = 0
+	lowest_line_dist_from_bottom = page.height
+	for line in page.lines:
+		if line['y0'] < lowest_line_dist_from_bottom:
+			lowest_line_dist_from_bottom = line['y0']
+			if line['y0'] < 200:
+				footer_height = line['y1']
+
+	# clip the rects to the crop, as the cropped page would
+	x0, top, x1, bottom = (0, header_height, page.width, page.height - footer_height)
+	clipped_rects = list()
+	for rect in page.rects:
+		clipped = {'top': max(rect['top'], top), 'bottom': min(rect['bottom'], bottom)}
+		clipped['width'] = min(rect['x1'], x1) - max(rect['x0'], x0)
+		clipped['height'] = clipped['bottom'] - clipped['top']
+		clipped_rects.append(clipped)
+	rects = [rect for rect in clipped_rects if (rect['width'] > (x1 - x0)/2) and (rect['height'] > (bottom - top) / 10)]
+
+	excluded = list()
+	for char in page.chars:
+		inside = False
+		for rect in rects:
+			if char['top'] >= rect['top'] and char['bottom'] <= rect['bottom']:
+				inside = True
+				break
+		excluded.append(inside)
+
+	return ((header_height, footer_height), excluded)
+
+
+
+'''
+cropAndExcludeByIndex
+=====================
+The indexed approach: build the page geometry once and use it for both the crop and the exclusion.
+Returns the crop margins and the flags of which chars are excluded.
+'''
+def cropAndExcludeByIndex(page, page_index):
+	geometry = buildPageGeometry(page)
+	header_height, footer_height = findHeaderAndFooter(geometry, page_index)
+	rect_index = buildRectIndex(geometry, (0, header_height, page.width, page.height - footer_height))
+	excluded = [charInsideRect(char, rect_index) for char in page.chars]
+
+	return ((header_height, footer_height), excluded)
+
+
+
+if __name__ == '__main__':
+	main()
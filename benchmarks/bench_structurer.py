@@ -0,0 +1,180 @@
+import re
+import glob
+import json
+import time
+from parsers import line_store
+from parsers.line_structurer import convertLinesToJSON, cleanExtractJSON
+
+'''
+Benchmark for the linear-time structurer against the original, which grew each item's text with += and
+recompiled its number patterns for every item. Checks that both build byte-identical JSON for every agenda
+in the classed_lines corpus, then times them on the corpus and on synthetic agendas with very long items.
+Run from the repo root with: python -m benchmarks.bench_structurer
+'''
+
+def main():
+
+	# the classed lines of every agenda, from the line store or legacy CSVs
+	agendas = list()
+	for filepath in sorted(glob.glob("docs/*/classed_lines/*_classed_lines.*")):
+		lines = line_store.readLines(filepath, ["line_class", "text"]).fillna("").to_dict(orient="records")
+		agendas.append((filepath, lines))
+
+	original_time, linear_time = timeStructurers(agendas, check_output=True)
+	print("corpus: %d agendas, %d lines" % (len(agendas), sum(len(lines) for filepath, lines in agendas)))
+	print("original: %.3fs, linear: %.3fs (%.1fx)" % (original_time, linear_time, original_time / max(linear_time, 1e-9)))
+
+	print("")
+	print("%14s %14s %14s %8s" % ("lines per item", "original (s)", "linear (s)", "speedup"))
+	for item_lines in [100, 1000, 10000, 50000]:
+		original_time, linear_time = timeStructurers([("synthetic", buildSyntheticLines(item_lines))], check_output=True)
+		print("%14d %14.3f %14.3f %7.1fx" % (item_lines, original_time, linear_time, original_time / max(linear_time, 1e-9)))
+
+
+
+'''
+timeStructurers
+===============
+Structure each agenda with both structurers, optionally checking that the serialized JSON is identical.
+Returns the total time taken by each.
+'''
+def timeStructurers(agendas, check_output):
+	original_time = 0
+	linear_time = 0
+
+	for filepath, lines in agendas:
+		start = time.time()
+		original_json = cleanExtractJSONOriginal(convertLinesToJSONOriginal("agency", "date", lines))
+		original_time += time.time() - start
+
+		start = time.time()
+		linear_json = cleanExtractJSON(convertLinesToJSON("agency", "date", lines))
+		linear_time += time.time() - start
+
+		if check_output:
+			assert serialize(original_json) == serialize(linear_json), filepath
+
+	return original_time, linear_time
+
+
+
+'''
+serialize
+=========
+Serialize an agenda the same way writeJSONtoDisk does.
+'''
+def serialize(json_agenda):
+	return json.dumps(json_agenda, sort_keys = True, indent = 4, ensure_ascii=True)
+
+
+
+'''
+buildSyntheticLines
+===================
+Build the classed lines of an agenda with a few sections, each with a few items of item_lines lines.
+'''
+def buildSyntheticLines(item_lines):
+	lines = list()
+	for section in range(3):
+		lines.append({"line_class": "section_heading", "text": "%d. SECTION %d" % (section + 1, section + 1)})
+		for item in range(2):
+			lines.append({"line_class": "item_heading", "text": "%d.%d Item heading %d" % (section + 1, item + 1, item)})
+			for line_num in range(item_lines):
+				lines.append({"line_class": "item_text", "text": "line %d of the item text, which goes on for a while" % line_num})
+	return lines
+
+
+
+'''
+The original structurer, kept for comparison.
+'''
+def extractSectionNumberOriginal(line_text):
+	re_starts_num_or_letter = re.compile(r'\d+\.?\s+|[(]?[A-Za-z][.)]?\s+')
+	re_starts_roman_numeral = re.compile(r'(XC|XL|L?X{0,3})(IX|IV|V?I{0,3})')
+	if re_starts_num_or_letter.match(line_text) is not None:
+		raw_num_string = re_starts_num_or_letter.match(line_text).group()
+	elif re_starts_roman_numeral.match(line_text) is not None:
+		raw_num_string = re_starts_roman_numeral.match(line_text).group()
+	else:
+		return False
+
+	num_string = raw_num_string.strip()
+	num_string = re.sub(r'^\s?[.)]', '', num_string)
+
+	return num_string
+
+
+def extractItemNumberOriginal(line_text):
+	line_text = re.sub(r'^[*]*', '', line_text).strip()
+
+	re_starts_num_or_letter = re.compile(r'\d+[.)]?\s+|[(]?[A-Za-z][.)]?\s+')
+	re_starts_sub_num = re.compile(r'\d+[\.]\d+\s+')
+	re_starts_num_letter = re.compile(r'\d+[\.][A-Za-z]\s+')
+
+	if re_starts_num_or_letter.match(line_text) is not None:
+		raw_num_string = re_starts_num_or_letter.match(line_text).group()
+		raw_num_string = re.sub(r'^\s?[(]?[.)]', '', raw_num_string)
+	elif re_starts_sub_num.match(line_text) is not None:
+		raw_num_string = re_starts_sub_num.match(line_text).group()
+	elif re_starts_num_letter.match(line_text) is not None:
+		raw_num_string = re_starts_num_letter.match(line_text).group()
+	else:
+		return False
+
+	num_string = raw_num_string.strip()
+
+	return num_string
+
+
+def convertLinesToJSONOriginal(agency, date, lines):
+	active_item = False
+	json_agenda = {"agency": agency, "meeting_date": date, "meeting_sections": []}
+
+	for i, line in enumerate(lines):
+		if line["line_class"] == "section_heading":
+			json_agenda["meeting_sections"].append({"section_name_raw": line["text"], "section_number": "", "items": []})
+			active_item = False
+		elif line["line_class"] == "item_heading":
+			if len(json_agenda['meeting_sections']) > 0:
+				json_agenda["meeting_sections"][-1]["items"].append({"item_text_raw": line["text"], "item_number": ""})
+				active_item = True
+		elif line["line_class"] == "item_text":
+			if active_item:
+				json_agenda["meeting_sections"][-1]["items"][-1]["item_text_raw"] += (" " + line["text"])
+		elif line["line_class"] == "other_text":
+			if active_item:
+				if (i+1 < len(lines)) and (lines[i+1] == "item_text"):
+					json_agenda["meeting_sections"][-1]["items"][-1]["item_text_raw"] += "\n"
+
+	return json_agenda
+
+
+def cleanExtractJSONOriginal(json_agenda):
+	for agenda_section in json_agenda["meeting_sections"]:
+		section_name = agenda_section["section_name_raw"]
+		section_number = extractSectionNumberOriginal(section_name)
+		if section_number:
+			agenda_section["section_number"] = section_number
+			section_name = section_name.replace(section_number, "", 1)
+			section_name = re.sub(r'^\.', "", section_name)
+
+		section_name = section_name.strip()
+		agenda_section["section_name"] = section_name
+
+		for item in agenda_section["items"]:
+			item_text = re.sub(r'^[*]*', '', item["item_text_raw"]).strip()
+			item_number = extractItemNumberOriginal(item_text)
+			if item_number:
+				item["item_number"] = item_number
+				item_text = item_text.replace(item_number, "", 1)
+				item_text = re.sub(r'^[.()]*', "", item_text)
+
+			item_text = item_text.strip()
+			item["item_text"] = item_text
+
+	return json_agenda
+
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,71 @@
+import sys
+import time
+import pickle
+import resource
+import multiprocessing
+from sklearn import ensemble, metrics, cross_validation, feature_extraction
+from parsers.line_classifier import prepDatasets, buildTrainingDataset, makeTextVectorizer, CLASSES_LIST
+
+'''
+Benchmark comparing the fitted vocabulary text features with the stateless hashed ones:
+held-out accuracy, featurizing time, the size of the pickled model pieces, and peak RSS.
+Each featurizer runs in a fresh process so peak RSS isn't shared between them.
+Run from the repo root with: python -m benchmarks.bench_text_features [agency]
+'''
+
+def main():
+
+	agency = sys.argv[1] if len(sys.argv) > 1 else "east_side_uhsd"
+	training_directory = "docs/" + agency + "/training_lines/"
+
+	print("%12s %14s %10s %14s %12s %16s" % ("featurizer", "shape", "accuracy", "pickle (MB)", "prep (s)", "peak RSS (MB)"))
+	for featurizer in ["vocabulary", "hashed"]:
+		pool = multiprocessing.Pool(1)
+		result = pool.apply(runFeaturizer, (featurizer, training_directory))
+		pool.close()
+		pool.join()
+
+		print("%12s %14s %10.3f %14.2f %12.2f %16.1f" % (featurizer, "%dx%d" % result['shape'], result['accuracy'], result['pickle_mb'], result['prep_time'], result['peak_rss_mb']))
+
+
+
+'''
+runFeaturizer
+=============
+Split the training lines, featurize them with the named featurizer, fit a random forest on the training part,
+and score it on the held-out part. The split uses a fixed seed so both featurizers see the same lines.
+Returns a dict of measurements.
+'''
+def runFeaturizer(featurizer, training_directory):
+
+	training_df = buildTrainingDataset(training_directory)
+	train_df, test_df = cross_validation.train_test_split(training_df, test_size=0.33, random_state=0)
+
+	start = time.time()
+	model_pieces = {'vect': makeTextVectorizer(featurizer), 'encoder': feature_extraction.DictVectorizer(sparse=True)}
+	train_datasets, model_pieces = prepDatasets(model_pieces, train_df.copy(), CLASSES_LIST, True)
+	test_datasets, model_pieces = prepDatasets(model_pieces, test_df.copy(), CLASSES_LIST, False)
+	prep_time = time.time() - start
+
+	rf = ensemble.RandomForestClassifier(n_estimators=30, n_jobs=-1, class_weight="balanced", random_state=0)
+	rf.fit(train_datasets[0], train_datasets[1])
+	model_pieces['model'] = rf
+
+	# collapse the test set's outcome columns the same way prepDatasets does for the training set
+	test_df['line_class'] = None
+	for y_col_name in CLASSES_LIST:
+		test_df.loc[(test_df[y_col_name]==1),'line_class'] = y_col_name
+	accuracy = metrics.accuracy_score(test_df['line_class'], rf.predict(test_datasets[0]))
+
+	pickle_mb = len(pickle.dumps(model_pieces, pickle.HIGHEST_PROTOCOL)) / (1024.0 * 1024.0)
+
+	# ru_maxrss is in KB on linux and bytes on mac
+	peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	peak_rss_mb = peak_rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak_rss / 1024.0
+
+	return {'shape': train_datasets[0].shape, 'accuracy': accuracy, 'pickle_mb': pickle_mb, 'prep_time': prep_time, 'peak_rss_mb': peak_rss_mb}
+
+
+
+if __name__ == '__main__':
+	main()
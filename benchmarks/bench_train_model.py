@@ -0,0 +1,66 @@
+import sys
+import time
+from sklearn import linear_model, multiclass, tree, ensemble, feature_extraction
+from sklearn.feature_extraction.text import CountVectorizer
+from parsers.line_classifier import trainModel, buildTrainingDataset, prepDatasets, exportTree, CLASSES_LIST, DTM_PARAMS
+
+'''
+Benchmark for production training, which fits only the production estimator,
+against the original trainModel, which fit a logistic regression, a decision tree (and rendered it), and a random forest.
+Run from the repo root with: python -m benchmarks.bench_train_model [agency]
+'''
+
+def main():
+
+	agency = sys.argv[1] if len(sys.argv) > 1 else "east_side_uhsd"
+	training_directory = "docs/" + agency + "/training_lines/"
+
+	start = time.time()
+	trainAllModels(training_directory, CLASSES_LIST)
+	all_models_time = time.time() - start
+
+	start = time.time()
+	trainModel(training_directory, CLASSES_LIST, False)
+	production_time = time.time() - start
+
+	print("%16s %18s %8s" % ("all models (s)", "production (s)", "speedup"))
+	print("%16.2f %18.2f %7.1fx" % (all_models_time, production_time, all_models_time / max(production_time, 1e-9)))
+
+
+
+'''
+trainAllModels
+==============
+The original production training: fits every model on the full training set, keeping only the random forest.
+Returns the fitted model pieces.
+'''
+def trainAllModels(training_directory, classes_list):
+	training_df = buildTrainingDataset(training_directory)
+
+	model_pieces = dict()
+	model_pieces['vect'] = CountVectorizer(**DTM_PARAMS)
+	model_pieces['encoder'] = feature_extraction.DictVectorizer(sparse=True)
+	datasets, model_pieces = prepDatasets(model_pieces, training_df, classes_list, True)
+	X = datasets[0]
+	y = datasets[1]
+
+	model_pieces['model'] = multiclass.OneVsRestClassifier(linear_model.LogisticRegressionCV(cv=5, penalty='l1', solver='liblinear', n_jobs=-1))
+	model_pieces['model'].fit(X, y)
+
+	dtc = tree.DecisionTreeClassifier(class_weight="balanced")
+	dtc.fit(X, y)
+	try:
+		exportTree(dtc, datasets[2], "tree.pdf")
+	except Exception as e:
+		print("Could not render tree (timing the fit only): %s" % e)
+
+	rf = ensemble.RandomForestClassifier(n_estimators=30, n_jobs=-1, class_weight="balanced")
+	rf.fit(X, y)
+	model_pieces['model'] = rf
+
+	return model_pieces
+
+
+
+if __name__ == '__main__':
+	main()
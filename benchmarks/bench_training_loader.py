@@ -0,0 +1,76 @@
+import os
+import sys
+import glob
+import time
+import resource
+import multiprocessing
+import pandas as pd
+from parsers.line_classifier import buildTrainingDataset
+
+'''
+Benchmark for the compact training dataset loader against the original one, which loaded every column as parsed
+(int64 indicators, object font names, and the stray index column), over the training lines of every agency.
+Each loader runs in a fresh process so peak RSS isn't shared between them.
+Run from the repo root with: python -m benchmarks.bench_training_loader
+'''
+
+def main():
+
+	training_directories = sorted(glob.glob("docs/*/training_lines/"))
+
+	print("%10s %8s %10s %14s %16s %10s" % ("loader", "lines", "columns", "frame (MB)", "peak RSS (MB)", "load (s)"))
+	for loader_name in ["original", "compact"]:
+		pool = multiprocessing.Pool(1)
+		result = pool.apply(runLoader, (loader_name, training_directories))
+		pool.close()
+		pool.join()
+
+		print("%10s %8d %10d %14.2f %16.1f %10.3f" % (loader_name, result['num_lines'], result['num_columns'], result['frame_mb'], result['peak_rss_mb'], result['load_time']))
+
+
+
+'''
+runLoader
+=========
+Load the training lines of every agency with the named loader, one agency's dataframe per directory,
+all kept in memory at once as they would be when training on the whole corpus.
+Returns a dict of measurements.
+'''
+def runLoader(loader_name, training_directories):
+
+	start = time.time()
+	if loader_name == "original":
+		training_dfs = [buildTrainingDatasetOriginal(directory) for directory in training_directories]
+	else:
+		training_dfs = [buildTrainingDataset(directory) for directory in training_directories]
+	load_time = time.time() - start
+
+	frame_bytes = sum(df.memory_usage(deep=True).sum() for df in training_dfs)
+
+	# ru_maxrss is in KB on linux and bytes on mac
+	peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	peak_rss_mb = peak_rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak_rss / 1024.0
+
+	return {'num_lines': sum(len(df) for df in training_dfs), 'num_columns': sum(len(df.columns) for df in training_dfs), \
+		'frame_mb': frame_bytes / (1024.0 * 1024.0), 'peak_rss_mb': peak_rss_mb, 'load_time': load_time}
+
+
+
+'''
+buildTrainingDatasetOriginal
+============================
+The original loader, with no dtypes or column selection.
+Returns the merged dataframe.
+'''
+def buildTrainingDatasetOriginal(directory_path):
+	df_list = list()
+	for filename in os.listdir(directory_path):
+		if filename.endswith(".csv"):
+			df_list.append(pd.read_csv(os.path.join(directory_path, filename), sep = ',', header = 0))
+
+	return pd.concat(df_list, ignore_index=True)
+
+
+
+if __name__ == '__main__':
+	main()
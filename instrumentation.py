@@ -0,0 +1,150 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import pstats
+import resource
+import threading
+from contextlib import contextmanager
+from scrapers import fetch
+
+'''
+Records where the pipeline spends its time. Each stage run under stageTimer writes one JSON line to METRICS_FILEPATH
+with its wall time, CPU time, peak RSS, HTTP activity, and any counts (pages, lines, items...) added with addCount.
+Stages listed in PROFILE_STAGES are also run under cProfile, with the stats written to PROFILE_DIRECTORY.
+
+CPU time, peak RSS and HTTP activity are process-wide, so when agencies run concurrently
+a stage's numbers include whatever else was running at the same time.
+'''
+
+# where to append the stage records
+METRICS_FILEPATH = os.environ.get("AGENDAMINER_METRICS", "docs/pipeline_metrics.jsonl")
+
+# stages to profile, as a comma-separated list (like "parse_pages,classify")
+PROFILE_STAGES = set(stage for stage in os.environ.get("AGENDAMINER_PROFILE", "").split(",") if stage)
+
+# where to write the profiles
+PROFILE_DIRECTORY = "docs/profiles/"
+
+# ru_maxrss is in kilobytes on linux, bytes on mac
+RSS_UNITS_PER_MB = 1024.0 ** 2 if sys.platform == 'darwin' else 1024.0
+
+_metrics_lock = threading.Lock()
+_active = threading.local()
+
+
+
+'''
+stageTimer
+==========
+Context manager that measures a stage for an agency (and optionally a single agenda),
+and writes out its record when the stage finishes, including if it raises.
+Yields the record, so the caller can add fields to it.
+'''
+@contextmanager
+def stageTimer(agency, stage, agenda=None):
+
+	record = {'agency': agency, 'stage': stage, 'agenda': agenda, 'start': time.time(), 'counts': dict()}
+
+	# counts added while this stage runs go to it and to any stage it's nested in
+	if not hasattr(_active, 'records'):
+		_active.records = list()
+	_active.records.append(record)
+
+	profiler = None
+	if profileEnabled(stage):
+		profiler = cProfile.Profile()
+
+	start_usage = resource.getrusage(resource.RUSAGE_SELF)
+	start_children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+	start_http = fetch.getCounters()
+	start_wall = time.time()
+
+	try:
+		if profiler is not None:
+			profiler.enable()
+		yield record
+		record['error'] = False
+	except:
+		record['error'] = True
+		raise
+	finally:
+		if profiler is not None:
+			profiler.disable()
+			record['profile'] = writeProfile(profiler, "_".join(str(part) for part in [agency, stage, agenda] if part is not None))
+
+		end_usage = resource.getrusage(resource.RUSAGE_SELF)
+		end_children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+		end_http = fetch.getCounters()
+
+		record['wall_s'] = time.time() - start_wall
+		record['cpu_s'] = (end_usage.ru_utime + end_usage.ru_stime) - (start_usage.ru_utime + start_usage.ru_stime)
+		record['children_cpu_s'] = (end_children_usage.ru_utime + end_children_usage.ru_stime) - (start_children_usage.ru_utime + start_children_usage.ru_stime)
+		record['peak_rss_mb'] = end_usage.ru_maxrss / RSS_UNITS_PER_MB
+		record['children_peak_rss_mb'] = end_children_usage.ru_maxrss / RSS_UNITS_PER_MB
+		for name, count in end_http.items():
+			if count != start_http.get(name, 0):
+				record['counts'][name] = count - start_http.get(name, 0)
+
+		_active.records.remove(record)
+		writeRecord(record)
+
+
+
+'''
+addCount
+========
+Add to a count (like pages, lines, or items) on every stage running in this thread.
+Does nothing outside a stage.
+'''
+def addCount(name, count=1):
+	for record in getattr(_active, 'records', []):
+		record['counts'][name] = record['counts'].get(name, 0) + count
+
+
+
+'''
+profileEnabled
+==============
+Returns true if the named stage should be profiled.
+'''
+def profileEnabled(stage):
+	return stage in PROFILE_STAGES
+
+
+
+'''
+writeProfile
+============
+Given a cProfile profiler and a name, write out its stats and print the slowest calls.
+Returns the path of the stats file, which can be loaded with pstats or snakeviz.
+'''
+def writeProfile(profiler, name):
+	if not os.path.exists(PROFILE_DIRECTORY):
+		os.makedirs(PROFILE_DIRECTORY)
+
+	profile_filepath = "%s%s_%d_%d.prof" % (PROFILE_DIRECTORY, name, os.getpid(), int(time.time() * 1000))
+	profiler.dump_stats(profile_filepath)
+
+	print("Profile of %s written to %s" % (name, profile_filepath))
+	pstats.Stats(profile_filepath).sort_stats('cumulative').print_stats(20)
+
+	return profile_filepath
+
+
+
+'''
+writeRecord
+===========
+Append a record to the metrics file as one line of JSON.
+'''
+def writeRecord(record):
+	metrics_directory = os.path.dirname(METRICS_FILEPATH)
+	line = json.dumps(record, sort_keys = True) + "\n"
+
+	with _metrics_lock:
+		if metrics_directory and not os.path.exists(metrics_directory):
+			os.makedirs(metrics_directory)
+		with open(METRICS_FILEPATH, 'a') as metrics_file:
+			metrics_file.write(line)
@@ -1,10 +1,41 @@
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, UnicodeDammit
+from lxml import etree
 import pickle
 import re
 import os.path
 import json
+import hashlib
+import datetime
 import line_structurer
+import instrumentation
+from scrapers.fetch import fetchURL, fetchAll
+
+# base url for an agency's BoardDocs pages, filled in with the agency code and page name
+BOARDDOCS_URL = 'http://www.boarddocs.com/ca/%s/Board.nsf/%s'
+
+# parsed agendas for meetings this many days ago or later are checked for amendments when detecting changes
+REFRESH_WINDOW_DAYS = 14
+
+# seconds a cached agenda page is trusted when checking for amendments, before asking the server again
+REFRESH_MAX_AGE = 60 * 60
+
+# how pages are parsed: "lxml" runs compiled XPath on the parsed html, "soup" builds BeautifulSoup trees (kept for comparison)
+PARSE_ENGINE = "lxml"
+
+# XPath for the parts of the pages the lxml engine reads, compiled once and shared by every page
+XPATH_CATEGORY_HEADINGS = etree.XPath("//div[contains(concat(' ', normalize-space(@class), ' '), ' category ')]")
+XPATH_CATEGORY_NAME = etree.XPath(".//span[contains(concat(' ', normalize-space(@class), ' '), ' category-name ')]")
+XPATH_CATEGORY_WRAPPER = etree.XPath("ancestor::div[contains(concat(' ', normalize-space(@class), ' '), ' wrap-category ')][1]")
+XPATH_FOLLOWING_DIVS = etree.XPath("following-sibling::div")
+XPATH_ITEM_NAME = etree.XPath("//div[@id='ai-name']")
+XPATH_ITEM_BODY = etree.XPath("//div[@key='publicbody']")
+XPATH_STRINGS_CONTAINING = etree.XPath("(//text() | //comment())[contains(., $label)]")
+XPATH_IDENTIFIED_DIVS = etree.XPath("//div[@id]")
+
+# BeautifulSoup collapses text that's all (ascii) whitespace to a newline or a space, except inside these tags
+WHITESPACE = '\x20\x0a\x09\x0c\x0d'
+WHITESPACE_PRESERVING_TAGS = set(['pre', 'textarea'])
 
 def main():
 
@@ -18,37 +49,89 @@ def main():
 '''
 parseAgendas
 ============
+Parse every agenda in the agency's list that hasn't been parsed yet.
+With detect_changes set, parsed agendas for recent and upcoming meetings are also checked for amendments,
+and only the items that changed are fetched and parsed again.
 '''
-def parseAgendas(agency, agency_code):
+def parseAgendas(agency, agency_code, detect_changes=False):
 
 	agenda_list = loadAgendaList(agency)
 	for agenda in agenda_list:
 
 		if not agenda['parsed']:
+			parseAgenda(agency, agency_code, agenda)
+
+		elif detect_changes and isRefreshDue(agenda):
+			parseAgenda(agency, agency_code, agenda, reuse_unchanged=True)
+
+	writeAgendaListToDisk(agency, agenda_list)
 
-			agenda_outline = parseAgendaOutline(agency, agency_code, agenda)
+	return agenda_list
 
-			json_agenda = {
-				"agency": agency,
-				"meeting_date": agenda['meeting_date'],
-				"meeting_sections": []
-			}
 
-			for section in agenda_outline:
-				json_agenda['meeting_sections'].append(structureAgendaSection(agency, agency_code, section))
 
-			print(json.dumps(json_agenda, indent=4))
+'''
+parseAgenda
+===========
+Given an entry in the agenda list, fetch and parse the agenda, write out its structured JSON,
+and record the fingerprints of its outline and items on the entry.
+With reuse_unchanged set, the agenda is left alone if its outline hasn't changed, and otherwise
+items whose entries in the outline haven't changed are taken from the structured JSON already on disk.
+'''
+def parseAgenda(agency, agency_code, agenda, reuse_unchanged=False):
+
+	# get the agenda, checking back with the server if it might have been amended
+	r = fetchURL(BOARDDOCS_URL % (agency_code, 'LT-GetAgenda'), params={'open': '', 'id': agenda['boarddocs_id']}, \
+		max_age=REFRESH_MAX_AGE if reuse_unchanged else None)
+	agenda_html = r.content
+
+	outline_fingerprint = fingerprint(agenda_html)
+	if reuse_unchanged and outline_fingerprint == agenda.get('outline_fingerprint'):
+		print("%s %s is unchanged" % (agency, agenda['meeting_date']))
+		return
+
+	agenda_outline = parseAgendaOutline(agency, agency_code, agenda, agenda_html)
+	item_fingerprints = fingerprintOutlineItems(agenda_html, agenda_outline)
+
+	# clean up the meeting title
+	clean_title = agenda['meeting_title'].strip().lower()
+	clean_title = re.sub(r'\W+', '_', clean_title)
+
+	# keep the items that are listed the same way as when they were parsed
+	parsed_items = dict()
+	if reuse_unchanged:
+		previous_fingerprints = agenda.get('item_fingerprints', {})
+		for item_id, item in loadStructuredItems(agency, agenda['meeting_date'], clean_title).items():
+			if item_id in previous_fingerprints and previous_fingerprints[item_id] == item_fingerprints.get(item_id):
+				parsed_items[item_id] = item
+
+	# fetch every other item in the agenda at once. on a refresh these are the amended items,
+	# so their cached pages are checked back with the server rather than served as they are
+	item_ids = [item_id for section in agenda_outline for item_id in section['item_ids'] if item_id not in parsed_items]
+	item_pages = fetchAgendaItems(agency_code, item_ids, max_age=0 if reuse_unchanged else None)
+	instrumentation.addCount('agendas')
+	instrumentation.addCount('items', len(item_ids))
+	instrumentation.addCount('items_reused', len(parsed_items))
+
+	json_agenda = {
+		"agency": agency,
+		"meeting_date": agenda['meeting_date'],
+		"meeting_sections": []
+	}
 
-			# clean up the meeting title
-			clean_title = agenda['meeting_title'].strip().lower()
-			clean_title = re.sub(r'\W+', '_', clean_title)
-			line_structurer.writeJSONtoDisk(json_agenda, agency, json_agenda['meeting_date'], clean_title)
+	for section in agenda_outline:
+		json_agenda['meeting_sections'].append(structureAgendaSection(agency, agency_code, section, item_pages, parsed_items))
 
-			agenda['parsed'] = True
+	if reuse_unchanged:
+		print("%s %s was amended: %d items fetched, %d unchanged" % (agency, agenda['meeting_date'], len(item_ids), len(parsed_items)))
+	else:
+		print(json.dumps(json_agenda, indent=4))
 
-	writeAgendaListToDisk(agency, agenda_list)
+	line_structurer.writeJSONtoDisk(json_agenda, agency, json_agenda['meeting_date'], clean_title)
 
-	return agenda_list
+	agenda['parsed'] = True
+	agenda['outline_fingerprint'] = outline_fingerprint
+	agenda['item_fingerprints'] = item_fingerprints
 
 
 
@@ -70,25 +153,135 @@ def loadAgendaList(agency):
 
 
 
+'''
+isRefreshDue
+============
+Check if a parsed agenda's meeting is recent or upcoming enough that it might still be amended.
+'''
+def isRefreshDue(agenda, today=None):
+	if today is None:
+		today = datetime.date.today()
+
+	meeting_date = datetime.datetime.strptime(agenda['meeting_date'], "%m-%d-%Y").date()
+	return (today - meeting_date).days <= REFRESH_WINDOW_DAYS
+
+
+
+'''
+fingerprint
+===========
+Return a short hash of a page or a piece of one, to tell if it changed between fetches.
+'''
+def fingerprint(content):
+	if not isinstance(content, bytes):
+		content = content.encode('utf-8')
+	return hashlib.sha1(content).hexdigest()
+
+
+
+'''
+fingerprintOutlineItems
+=======================
+Given the html of an agenda page and its outline, fingerprint each item's entry in the outline
+(its title, type, order and attachments), which changes when the item is amended.
+Returns a dict mapping each item id to its fingerprint.
+'''
+def fingerprintOutlineItems(agenda_html, agenda_outline):
+	item_ids = set(item_id for section in agenda_outline for item_id in section['item_ids'])
+
+	item_fingerprints = dict()
+	agenda_tree = parseHTML(agenda_html)
+	if agenda_tree is not None:
+		for element in XPATH_IDENTIFIED_DIVS(agenda_tree):
+			if element.attrib['id'] in item_ids:
+				item_fingerprints[element.attrib['id']] = fingerprint(etree.tostring(element, encoding='utf-8', with_tail=False))
+
+	return item_fingerprints
+
+
+
+'''
+loadStructuredItems
+===================
+Given an agency, a meeting date, and a cleaned meeting title, load the items of the structured agenda already on disk.
+Returns a dict mapping each item's BoardDocs id to the item, empty if the agenda hasn't been written out.
+'''
+def loadStructuredItems(agency, date, meeting_title):
+	structured_filepath = line_structurer.structuredAgendaFilepath(agency, date, meeting_title)
+	if not os.path.exists(structured_filepath):
+		return dict()
+
+	with open(structured_filepath) as structured_file:
+		json_agenda = json.load(structured_file)
+
+	return dict((item['boarddocs_id'], item) for section in json_agenda['meeting_sections'] for item in section['items'] if 'boarddocs_id' in item)
+
+
+
 '''
 parseAgendaOutline
 ==============
 Given the BoardDocs code for an agency and a dict containing the agenda id,
-parse the agenda to extract section headings and item ids.
+parse the agenda to extract section headings and item ids. Fetches the agenda page unless its html is given.
 Return the JSON-formatted agenda outline.
 '''
-def parseAgendaOutline(agency, agency_code, agenda_info):
+def parseAgendaOutline(agency, agency_code, agenda_info, agenda_html=None):
+
+	# # get agenda (responses are cached on disk to avoid hammering the server)
+	if agenda_html is None:
+		agenda_id = agenda_info['boarddocs_id']
+		r = fetchURL(BOARDDOCS_URL % (agency_code, 'LT-GetAgenda'), params={'open': '', 'id': agenda_id})
+		agenda_html = r.content
+
+	if PARSE_ENGINE == "soup":
+		return parseOutlineSoup(agenda_html)
+	return parseOutlineHTML(agenda_html)
+
+
+
+'''
+parseOutlineHTML
+================
+Given the html of an agenda page, find each section heading and the ids of the items under it,
+with compiled XPath on the lxml tree.
+Return the agenda outline, the same as parseOutlineSoup.
+'''
+def parseOutlineHTML(agenda_html):
+
+	agenda_tree = parseHTML(agenda_html)
+	if agenda_tree is None:
+		return list()
+
+	# init json object
+	items_structure = list()
+
+	# extract each agenda section heading
+	for heading in XPATH_CATEGORY_HEADINGS(agenda_tree):
+		heading_text = elementString(XPATH_CATEGORY_NAME(heading)[0])
+		heading_id = heading.attrib['id']
 
-	agenda_id = agenda_info['boarddocs_id']
+		items_structure.append({'heading': heading_text, 'heading_id': heading_id, 'item_ids': []})
 
-	# # get agenda
-	r = requests.get('http://www.boarddocs.com/ca/' + agency_code + '/Board.nsf/LT-GetAgenda', params={'open': '', 'id': agenda_id})
-	agenda_soup = BeautifulSoup(r.content, "lxml")
+		# get items until next heading
+		heading_wrapper = XPATH_CATEGORY_WRAPPER(heading)[0]
+		for next_element in XPATH_FOLLOWING_DIVS(heading_wrapper):
+			if "wrap-category" in next_element.attrib['class'].split():
+				break
+			items_structure[-1]['item_ids'].append(next_element.attrib['id'])
+
+	return items_structure
+
+
+
+'''
+parseOutlineSoup
+================
+Given the html of an agenda page, find each section heading and the ids of the items under it with BeautifulSoup.
+Return the agenda outline.
+'''
+def parseOutlineSoup(agenda_html):
 
-	# write to disk to avoid hammering the server
-	# pickle.dump(r.content, open("../docs/" + agency + "/data/test_agenda_html.p", "wb" ))
-	# content = pickle.load(open("../docs/" + agency + "/data/test_agenda_html.p", "rb" ))
-	# agenda_soup = BeautifulSoup(content, "lxml")
+	agenda_soup = BeautifulSoup(agenda_html, "lxml")
 
 	# init json object
 	items_structure = list()
@@ -121,9 +314,17 @@ structureAgendaSection
 ======================
 Given a dict with info about an agenda section,
 generate a JSON-formatted dict with info on that section and its items.
+Uses the prefetched item pages if given, otherwise fetches the section's items concurrently.
+Items already in parsed_items are used as they are.
 Return the JSON object.
 '''
-def structureAgendaSection(agency, agency_code, section):
+def structureAgendaSection(agency, agency_code, section, item_pages=None, parsed_items=None):
+
+	if parsed_items is None:
+		parsed_items = dict()
+
+	if item_pages is None:
+		item_pages = fetchAgendaItems(agency_code, [item_id for item_id in section['item_ids'] if item_id not in parsed_items])
 
 	section_info = parseItemText(section['heading'], agency, True)
 
@@ -134,7 +335,10 @@ def structureAgendaSection(agency, agency_code, section):
 	}
 
 	for item_id in section['item_ids']:
-		json_section['items'].append(parseAgendaItem(agency, agency_code, item_id))
+		if item_id in parsed_items:
+			json_section['items'].append(parsed_items[item_id])
+		else:
+			json_section['items'].append(parseAgendaItem(agency, agency_code, item_id, item_pages.get(item_id)))
 
 	return json_section
 
@@ -144,18 +348,66 @@ def structureAgendaSection(agency, agency_code, section):
 parseAgendaItem
 ===============
 Given a board docs agency code and an item id, 
-parse that item into a structured dict. Return the dict.
+parse that item into a structured dict. Fetches the item page unless its html is given. Return the dict.
 '''
-def parseAgendaItem(agency, agency_code, item_id):
+def parseAgendaItem(agency, agency_code, item_id, item_html=None):
 
 	# get agenda item
-	r = requests.get('http://www.boarddocs.com/ca/' + agency_code + '/Board.nsf/LT-GetAgendaItem', params={'open': '', 'id': item_id})
-	item_soup = BeautifulSoup(r.content, "lxml")
+	if item_html is None:
+		item_html = fetchAgendaItems(agency_code, [item_id])[item_id]
+
+	if PARSE_ENGINE == "soup":
+		return parseItemSoup(agency, item_id, item_html)
+	return parseItemHTML(agency, item_id, item_html)
+
+
+
+'''
+parseItemHTML
+=============
+Given the html of an agenda item page, extract its number, text, details, type and recommendation
+with compiled XPath on the lxml tree. Return the dict, the same as parseItemSoup.
+'''
+def parseItemHTML(agency, item_id, item_html):
 
-	# write to disk to avoid hammering the server
-	# pickle.dump(r.content, open("../docs/" + agency + "/data/test_agenda_item_html.p", "wb" ))
-	# content = pickle.load(open("../docs/" + agency + "/data/test_agenda_item_html.p", "rb" ))
-	# item_soup = BeautifulSoup(content, "lxml")
+	item_tree = parseHTML(item_html)
+
+	item_content = { \
+		'item_number': '', \
+		'item_text_raw': '', \
+		'item_text': '', \
+		'item_details': '', \
+		'item_type': '', \
+		'item_recommendation': '',\
+		'boarddocs_id': item_id \
+	}
+
+	item_content['item_text_raw'] = ''.join(elementStrings(XPATH_ITEM_NAME(item_tree)[0]))
+	cleaned_text = parseItemText(item_content['item_text_raw'], agency, False)
+	item_content['item_number'] = cleaned_text['item_number']
+	item_content['item_text'] = cleaned_text['item_text']
+
+	# extract item details
+	details = ''.join(elementStrings(XPATH_ITEM_BODY(item_tree)[0]))
+	item_content['item_details'] = re.sub(r'[\n]+', '\n', details) # strip extra line breaks
+
+	# extract recommendation and item type, from the div after their headings
+	item_content['item_recommendation'] = findLabelledValue(item_tree, "Recommended Action", item_content['item_recommendation'])
+	item_content['item_type'] = findLabelledValue(item_tree, "Type", item_content['item_type'])
+
+	return item_content
+
+
+
+'''
+parseItemSoup
+=============
+Given the html of an agenda item page, extract its number, text, details, type and recommendation with BeautifulSoup.
+Return the dict.
+'''
+def parseItemSoup(agency, item_id, item_html):
+
+	item_soup = BeautifulSoup(item_html, "lxml")
 
 	item_content = { \
 		'item_number': '', \
@@ -190,6 +442,135 @@ def parseAgendaItem(agency, agency_code, item_id):
 
 
 
+'''
+fetchAgendaItems
+================
+Given a board docs agency code and a list of item ids,
+fetch the pages for all of the items concurrently over a shared keep-alive session.
+Cached pages older than max_age seconds (the cache's TTL if None) are revalidated.
+Return a dict mapping each item id to its page html.
+'''
+def fetchAgendaItems(agency_code, item_ids, max_age=None):
+
+	item_url = BOARDDOCS_URL % (agency_code, 'LT-GetAgendaItem')
+	responses = fetchAll([(item_url, {'open': '', 'id': item_id}) for item_id in item_ids], max_age=max_age)
+
+	return dict((item_id, r.content) for item_id, r in zip(item_ids, responses))
+
+
+
+'''
+parseHTML
+=========
+Parse a page's html into an lxml tree. Pages are decoded the way BeautifulSoup decodes them,
+so both engines see the same text.
+Returns the root element, or None if the page is empty.
+'''
+def parseHTML(html):
+	if isinstance(html, bytes):
+		try:
+			html = html.decode('utf-8')
+		except UnicodeDecodeError:
+			html = UnicodeDammit(html).unicode_markup
+
+	try:
+		return etree.HTML(html)
+	except ValueError:
+		# lxml won't take unicode with an xml encoding declaration
+		return etree.HTML(html.encode('utf-8'), etree.HTMLParser(encoding='utf-8'))
+
+
+
+'''
+elementString
+=============
+The text of an lxml element the way BeautifulSoup's .string finds it:
+the element's only text node, or the .string of its only child element. None if it has more than one child.
+'''
+def elementString(element):
+	children = list(element)
+	if element.text:
+		return soupText(element.text, preservesWhitespace(element)) if not children else None
+
+	if len(children) != 1 or children[0].tail:
+		return None
+	if isinstance(children[0], etree._Comment):
+		return children[0].text
+	return elementString(children[0])
+
+
+
+'''
+elementStrings
+==============
+Yield the text in an lxml element the way BeautifulSoup's .strings does: every text node under it,
+in document order, skipping comments.
+'''
+def elementStrings(element, preserve_whitespace=None):
+	if preserve_whitespace is None:
+		preserve_whitespace = preservesWhitespace(element)
+	elif element.tag in WHITESPACE_PRESERVING_TAGS:
+		preserve_whitespace = True
+
+	if element.text and isinstance(element.tag, str):
+		yield soupText(element.text, preserve_whitespace)
+
+	for child in element:
+		if isinstance(child.tag, str):
+			for text in elementStrings(child, preserve_whitespace):
+				yield text
+		if child.tail:
+			yield soupText(child.tail, preserve_whitespace)
+
+
+
+'''
+preservesWhitespace
+===================
+Check if an lxml element is, or is inside, a tag whose whitespace BeautifulSoup keeps.
+'''
+def preservesWhitespace(element):
+	return element.tag in WHITESPACE_PRESERVING_TAGS or any(ancestor.tag in WHITESPACE_PRESERVING_TAGS for ancestor in element.iterancestors())
+
+
+
+'''
+soupText
+========
+Given a text node from lxml, return it as BeautifulSoup stores it, with text that's all whitespace collapsed.
+'''
+def soupText(text, preserve_whitespace):
+	if preserve_whitespace or text.strip(WHITESPACE):
+		return text
+	return '\n' if '\n' in text else ' '
+
+
+
+'''
+findLabelledValue
+=================
+Find the first text on the page containing the label, like the "Type" heading on an item page,
+and return the .string of the div after the element holding it.
+Returns the default if the label or the div isn't there.
+'''
+def findLabelledValue(tree, label, default):
+	label_strings = XPATH_STRINGS_CONTAINING(tree, label=label)
+	if not label_strings:
+		return default
+
+	# a tail belongs to the element before it, so its parent is one level up
+	label_string = label_strings[0]
+	label_element = label_string.getparent()
+	if getattr(label_string, 'is_tail', False):
+		label_element = label_element.getparent()
+
+	value_divs = XPATH_FOLLOWING_DIVS(label_element)
+	if not value_divs:
+		return default
+	return elementString(value_divs[0])
+
+
+
 '''
 parseItemText
 =================
@@ -225,12 +606,14 @@ writeAgendaListToDisk
 =====================
 Given an agency and JSON-formatted agenda list,
 write out the list to disk.
+Writes to a temp file first so an interrupted write never leaves a truncated list behind.
 '''
 def writeAgendaListToDisk(agency, agenda_list):
 
 	agenda_list_filepath = "docs/" + agency + "/agenda_list.json"
-	with open(agenda_list_filepath, 'wb') as outfile:
+	with open(agenda_list_filepath + ".tmp", 'wb') as outfile:
 		json.dump(agenda_list, outfile, sort_keys = True, indent = 4, ensure_ascii=False)
+	os.rename(agenda_list_filepath + ".tmp", agenda_list_filepath)
 
 
 
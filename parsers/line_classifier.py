@@ -1,16 +1,73 @@
 import numpy as np
 import pprint
 import scipy
+from scipy import sparse
 import os
+import csv
+import pickle
+import hashlib
+from collections import Counter
+import time
+import sklearn
 import pandas as pd
 from sklearn import linear_model, svm, metrics, multiclass, cross_validation, preprocessing, grid_search, feature_extraction, ensemble, tree
-from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer, HashingVectorizer
 from sklearn.externals.six import StringIO
 import pydot
+import line_store
+import instrumentation
+import pdf_parser
 
 pp = pprint.PrettyPrinter(indent=4)
 pd.set_option('display.max_rows', 1000)
 
+# classes each line can be assigned
+CLASSES_LIST = ["meeting_heading", "section_heading", "item_heading", "item_text", "other_text"]
+
+# bump whenever trainModel changes the features or models it builds, to invalidate saved models
+MODEL_VERSION = 5
+
+# columns of the lines CSVs that aren't used directly as features
+NON_FEATURE_COLS = ['Unnamed: 0','line_id', 'meeting_date', 'text', 'font_name', 'first_char', 'font_size', 'left_inset', 'agency']
+
+# categorical columns to convert to dummy variables
+DUMMY_COLS = ['font_name', 'font_size', 'left_inset']
+
+# columns of the training CSVs that hold text or measurements. every other column is a 0/1 indicator,
+# and is loaded as uint8
+TRAINING_TEXT_COLS = ['line_id', 'meeting_date', 'text', 'first_char', 'agency']
+TRAINING_CATEGORY_COLS = ['font_name']
+TRAINING_MEASURE_COLS = ['font_size', 'left_inset']
+
+# number of lines to read at a time when streaming a training file
+TRAINING_CHUNK_LINES = 10000
+
+# settings for the vectorizer used to build the document-term matrix
+DTM_PARAMS = {'strip_accents': "ascii", 'ngram_range': (1,4), 'stop_words': 'english', 'max_df': 0.9, 'min_df': 4, 'binary': True}
+
+# how to turn the text of each line into features: "vocabulary" fits a CountVectorizer with DTM_PARAMS,
+# "hashed" hashes the n-grams into a fixed number of columns with HASHING_PARAMS, with no fit step or vocabulary to store
+TEXT_FEATURIZER = "vocabulary"
+
+# settings for the hashed featurizer. there's no vocabulary, so no max_df/min_df
+HASHING_PARAMS = {'strip_accents': "ascii", 'ngram_range': (1,4), 'stop_words': 'english', 'binary': True, 'n_features': 2 ** 18, 'norm': None}
+
+# estimators trainModel can fit, by name. evaluating a model compares all of them
+MODEL_REGISTRY = {
+	'log_regression': lambda: multiclass.OneVsRestClassifier(linear_model.LogisticRegressionCV(cv=5, penalty='l1', solver='liblinear', n_jobs=-1)),
+	'decision_tree': lambda: tree.DecisionTreeClassifier(class_weight="balanced"),
+	'random_forest': lambda: ensemble.RandomForestClassifier(n_estimators=30, n_jobs=-1, class_weight="balanced")
+}
+
+# the estimator used to classify agendas
+PRODUCTION_MODEL = 'random_forest'
+
+# max number of lines to stack into one feature matrix when classifying agendas in a batch
+MAX_BATCH_LINES = 200000
+
+# number of cores the model uses to predict a batch (-1 for all of them)
+PREDICT_JOBS = -1
+
 def main():
 
 	classifyAgendas("cupertino_usd", ["04-05-2016"], True)
@@ -20,24 +77,56 @@ def main():
 classifyAgendas
 ===============
 Given an agency and a list of agenda dates, classifies the lines in each agenda.
-Saves the classified lines out as CSVs.
+The agendas are classified in batches of up to MAX_BATCH_LINES lines, so the model predicts on a few large matrices
+instead of one small one per agenda.
+Saves the classified lines out to the line store.
 '''
 def classifyAgendas(agency, dates, eval_model):
 
-	classes_list = ["meeting_heading", "section_heading", "item_heading", "item_text", "other_text"]
+	classes_list = CLASSES_LIST
 
-	# build classification model
-	training_directory = "docs/" + agency + "/training_lines/"
-	model_pieces = trainModel(training_directory, classes_list, eval_model)
+	# build classification model, reusing the saved one unless the model is being evaluated
+	if eval_model:
+		training_directory = "docs/" + agency + "/training_lines/"
+		model_pieces = trainModel(training_directory, classes_list, eval_model)
+	else:
+		model_pieces = loadModel(agency, classes_list)
+
+	# predict on as many cores as the model can use
+	if hasattr(model_pieces['model'], 'n_jobs'):
+		model_pieces['model'].n_jobs = PREDICT_JOBS
+
+	start_time = time.time()
+	num_lines = 0
 
-	# loop through agendas for each date
+	# load agendas until the batch is full, then classify the whole batch at once
+	batch = list()
+	batch_lines = 0
 	for date in dates:
-		predict_filepath = "docs/" + agency + "/parsed_lines/" + agency + "_" + date + "_parsed_lines.csv"
-		classed_filepath = "docs/" + agency + "/classed_lines/" + agency + "_" + date + "_classed_lines.csv"
+		predict_filepath = line_store.findLinesFilepath(agency, date, "parsed_lines")
+		classed_filepath = line_store.linesFilepath(agency, date, "classed_lines")
 
 		print(predict_filepath)
 
-		classifyLines(model_pieces, predict_filepath, classed_filepath, classes_list)
+		input_df = line_store.readLines(predict_filepath)
+		batch.append((input_df, classed_filepath))
+		batch_lines += len(input_df)
+
+		if batch_lines >= MAX_BATCH_LINES:
+			classifyBatch(model_pieces, batch, classes_list)
+			num_lines += batch_lines
+			batch = list()
+			batch_lines = 0
+
+	if len(batch):
+		classifyBatch(model_pieces, batch, classes_list)
+		num_lines += batch_lines
+
+	instrumentation.addCount('agendas', len(dates))
+	instrumentation.addCount('lines', num_lines)
+
+	elapsed_time = time.time() - start_time
+	print("Classified %d lines from %d agendas in %.1fs (%.0f lines/sec)" % (num_lines, len(dates), elapsed_time, num_lines / max(elapsed_time, 1e-9)))
 
 
 
@@ -45,38 +134,41 @@ def classifyAgendas(agency, dates, eval_model):
 '''
 prepDatasets
 ============
-Given the path to a CSV file, convert it into an array of features, and (if y_col_name is set), to a 1-dimensional array of outcome indicators. Use the given vectorizer to create a DTM from the text.
+Given the path to a CSV file, convert it into a sparse (CSR) matrix of features, and (if y_col_name is set), to a 1-dimensional array of outcome indicators. Use the given vectorizer to create a DTM from the text.
+The feature columns, dummy encoder, and vectorizer are fit on the data when the outcomes are known, unless fit_features is False
+(when building the training set a chunk at a time, for instance). The feature names are only built when the features are fit
+(there are 2^18 of them with the hashed featurizer); otherwise None is returned in their place.
 Return the array(s).
 '''
-def prepDatasets(model_pieces, df, y_cols, know_outcomes):
+def prepDatasets(model_pieces, df, y_cols, know_outcomes, fit_features=None):
+
+	if fit_features is None:
+		fit_features = know_outcomes
 
 	# list of unwanted cols to drop
-	cols_to_drop = ['Unnamed: 0','line_id', 'meeting_date', 'text', 'font_name', 'first_char', 'font_size', 'left_inset', 'agency']
+	cols_to_drop = list(NON_FEATURE_COLS)
 	if know_outcomes:
 		cols_to_drop.extend(y_cols)
+	cols_to_drop = [col for col in cols_to_drop if col in df.columns]
 
-	# create feature array
-	x_df = df.drop(cols_to_drop, axis=1)
-	x_array = x_df.values
-
-	feature_names = x_df.columns.values
+	# create feature array, with the columns in the same order as the training set
+	if fit_features:
+		model_pieces['feature_cols'] = [col for col in df.columns if col not in cols_to_drop]
+	x_array = buildSparseColumns(df, model_pieces['feature_cols'])
 
 	# create dummy variables for categorical features
-	feature_dummies, model_pieces = convertFeaturesToDummyVariables(df, model_pieces, know_outcomes)
-	x_array = np.concatenate((x_array, feature_dummies), axis=1)
-	feature_names = np.concatenate((feature_names, model_pieces['encoder'].feature_names_), axis=0)
+	feature_dummies, model_pieces = convertFeaturesToDummyVariables(df, model_pieces, fit_features)
 
-	# create document-term matrix
+	# create document-term matrix (the hashing vectorizer is stateless, so fitting it doesn't change it)
 	df['text'].fillna('', inplace=True)
-	if know_outcomes:
+	if fit_features:
 		counts_matrix = model_pieces['vect'].fit_transform(df['text'])
 	else:
 		counts_matrix = model_pieces['vect'].transform(df['text'])
 	
-	# merge DTM with feature array
-	x_array = np.concatenate((x_array, counts_matrix.toarray()), axis=1)
-	dtm_feature_names = [f.encode('ascii', 'ignore') for f in model_pieces['vect'].get_feature_names()]
-	feature_names = np.concatenate((feature_names, dtm_feature_names), axis=0)
+	# merge dummies and DTM with feature array, keeping everything sparse
+	x_array = sparse.hstack((x_array, feature_dummies, counts_matrix), format='csr')
+	feature_names = getFeatureNames(model_pieces) if fit_features else None
 
 	# create list to return x and y arrays in
 	data_arrays = [x_array]
@@ -96,23 +188,94 @@ def prepDatasets(model_pieces, df, y_cols, know_outcomes):
 
 
 
+'''
+buildSparseColumns
+==================
+Given a dataframe and a list of columns, build a sparse (CSR) matrix of those columns one at a time,
+so the frame is never copied into one dense array, and the values keep the columns' own dtypes (upcast only as far as they need).
+Columns missing from the frame are left empty.
+Returns the CSR matrix.
+'''
+def buildSparseColumns(df, columns):
+	rows = [np.zeros(0, dtype=np.int64)]
+	cols = [np.zeros(0, dtype=np.int64)]
+	values = [np.zeros(0, dtype=np.uint8)]
+
+	for col_index, col in enumerate(columns):
+		if col not in df.columns:
+			continue
+		col_values = df[col].values
+		nonzero_rows = np.flatnonzero(col_values)
+		rows.append(nonzero_rows)
+		cols.append(np.full(len(nonzero_rows), col_index, dtype=np.int64))
+		values.append(col_values[nonzero_rows])
+
+	return sparse.coo_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))), shape=(len(df), len(columns))).tocsr()
+
+
+
+'''
+makeTextVectorizer
+==================
+Build the vectorizer for the text of each line, as set by TEXT_FEATURIZER.
+Returns the (unfitted) vectorizer.
+'''
+def makeTextVectorizer(featurizer=TEXT_FEATURIZER):
+	if featurizer == "hashed":
+		return makeHashingVectorizer()
+	return CountVectorizer(**DTM_PARAMS)
+
+
+
+'''
+makeHashingVectorizer
+=====================
+Build a HashingVectorizer with HASHING_PARAMS that only produces non-negative counts
+(older versions of sklearn call the option non_negative instead of alternate_sign).
+'''
+def makeHashingVectorizer():
+	try:
+		return HashingVectorizer(alternate_sign=False, **HASHING_PARAMS)
+	except TypeError:
+		return HashingVectorizer(non_negative=True, **HASHING_PARAMS)
+
+
+
+'''
+getFeatureNames
+===============
+Given fitted model pieces, name each column of the feature matrix prepDatasets builds:
+the line's own columns, the dummy variables, and the n-grams of the DTM (or the hashed columns, which have no names of their own).
+Returns an array of the names.
+'''
+def getFeatureNames(model_pieces):
+	if isinstance(model_pieces['vect'], HashingVectorizer):
+		dtm_feature_names = ['hash_%d' % i for i in range(model_pieces['vect'].n_features)]
+	else:
+		dtm_feature_names = [f.encode('ascii', 'ignore') for f in model_pieces['vect'].get_feature_names()]
+
+	return np.concatenate((np.array(model_pieces['feature_cols'], dtype=object), model_pieces['encoder'].feature_names_, dtm_feature_names), axis=0)
+
+
+
 '''
 trainModel
 ==========
 Use the training file to build a model that classifies each line as
 one of the inputted classes.
+Normally fits only the named estimator from MODEL_REGISTRY. If eval_model is True, holds out a test set,
+fits and scores every estimator in the registry, and exports the decision tree.
 Returns the fitted model.
 '''
-def trainModel(training_directory, classes_list, eval_model):
-	training_df = buildTrainingDataset(training_directory)
+def trainModel(training_directory, classes_list, eval_model, model_name=PRODUCTION_MODEL):
 
 	# create a DTM vectorizer and dummy encoder object for use later
 	model_pieces = dict()
-	model_pieces['vect'] = CountVectorizer(strip_accents="ascii", ngram_range=(1,4), stop_words='english', max_df=0.9, min_df=4, binary=True)
-	model_pieces['encoder'] = feature_extraction.DictVectorizer(sparse=False)
+	model_pieces['vect'] = makeTextVectorizer()
+	model_pieces['encoder'] = feature_extraction.DictVectorizer(sparse=True)
 	
-	# create datasets from the input file
-	datasets, model_pieces = prepDatasets(model_pieces, training_df, classes_list, True)
+	# create datasets from the training files, a chunk at a time
+	datasets, model_pieces = buildTrainingMatrix(training_directory, model_pieces, classes_list)
 	X = datasets[0]
 	y = datasets[1]
 
@@ -120,105 +283,385 @@ def trainModel(training_directory, classes_list, eval_model):
 	# interactor = preprocessing.PolynomialFeatures(interaction_only=True)
 	# X = interactor.fit_transform(X)
 
-	# split into training and validation sets if eval_model is True
-	if eval_model:
-		X_train, X_test, y_train, y_test = cross_validation.train_test_split(X, y, test_size=0.33, stratify=y)
-	else:
-		X_train = X
-		y_train = y
+	model_pieces['model_name'] = model_name
 
-	## LOG REGRESSION
+	if not eval_model:
+		model_pieces['model'] = MODEL_REGISTRY[model_name]()
+		model_pieces['model'].fit(X, y)
+		return model_pieces
 
-	# # train classifier
-	model_pieces['model'] = multiclass.OneVsRestClassifier(linear_model.LogisticRegressionCV(cv=5, penalty='l1', solver='liblinear', n_jobs=-1))
-	model_pieces['model'].fit(X_train, y_train)
+	# split into training and validation sets
+	X_train, X_test, y_train, y_test = cross_validation.train_test_split(X, y, test_size=0.33, stratify=y)
 
-	if eval_model:
-		log_pred_classes = model_pieces['model'].predict(X_test)
-		print(model_pieces['model'].coef_)
-	
-		print(metrics.accuracy_score(y_test, log_pred_classes))
-		print(metrics.classification_report(y_test, log_pred_classes))
-		print(metrics.confusion_matrix(y_test, log_pred_classes))
+	# fit and score each estimator
+	for estimator_name in sorted(MODEL_REGISTRY):
+		print(estimator_name)
+		estimator = MODEL_REGISTRY[estimator_name]()
+		estimator.fit(X_train, y_train)
+
+		pred_classes = estimator.predict(X_test)
+		print(metrics.accuracy_score(y_test, pred_classes))
+		print(metrics.classification_report(y_test, pred_classes))
+		print(metrics.confusion_matrix(y_test, pred_classes))
+
+		if estimator_name == 'log_regression':
+			print(estimator.coef_)
+		elif estimator_name == 'decision_tree':
+			exportTree(estimator, datasets[2], "tree.pdf")
+		elif estimator_name == 'random_forest':
+			rf_features = pd.DataFrame({'feature': datasets[2], 'importance': estimator.feature_importances_ })
+			# print(rf_features[rf_features['importance'] > 0].sort_values('importance', ascending=False))
+
+		if estimator_name == model_name:
+			model_pieces['model'] = estimator
+
+	return model_pieces
 
-	# try a tree
-	dtc = tree.DecisionTreeClassifier(class_weight="balanced")
-	dtc.fit(X_train, y_train)
+
+
+'''
+buildTrainingMatrix
+===================
+Given a training directory and unfitted model pieces, build the features and outcomes of the whole training set
+without ever loading it as one dataframe. The training files are read a chunk at a time, twice: the first pass fits the
+feature columns, dummy encoder, and vectorizer, keeping only the chunks' text and distinct font values, and the second
+builds each chunk's sparse features with them and stacks them. The model still needs the whole sparse matrix to fit.
+Returns the same [datasets, model_pieces] as prepDatasets.
+'''
+def buildTrainingMatrix(training_directory, model_pieces, classes_list):
+	indent_buckets = loadIndentBuckets(training_directory)
+	cols_to_drop = set(NON_FEATURE_COLS + classes_list)
+
+	# fit the features on every chunk
+	feature_cols = list()
+	dummy_dfs = list()
+	texts = list()
+	for chunk_df in iterTrainingLines(training_directory, indent_buckets):
+		new_cols = [col for col in chunk_df.columns if col not in cols_to_drop and col not in feature_cols]
+		feature_cols.extend(new_cols)
+		cols_to_drop.update(new_cols)
+		dummy_dfs.append(getDummyValues(chunk_df).drop_duplicates())
+		texts.extend(chunk_df['text'].fillna(''))
+
+	model_pieces['feature_cols'] = feature_cols
+	model_pieces['encoder'].fit(pd.concat(dummy_dfs, ignore_index=True).drop_duplicates().to_dict(orient='records'))
+	model_pieces['vect'].fit(texts)
+	del texts
+
+	# build each chunk's features with them
+	x_arrays = list()
+	y_arrays = list()
+	for chunk_df in iterTrainingLines(training_directory, indent_buckets):
+		datasets, model_pieces = prepDatasets(model_pieces, chunk_df, classes_list, True, fit_features=False)
+		x_arrays.append(datasets[0])
+		y_arrays.append(datasets[1])
+
+	return [[sparse.vstack(x_arrays, format='csr'), pd.concat(y_arrays, ignore_index=True), getFeatureNames(model_pieces)], model_pieces]
+
+
+
+'''
+iterTrainingLines
+=================
+Given a training directory and its indentation buckets, yield the lines of each training CSV in turn,
+a chunk at a time, with their indentation features rebuilt by prepTrainingLines.
+'''
+def iterTrainingLines(training_directory, indent_buckets):
+	for filename in sorted(os.listdir(training_directory)):
+		if filename.endswith(".csv"):
+			for chunk_df in iterTrainingChunks(os.path.join(training_directory, filename)):
+				yield prepTrainingLines(chunk_df, indent_buckets)
+
+
+
+'''
+exportTree
+==========
+Render a fitted decision tree to a PDF with graphviz, to see which features it splits on.
+'''
+def exportTree(dtc, feature_names, output_filepath):
 	dot_data = StringIO() 
 	tree.export_graphviz(dtc, out_file=dot_data,
 		special_characters=True,
 		class_names=dtc.classes_,
 		impurity=False,
-		feature_names=datasets[2]
+		feature_names=feature_names
 		) 
 	graph = pydot.graph_from_dot_data(dot_data.getvalue()) 
-	graph.write_pdf("tree.pdf") 
+	graph.write_pdf(output_filepath) 
 
-	if eval_model:
-		dtc_pred_classes = dtc.predict(X_test)
-	
-		print(metrics.accuracy_score(y_test, dtc_pred_classes))
-		print(metrics.classification_report(y_test, dtc_pred_classes))
-		print(metrics.confusion_matrix(y_test, dtc_pred_classes))
 
-	# try a random forest
-	rf = ensemble.RandomForestClassifier(n_estimators=30, n_jobs=-1, class_weight="balanced")
-	rf.fit(X_train, y_train)
-	model_pieces['model'] = rf
-	rf_features = pd.DataFrame({'feature': datasets[2], 'importance': rf.feature_importances_ })
-	# print(rf_features[rf_features['importance'] > 0].sort_values('importance', ascending=False))
 
-	if eval_model:
-		rf_pred_classes = rf.predict(X_test)
-		
-		print(metrics.accuracy_score(y_test, rf_pred_classes))
-		print(metrics.classification_report(y_test, rf_pred_classes))
-		print(metrics.confusion_matrix(y_test, rf_pred_classes))
+'''
+loadModel
+=========
+Given an agency, load its saved classification model if it was built from the current training set.
+Otherwise train a new model and save it to the agency's data directory.
+Returns the fitted model pieces.
+'''
+def loadModel(agency, classes_list):
 
+	training_directory = "docs/" + agency + "/training_lines/"
+	model_filepath = "docs/" + agency + "/data/line_classifier_model.p"
+	model_key = getModelKey(training_directory, classes_list)
+
+	# try the saved model
+	if os.path.exists(model_filepath):
+		try:
+			with open(model_filepath, 'rb') as model_file:
+				saved_model = pickle.load(model_file)
+			if saved_model['model_key'] == model_key:
+				print("Using saved model %s" % model_filepath)
+				return saved_model['model_pieces']
+		except Exception as e:
+			print("Could not load saved model %s: %s" % (model_filepath, e))
+
+	# otherwise retrain
+	model_pieces = trainModel(training_directory, classes_list, False)
+	model_pieces['model_key'] = model_key
+	writeModelToDisk(model_filepath, model_key, model_pieces)
 
 	return model_pieces
 
 
 
+'''
+getModelKey
+===========
+Given the training directory, build a key identifying the model that trainModel would fit:
+a hash of the training CSV contents, the feature settings (including the agency's indentation buckets), the production estimator,
+and the model and library versions.
+Returns the key as a hex string.
+'''
+def getModelKey(training_directory, classes_list):
+
+	key_hash = hashlib.sha1()
+
+	# feature schema
+	schema = [MODEL_VERSION, sklearn.__version__, PRODUCTION_MODEL, classes_list, NON_FEATURE_COLS, DUMMY_COLS, TEXT_FEATURIZER, sorted(DTM_PARAMS.items()), sorted(HASHING_PARAMS.items()), \
+		sorted(loadIndentBuckets(training_directory).items())]
+	key_hash.update(repr(schema).encode('utf-8'))
+
+	# training set contents, in the order they are loaded
+	for filename in sorted(os.listdir(training_directory)):
+		if filename.endswith(".csv"):
+			with open(os.path.join(training_directory, filename), 'rb') as training_file:
+				key_hash.update(training_file.read())
+
+	return key_hash.hexdigest()
+
+
+
+'''
+writeModelToDisk
+================
+Pickle the fitted model pieces along with their key.
+Writes to a temp file first so a crash never leaves a half-written model behind.
+'''
+def writeModelToDisk(model_filepath, model_key, model_pieces):
+
+	temp_filepath = model_filepath + ".tmp"
+	with open(temp_filepath, 'wb') as model_file:
+		pickle.dump({'model_key': model_key, 'model_pieces': model_pieces}, model_file, pickle.HIGHEST_PROTOCOL)
+	os.rename(temp_filepath, model_filepath)
+
+
+
 '''
 buildTrainingDataset
 ======================
 Given a directory path, load all the csv files in that directory as pandas
 dataframes, and merge them together.
+Indicator columns are loaded as uint8 and font names as categories, and the stray index column is skipped.
+Pass a list of columns to load only those.
 '''
-def buildTrainingDataset(directory_path):
+def buildTrainingDataset(directory_path, columns=None):
 	df_list = list()
 	for filename in os.listdir(directory_path):
 		if filename.endswith(".csv"):
 			filepath = os.path.join(directory_path, filename)
-			df = pd.read_csv(open(filepath,'rU'), sep = ',', header = 0)
-			df_list.append(df)
+			df_list.append(readTrainingFile(filepath, columns))
+
+	df = pd.concat(df_list, ignore_index=True)
 
-	return pd.concat(df_list, ignore_index=True) 
+	# indicators missing from some of the files come back as NaNs, and categories that differ between files as objects
+	upcast_cols = [col for col in df.columns if isIndicatorColumn(col) and df[col].dtype != np.uint8]
+	if len(upcast_cols):
+		df[upcast_cols] = df[upcast_cols].fillna(0).astype(np.uint8)
+	for col in TRAINING_CATEGORY_COLS:
+		if col in df.columns:
+			df[col] = df[col].astype('category')
+
+	return df
+
+
+
+'''
+loadIndentBuckets
+=================
+Given a training directory, load the indentation buckets of its agency's layout profile, so the training lines are bucketed
+the same way as the lines they're used to classify. If the profile's buckets aren't frozen yet, they're learned from the
+training lines themselves (without saving them); the model key changes once parsing freezes them, so the model is retrained then.
+Returns the dict from indentation to bucket.
+'''
+def loadIndentBuckets(training_directory):
+	agency = os.path.basename(os.path.dirname(os.path.normpath(training_directory)))
+	layout_profile = pdf_parser.loadLayoutProfile(agency)
+
+	if layout_profile['indent_buckets'] is None:
+		for filename in sorted(os.listdir(training_directory)):
+			if filename.endswith(".csv"):
+				left_insets = readTrainingFile(os.path.join(training_directory, filename), ['left_inset'])['left_inset']
+				pdf_parser.updateLayoutProfile(layout_profile, filename, left_insets.map(round))
+
+	return pdf_parser.getIndentBuckets(layout_profile)
+
+
+
+'''
+prepTrainingLines
+=================
+Given training lines, rebuild their indentation features the way the parser now builds them:
+left insets rounded to whole points, and buckets from the agency's layout profile rather than ranked within each document.
+Returns the updated dataframe.
+'''
+def prepTrainingLines(training_df, indent_buckets):
+	training_df['left_inset'] = training_df['left_inset'].map(round)
+	training_df = pdf_parser.bucketLeftIndentation(training_df, indent_buckets)
+
+	bucket_cols = ['indent_bucket_%d' % bucket for bucket in range(6)]
+	training_df[bucket_cols] = training_df[bucket_cols].astype(np.uint8)
+
+	return training_df
+
+
+
+'''
+iterTrainingChunks
+==================
+Given the path to a training CSV, yield its lines as dataframes of up to chunk_lines lines,
+with the same compact dtypes as buildTrainingDataset.
+A file with blank indicator cells is loaded whole by readTrainingFile from the first chunk that has one.
+'''
+def iterTrainingChunks(filepath, chunk_lines=TRAINING_CHUNK_LINES, columns=None):
+	usecols, dtypes = getTrainingFileSchema(filepath, columns)
+	num_lines = 0
+	try:
+		for chunk_df in pd.read_csv(filepath, sep = ',', header = 0, usecols=usecols, dtype=dtypes, chunksize=chunk_lines):
+			num_lines += len(chunk_df)
+			yield chunk_df
+	except ValueError:
+		training_df = readTrainingFile(filepath, columns)
+		for chunk_start in range(num_lines, len(training_df), chunk_lines):
+			yield training_df.iloc[chunk_start:chunk_start + chunk_lines].copy()
+
+
+
+'''
+readTrainingFile
+================
+Given the path to a training CSV, load it with compact dtypes.
+Files with blank indicator cells can't be read straight into uint8, so those are filled in with 0s after loading.
+Returns the dataframe.
+'''
+def readTrainingFile(filepath, columns=None):
+	usecols, dtypes = getTrainingFileSchema(filepath, columns)
+	try:
+		return pd.read_csv(filepath, sep = ',', header = 0, usecols=usecols, dtype=dtypes)
+	except ValueError:
+		indicator_cols = [col for col in usecols if isIndicatorColumn(col)]
+		dtypes = dict((col, dtype) for col, dtype in dtypes.items() if col not in indicator_cols)
+		df = pd.read_csv(filepath, sep = ',', header = 0, usecols=usecols, dtype=dtypes)
+		df[indicator_cols] = df[indicator_cols].fillna(0).astype(np.uint8)
+		return df
+
+
+
+'''
+getTrainingFileSchema
+=====================
+Given the path to a training CSV, read its header and pick the columns to load and their dtypes.
+Returns a tuple of the list of columns and the dict of dtypes.
+'''
+def getTrainingFileSchema(filepath, columns=None):
+	with open(filepath) as training_file:
+		header = next(csv.reader(training_file))
+
+	# rename repeated columns the way pandas does (an n-gram can share its name with a text column)
+	seen_cols = Counter()
+	for i, col in enumerate(header):
+		seen_cols[col] += 1
+		if seen_cols[col] > 1:
+			header[i] = "%s.%d" % (col, seen_cols[col] - 1)
+
+	# unnamed columns are written by to_csv's index
+	usecols = [col for col in header if col != '' and not col.startswith('Unnamed: ') and (columns is None or col in columns)]
+
+	dtypes = dict()
+	for col in usecols:
+		if col in TRAINING_TEXT_COLS:
+			dtypes[col] = object
+		elif col in TRAINING_CATEGORY_COLS:
+			dtypes[col] = 'category'
+		elif col in TRAINING_MEASURE_COLS:
+			dtypes[col] = np.float64
+		elif isIndicatorColumn(col):
+			dtypes[col] = np.uint8
+
+	return (usecols, dtypes)
+
+
+
+'''
+isIndicatorColumn
+=================
+Returns true if a training CSV column holds a 0/1 indicator.
+'''
+def isIndicatorColumn(col):
+	return col not in TRAINING_TEXT_COLS and col not in TRAINING_CATEGORY_COLS and col not in TRAINING_MEASURE_COLS and not col.startswith('Unnamed: ')
 
 
 
 '''
 classifyLines
 =============
-Given a model, an input filepath, and an output filepath, predicts
-the classifications of each line in the input file, and writes out a version 
-of the file with the classifications.
+Given the path to a file of parsed lines, classify each line and write out the classified lines.
 '''
 def classifyLines(model_pieces, input_filepath, output_filepath, classes_list):
+	classifyBatch(model_pieces, [(line_store.readLines(input_filepath), output_filepath)], classes_list)
+
+
+
+'''
+classifyBatch
+=============
+Given a list of (lines dataframe, output filepath) tuples, stack the lines of every agenda into one feature matrix,
+predict them all at once, then split the predictions back out and write out each agenda's classified lines.
+'''
+def classifyBatch(model_pieces, batch, classes_list):
 
-	input_df = pd.read_csv(input_filepath, sep = ',', header = 0)
+	# stack the agendas (concat copies them, so prepDatasets converting some columns to strings doesn't touch the originals)
+	input_dfs = [input_df for input_df, output_filepath in batch]
+	stacked_df = pd.concat(input_dfs, ignore_index=True)
 
-	# create datasets from the input file
-	datasets, model_pieces = prepDatasets(model_pieces, input_df, classes_list, False)
-	X_predict = datasets[0]
+	if len(stacked_df):
+		# create datasets from the stacked lines
+		datasets, model_pieces = prepDatasets(model_pieces, stacked_df, classes_list, False)
+		X_predict = datasets[0]
 
-	# predict classes
-	preds = model_pieces['model'].predict(X_predict)
-	input_df['line_class'] = preds
+		# predict classes
+		preds = model_pieces['model'].predict(X_predict)
+	else:
+		preds = np.array([])
 
-	# write out predicted df to csv
-	input_df.to_csv(output_filepath, index=False)
+	# split the predictions back out, in the same order the agendas were stacked
+	offset = 0
+	for input_df, output_filepath in batch:
+		input_df['line_class'] = preds[offset:offset + len(input_df)]
+		offset += len(input_df)
+
+		# write out predicted df
+		line_store.writeLines(input_df, output_filepath)
 
 
 
@@ -229,13 +672,8 @@ Converts categorical features to dummy variables.
 '''
 def convertFeaturesToDummyVariables(df, model_pieces, know_outcomes):
 
-	# convert numeric (but really categorical) variables to strings
-	df['font_size'] = df['font_size'].astype(str)
-	df['left_inset'] = df['left_inset'].astype(str)
-
 	# create dict from categorical columns
-	cols_to_create_dummies = ['font_name', 'font_size', 'left_inset']
-	to_dummies_dict = df[cols_to_create_dummies].to_dict(orient='records')
+	to_dummies_dict = getDummyValues(df).to_dict(orient='records')
 
 	# encode variables
 	if know_outcomes:
@@ -247,6 +685,19 @@ def convertFeaturesToDummyVariables(df, model_pieces, know_outcomes):
 
 
 
+'''
+getDummyValues
+==============
+Converts the numeric (but really categorical) dummy columns to strings.
+Returns the dummy columns.
+'''
+def getDummyValues(df):
+	df['font_size'] = df['font_size'].astype(str)
+	df['left_inset'] = df['left_inset'].astype(str)
+	return df[DUMMY_COLS]
+
+
+
 
 
 
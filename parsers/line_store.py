@@ -0,0 +1,224 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+'''
+A compact, typed storage format for the line records passed between pipeline stages.
+Each agenda's lines are saved as a compressed .npz archive with one NumPy array per column:
+0/1 indicator columns as uint8, other numbers as int64/float64, and text as a buffer of utf-8 bytes plus row offsets.
+Columns are read lazily, so a stage only loads the columns it asks for.
+'''
+
+def main():
+
+	# convert the existing CSV corpora for every agency (or just the agencies given)
+	agencies = sys.argv[1:] or sorted(os.listdir("docs"))
+	for agency in agencies:
+		num_converted = convertCSVCorpus(agency)
+		print("%s: converted %d files" % (agency, num_converted))
+
+
+
+'''
+linesFilepath
+=============
+Given an agency, a date, and a stage ("parsed_lines" or "classed_lines"),
+return the path of the stored lines for that agenda.
+'''
+def linesFilepath(agency, date, stage):
+	return "docs/" + agency + "/" + stage + "/" + agency + "_" + date + "_" + stage + ".npz"
+
+
+
+'''
+writeLines
+==========
+Given a dataframe of lines and a filepath, write the lines out as one typed array per column.
+Writes to a temp file first so a crash never leaves a half-written file behind.
+'''
+def writeLines(df, filepath):
+
+	arrays = dict()
+	for col in df.columns:
+		col = unicodeString(col)
+		if df[col].dtype.kind not in 'biuf':
+			arrays['col_' + col], arrays['offsets_' + col] = textColumnToArrays(df[col])
+		else:
+			arrays['col_' + col] = numberColumnToArray(df[col])
+
+	# keep the column order
+	arrays['columns'] = np.array([unicodeString(col) for col in df.columns], dtype='U')
+
+	with open(filepath + ".tmp", 'wb') as outfile:
+		np.savez_compressed(outfile, **arrays)
+	os.rename(filepath + ".tmp", filepath)
+
+
+
+'''
+readLines
+=========
+Given a filepath, load the stored lines as a dataframe. If columns is set, only those columns are read.
+Legacy CSV files are read with pandas, passing csv_options through to read_csv.
+'''
+def readLines(filepath, columns=None, **csv_options):
+
+	if filepath.endswith(".csv"):
+		return pd.read_csv(filepath, sep = ',', header = 0, usecols=columns, **csv_options)
+
+	lines_file = np.load(filepath)
+	try:
+		stored_columns = list(lines_file['columns'])
+		if columns is None:
+			columns = stored_columns
+		else:
+			columns = [col for col in stored_columns if col in columns]
+
+		df = pd.DataFrame(dict((col, readColumn(lines_file, col)) for col in columns), columns=columns)
+	finally:
+		lines_file.close()
+
+	return df
+
+
+
+'''
+readManyLines
+=============
+Given a list of filepaths, load and stack the lines from all of them into one dataframe.
+'''
+def readManyLines(filepaths, columns=None, **csv_options):
+	return pd.concat([readLines(filepath, columns, **csv_options) for filepath in filepaths], ignore_index=True)
+
+
+
+'''
+findLinesFilepath
+=================
+Given an agency, a date, and a stage, return the path of the stored lines,
+falling back to the legacy CSV if the agenda hasn't been converted yet.
+'''
+def findLinesFilepath(agency, date, stage):
+	filepath = linesFilepath(agency, date, stage)
+	csv_filepath = filepath[:-len(".npz")] + ".csv"
+	if not os.path.exists(filepath) and os.path.exists(csv_filepath):
+		return csv_filepath
+	return filepath
+
+
+
+'''
+readColumn
+==========
+Given an open .npz file and a column name, load that column's values.
+'''
+def readColumn(lines_file, col):
+
+	values = lines_file['col_' + col]
+	if ('offsets_' + col) not in lines_file.files:
+		return values
+
+	# text columns are a single buffer of utf-8 bytes, split up by the row offsets
+	text_buffer = values.tobytes()
+	offsets = lines_file['offsets_' + col]
+	return np.array([text_buffer[offsets[i]:offsets[i+1]].decode('utf-8') for i in range(len(offsets) - 1)], dtype=object)
+
+
+
+'''
+textColumnToArrays
+==================
+Convert a text column to a buffer of utf-8 bytes and the offsets where each row starts.
+Missing values are stored as empty strings.
+'''
+def textColumnToArrays(series):
+
+	encoded_values = [unicodeString(value).encode('utf-8') for value in series.fillna('')]
+	offsets = np.cumsum([0] + [len(value) for value in encoded_values]).astype(np.int64)
+	text_buffer = np.frombuffer(b''.join(encoded_values), dtype=np.uint8)
+
+	return text_buffer, offsets
+
+
+
+'''
+numberColumnToArray
+===================
+Convert a numeric column to the most compact array that holds its values exactly.
+0/1 indicators become uint8, whole numbers stored as ints become int64, and everything else is left as is.
+'''
+def numberColumnToArray(series):
+
+	values = series.values
+	if len(values) == 0:
+		return values
+
+	is_int = values.dtype.kind in 'biu'
+	is_whole_float = values.dtype.kind == 'f' and not np.any(np.isnan(values)) and np.all(np.mod(values, 1) == 0)
+
+	if (is_int or is_whole_float) and values.min() >= 0 and values.max() <= 1:
+		return values.astype(np.uint8)
+	if is_int:
+		return values.astype(np.int64)
+
+	return values
+
+
+
+'''
+unicodeString
+=============
+Return a value as a unicode string, decoding utf-8 bytes.
+'''
+def unicodeString(value):
+	if isinstance(value, bytes):
+		return value.decode('utf-8')
+	if not isinstance(value, type(u'')):
+		return type(u'')(value)
+	return value
+
+
+
+'''
+convertCSVCorpus
+================
+Convert an agency's parsed_lines and classed_lines CSVs to stored lines, skipping files already converted.
+Returns the number of files converted.
+'''
+def convertCSVCorpus(agency):
+
+	num_converted = 0
+	for stage in ["parsed_lines", "classed_lines"]:
+		stage_dir = "docs/" + agency + "/" + stage + "/"
+		if not os.path.isdir(stage_dir):
+			continue
+
+		for filename in sorted(os.listdir(stage_dir)):
+			if filename.endswith(".csv") and not os.path.exists(stage_dir + filename[:-len(".csv")] + ".npz"):
+				convertCSVFile(stage_dir + filename)
+				num_converted += 1
+
+	return num_converted
+
+
+
+'''
+convertCSVFile
+==============
+Convert a single lines CSV to stored lines next to it, dropping the stray index column.
+Returns the path of the new file.
+'''
+def convertCSVFile(csv_filepath):
+
+	df = pd.read_csv(csv_filepath, sep = ',', header = 0)
+	df = df.drop([col for col in df.columns if col.startswith('Unnamed: ')], axis=1)
+
+	filepath = csv_filepath[:-len(".csv")] + ".npz"
+	writeLines(df, filepath)
+	return filepath
+
+
+
+if __name__ == '__main__':
+	main()
@@ -2,6 +2,27 @@ import csv
 import re
 import json
 import codecs
+import line_store
+import instrumentation
+
+# bump whenever a change to the structurer changes the JSON it builds, so agendas get restructured
+STRUCTURER_VERSION = 1
+
+# patterns for the section numbers at the start of section headings
+RE_SECTION_NUM_OR_LETTER = re.compile(r'\d+\.?\s+|[(]?[A-Za-z][.)]?\s+')
+RE_SECTION_ROMAN_NUMERAL = re.compile(r'(XC|XL|L?X{0,3})(IX|IV|V?I{0,3})')
+RE_SECTION_NUM_PUNCTUATION = re.compile(r'^\s?[.)]')
+
+# patterns for the item numbers at the start of item text
+RE_ITEM_NUM_OR_LETTER = re.compile(r'\d+[.)]?\s+|[(]?[A-Za-z][.)]?\s+')
+RE_ITEM_SUB_NUM = re.compile(r'\d+[\.]\d+\s+')
+RE_ITEM_NUM_LETTER = re.compile(r'\d+[\.][A-Za-z]\s+')
+RE_ITEM_NUM_PUNCTUATION = re.compile(r'^\s?[(]?[.)]')
+
+# leftovers to strip from the start of section names and item text
+RE_LEADING_STARS = re.compile(r'^[*]*')
+RE_LEADING_DOT = re.compile(r'^\.')
+RE_LEADING_DOTS_AND_PARENS = re.compile(r'^[.()]*')
 
 def main():
 
@@ -24,6 +45,9 @@ def structureLines(agency, date):
 	json_agenda = convertLinesToJSON(agency, date, lines)
 	json_agenda = cleanExtractJSON(json_agenda)
 
+	instrumentation.addCount('lines', len(lines))
+	instrumentation.addCount('items', sum(len(section['items']) for section in json_agenda['meeting_sections']))
+
 	# print(json.dumps(json_agenda, indent=4))
 
 	writeJSONtoDisk(json_agenda, agency, date, "meeting")
@@ -34,17 +58,21 @@ def structureLines(agency, date):
 loadLines
 =========
 Given an agency and a meeting date,
-load the classed lines CSV into a list of dicts
+load the classed lines into a list of dicts
 '''
 def loadLines(agency, date):
 	lines = list()
-	lines_filepath = "docs/" + agency + "/classed_lines/" + agency + "_" + date + "_classed_lines.csv"
+	lines_filepath = line_store.findLinesFilepath(agency, date, "classed_lines")
 	print(lines_filepath)
 
-	with open(lines_filepath) as lines_file:
-		lines_reader = csv.DictReader(lines_file)
-		for row in lines_reader:
-			lines.append(row)
+	# agendas classed before the line store existed are still CSVs
+	if lines_filepath.endswith(".csv"):
+		with open(lines_filepath) as lines_file:
+			lines_reader = csv.DictReader(lines_file)
+			for row in lines_reader:
+				lines.append(row)
+	else:
+		lines = line_store.readLines(lines_filepath, ["line_class", "text"]).to_dict(orient="records")
 
 	return lines
 
@@ -59,18 +87,14 @@ Return the number if one is found, False otherwise.
 def extractSectionNumber(line_text):
 
 	# try to find a section number
-	re_starts_num_or_letter = re.compile(r'\d+\.?\s+|[(]?[A-Za-z][.)]?\s+')
-	re_starts_roman_numeral = re.compile(r'(XC|XL|L?X{0,3})(IX|IV|V?I{0,3})')
-	if re_starts_num_or_letter.match(line_text) is not None:
-		raw_num_string = re_starts_num_or_letter.match(line_text).group()
-	elif re_starts_roman_numeral.match(line_text) is not None:
-		raw_num_string = re_starts_roman_numeral.match(line_text).group()
-	else:
+	num_match = RE_SECTION_NUM_OR_LETTER.match(line_text) or RE_SECTION_ROMAN_NUMERAL.match(line_text)
+	if num_match is None:
 		return False
+	raw_num_string = num_match.group()
 
 	# clean the section number
 	num_string = raw_num_string.strip() # remove whitespace
-	num_string = re.sub(r'^\s?[.)]', '', num_string) # remove dots and )
+	num_string = RE_SECTION_NUM_PUNCTUATION.sub('', num_string) # remove dots and )
 
 	return num_string
 
@@ -85,23 +109,17 @@ Return the number if one is found, False otherwise.
 def extractItemNumber(line_text):
 
 	# initial cleaning - strip whitespace and stars
-	line_text = re.sub(r'^[*]*', '', line_text).strip()
-
-	# regex options to try
-	re_starts_num_or_letter = re.compile(r'\d+[.)]?\s+|[(]?[A-Za-z][.)]?\s+')
-	re_starts_sub_num = re.compile(r'\d+[\.]\d+\s+')
-	re_starts_num_letter = re.compile(r'\d+[\.][A-Za-z]\s+')
+	line_text = RE_LEADING_STARS.sub('', line_text).strip()
 
 	# try to find a item number
-	if re_starts_num_or_letter.match(line_text) is not None:
-		raw_num_string = re_starts_num_or_letter.match(line_text).group()
-		raw_num_string = re.sub(r'^\s?[(]?[.)]', '', raw_num_string)
-	elif re_starts_sub_num.match(line_text) is not None:
-		raw_num_string = re_starts_sub_num.match(line_text).group()
-	elif re_starts_num_letter.match(line_text) is not None:
-		raw_num_string = re_starts_num_letter.match(line_text).group()
+	num_match = RE_ITEM_NUM_OR_LETTER.match(line_text)
+	if num_match is not None:
+		raw_num_string = RE_ITEM_NUM_PUNCTUATION.sub('', num_match.group())
 	else:
-		return False
+		num_match = RE_ITEM_SUB_NUM.match(line_text) or RE_ITEM_NUM_LETTER.match(line_text)
+		if num_match is None:
+			return False
+		raw_num_string = num_match.group()
 
 	# clean the section number
 	num_string = raw_num_string.strip() # remove whitespace
@@ -114,6 +132,7 @@ def extractItemNumber(line_text):
 convertLinesToJSON
 ==================
 Given a list of classified lines, convert them into a heirarchical JSON object.
+The text of each item is collected as a list of fragments and joined once all the lines are in.
 Return the object.
 '''
 def convertLinesToJSON(agency, date, lines):
@@ -121,6 +140,9 @@ def convertLinesToJSON(agency, date, lines):
 	# init active item flag
 	active_item = False
 
+	# the text fragments of every item, in order, to join at the end
+	items_fragments = list()
+
 	# init json object
 	json_agenda = {
 		"agency": agency, \
@@ -145,7 +167,9 @@ def convertLinesToJSON(agency, date, lines):
 			# make sure there is an existing meeting section, otherwise probably a misclassification
 			if len(json_agenda['meeting_sections']) > 0:
 
-				json_agenda["meeting_sections"][-1]["items"].append({"item_text_raw": line["text"], "item_number": ""})
+				item = {"item_text_raw": "", "item_number": ""}
+				json_agenda["meeting_sections"][-1]["items"].append(item)
+				items_fragments.append((item, [line["text"]]))
 
 				# set active_item flag
 				active_item = True
@@ -158,7 +182,7 @@ def convertLinesToJSON(agency, date, lines):
 		# additional lines of item text
 		elif line["line_class"] == "item_text":
 			if active_item:
-				json_agenda["meeting_sections"][-1]["items"][-1]["item_text_raw"] += (" " + line["text"])
+				items_fragments[-1][1].extend((" ", line["text"]))
 
 			else:
 				# throw warning
@@ -169,7 +193,11 @@ def convertLinesToJSON(agency, date, lines):
 			# ignore it unless there is an open agenda item, then explore it in more detail
 			if active_item:
 				if (i+1 < len(lines)) and (lines[i+1] == "item_text"): # if the next line is text, this is probably an empty line
-					json_agenda["meeting_sections"][-1]["items"][-1]["item_text_raw"] += "\n"
+					items_fragments[-1][1].append("\n")
+
+	# join each item's text
+	for item, item_fragments in items_fragments:
+		item["item_text_raw"] = "".join(item_fragments)
 
 	return json_agenda
 
@@ -193,7 +221,7 @@ def cleanExtractJSON(json_agenda):
 
 			# strip the section number from the section name
 			section_name = section_name.replace(section_number, "", 1)
-			section_name = re.sub(r'^\.', "", section_name) # remove any remaining dot at the start of the line
+			section_name = RE_LEADING_DOT.sub("", section_name) # remove any remaining dot at the start of the line
 
 		section_name = section_name.strip()
 		agenda_section["section_name"] = section_name
@@ -201,14 +229,14 @@ def cleanExtractJSON(json_agenda):
 		for item in agenda_section["items"]:
 
 			# try to extract the item number
-			item_text = re.sub(r'^[*]*', '', item["item_text_raw"]).strip()
+			item_text = RE_LEADING_STARS.sub('', item["item_text_raw"]).strip()
 			item_number = extractItemNumber(item_text)
 			if item_number:
 				item["item_number"] = item_number
 
 				# strip the item number from the item text
 				item_text = item_text.replace(item_number, "", 1)
-				item_text = re.sub(r'^[.()]*', "", item_text) # remove any remaining dots or parens at the start of the line
+				item_text = RE_LEADING_DOTS_AND_PARENS.sub("", item_text) # remove any remaining dots or parens at the start of the line
 
 			item_text = item_text.strip()
 			item["item_text"] = item_text
@@ -225,13 +253,23 @@ Given a JSON-formatted agenda object, an agency name, and a date,
 writes out the object to disk as JSON
 '''
 def writeJSONtoDisk(json_agenda, agency, date, meeting_title):
-	filepath = "docs/" + agency + "/structured_agendas/" + agency + "_" + date + "_" + meeting_title + "_agenda.json"
+	filepath = structuredAgendaFilepath(agency, date, meeting_title)
 
 	with codecs.open(filepath, 'w', encoding="utf-8") as outfile:
 		json.dump(json_agenda, outfile, sort_keys = True, indent = 4, ensure_ascii=True)
 
 
 
+'''
+structuredAgendaFilepath
+========================
+Given an agency, a meeting date, and a meeting title, return the path of the structured agenda JSON.
+'''
+def structuredAgendaFilepath(agency, date, meeting_title):
+	return "docs/" + agency + "/structured_agendas/" + agency + "_" + date + "_" + meeting_title + "_agenda.json"
+
+
+
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
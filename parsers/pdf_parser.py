@@ -3,14 +3,39 @@ import csv
 import pprint
 import os.path
 import pickle
+import traceback
+import multiprocessing
+from bisect import bisect_right
+import numpy as np
 import pandas as pd
 import pdfplumber
 from operator import itemgetter
 from collections import Counter
 from sklearn.feature_extraction.text import CountVectorizer
+import line_store
+import instrumentation
 
 pp = pprint.PrettyPrinter(indent=4)
 
+# bump whenever a change to the parser changes the lines it extracts, so agendas get reparsed
+PARSER_VERSION = 3
+
+# patterns for the formatting features, matched against the stripped text of each line
+RE_STARTS_NUM = re.compile(r'^\d{1,3}\.?\s+')
+RE_STARTS_SUBNUM = re.compile(r'^\d+[\.]\d+\s+')
+RE_STARTS_ROMAN_NUMERAL = re.compile(r'^(?:XC|XL|L?X{0,3})(?:IX|IV|V?I{0,3})\.\s+')
+RE_STARTS_ENUM_LETTER = re.compile(r'^[(]?[A-Za-z][).]?\s+')
+RE_INCLUDES_TIME = re.compile(r'[aA|pP].?[mM].?')
+
+# max number of pages of one agenda to hand to a single worker when parsing in parallel
+PAGES_PER_TASK = 10
+
+# an indentation needs to start at least this share of an agency's lines to get its own bucket
+MIN_INDENT_SHARE = 0.01
+
+# the pdfplumber object types the line builder reads. pages are filtered down to these before they're cropped
+PAGE_OBJECT_TYPES = ('char', 'line', 'rect')
+
 def main():
 
 	agency = "cupertino_usd"
@@ -24,14 +49,16 @@ parsePDFtoLines
 ===============
 Given an agency and a date, extract all the lines of the PDF,
 along with a set of features for each line to use in the line classifier.
-Write out a CSV file with the parsed lines and features.
+Write out the parsed lines and features.
 '''
 def parsePDFtoLines(agency, date, manual_classify):
 
 	filepath = "docs/" + agency + "/raw_pdfs/" + agency + "_" + date + ".pdf"
 
-	# list to hold all lines in the PDF
-	lines = extractLinesFromPDF(filepath, agency, date)
+	# list to hold all lines in the PDF, bucketed with the agency's layout profile (learned from this agenda if it's the first)
+	layout_profile = loadLayoutProfile(agency)
+	lines = extractLinesFromPDF(filepath, agency, date, layout_profile)
+	writeLayoutProfile(agency, layout_profile)
 
 	if manual_classify:
 		# manually classify lines to build training set
@@ -40,8 +67,8 @@ def parsePDFtoLines(agency, date, manual_classify):
 	# convert the lines to a pandas df
 	lines_df = pd.DataFrame(lines)
 
-	# write out the lines to disk as csv
-	writeDFtoCSV(lines_df, agency, date, manual_classify)
+	# write out the lines to disk
+	writeLinesToDisk(lines_df, agency, date, manual_classify)
 
 
 
@@ -49,31 +76,257 @@ def parsePDFtoLines(agency, date, manual_classify):
 extractLinesFromPDF
 ===================
 Uses PDFPlumber to open a PDF document and convert it into a list of dicts (one per line) containing that line's text and formatting information.
+If a layout profile is passed, its indentation buckets are used, learning them from this document if they aren't frozen yet.
 Returns the list of dicts.
 '''
-def extractLinesFromPDF(filepath, agency, date):
+def extractLinesFromPDF(filepath, agency, date, layout_profile=None):
 	print filepath
 	with pdfplumber.open(filepath) as pdf:
 
-		# init lines list
-		lines = list()
+		# convert every page to a list of lines with formatting
+		lines = extractPageLines(pdf, range(len(pdf.pages)), agency, date)
+
+		indent_buckets = None
+		if layout_profile is not None:
+			updateLayoutProfile(layout_profile, date, [line['left_inset'] for line in lines])
+			indent_buckets = getIndentBuckets(layout_profile)
+
+		lines_df = addDocumentFeatures(lines, agency, indent_buckets)
+		return lines_df.to_dict(orient='records')
+
+
+
+'''
+extractPageLines
+================
+Given an open PDF and a list of page indexes, crop each page and convert it into a list of line dicts.
+Each page's parsed objects are released once its lines are built, so memory doesn't grow with the length of the PDF.
+Returns the lines from all of the pages, in page order.
+'''
+def extractPageLines(pdf, page_indexes, agency, date):
+
+	# init lines list
+	lines = list()
+
+	# loop over pages
+	for page_index in page_indexes:
+		# parse the page, keeping only the objects the line builder needs
+		full_page = pdf.pages[page_index]
+		trimmed_page = trimPageObjects(full_page)
+
+		# index the page's drawn lines and rects once, for both cropping and rect exclusion
+		geometry = buildPageGeometry(trimmed_page)
+
+		# crop page
+		page = cropHeaderAndFooter(trimmed_page, page_index, geometry)
+
+		# convert to a list of lines with formatting
+		page_lines = getLinesWithFormatting(page, page_index, agency, date, geometry)
+		lines += page_lines
+
+		instrumentation.addCount('pages')
+		instrumentation.addCount('chars', len(page.chars))
+		instrumentation.addCount('lines', len(page_lines))
+
+		releasePage(full_page)
+
+	return lines
+
+
+
+'''
+trimPageObjects
+===============
+Parses a pdfplumber page and filters it down to the PAGE_OBJECT_TYPES with pdfplumber's page.filter,
+so cropping the page only has to clip chars, lines and rects, not curves, images and annotations.
+The full page still holds everything it parsed until it's released with releasePage.
+Returns the filtered page.
+'''
+def trimPageObjects(page):
+	trimmed_page = page.filter(lambda obj: obj['object_type'] in PAGE_OBJECT_TYPES)
+
+	# build the filtered objects once, up front, so the crop starts from them
+	trimmed_page.objects
+
+	return trimmed_page
+
+
+
+'''
+releasePage
+===========
+Frees the objects pdfplumber has cached for a page. The PDF keeps every page it has opened,
+so without this each page's chars stay in memory until the whole PDF is closed.
+'''
+def releasePage(page):
+	# newer versions of pdfplumber can release a page themselves
+	if hasattr(page, 'close'):
+		page.close()
+	elif hasattr(page, 'flush_cache'):
+		page.flush_cache()
+	else:
+		for cached_attribute in ('_objects', '_layout'):
+			if hasattr(page, cached_attribute):
+				delattr(page, cached_attribute)
+
+
+
+'''
+addDocumentFeatures
+===================
+Given the list of line dicts in a document, computes the formatting features for every line at once, as dataframe columns.
+Indentations are bucketed with the indentation buckets of the agency's layout profile if they're passed, and within the document otherwise.
+Returns a dataframe of the lines with their features, with the columns in alphabetical order.
+'''
+def addDocumentFeatures(lines, agency, indent_buckets=None):
+
+	lines_df = pd.DataFrame(lines)
+	if len(lines_df) == 0:
+		return lines_df
+
+	# add text-based features
+	lines_df = addFormattingFeatures(lines_df)
+
+	# convert font information into a set of ranked dummy vars
+	lines_df = cleanFontNames(lines_df)
+	lines_df = assignFontStyles(lines_df)
+
+	# bucket left indentations into 5 ranked dummy vars
+	lines_df = bucketLeftIndentation(lines_df, indent_buckets)
 
-		# loop over pages
-		for page_index, page in enumerate(pdf.pages):
-			# crop page
-			page = cropHeaderAndFooter(page, page_index)
+	return lines_df[sorted(lines_df.columns)]
 
-			# convert to a list of lines with formatting
-			lines += getLinesWithFormatting(page, page_index, agency, date)
 
-		# convert font information into a set of ranked dummy vars
-		lines = cleanFontNames(lines)
-		lines = assignFontStyles(lines)
 
-		# bucket left indentations into 5 ranked dummy vars
-		lines = bucketLeftIndentation(lines, agency)
+'''
+parsePDFsToLines
+================
+Given an agency and a list of agenda dates, parse each agenda PDF into lines using a pool of processes,
+and write out the parsed lines for each agenda.
+Agendas longer than PAGES_PER_TASK are split into chunks of pages, and the chunks are merged back in page order,
+so the output is the same as a serial run. An agenda that fails to parse is reported and skipped without stopping the rest.
+If the agency's indentation buckets haven't been frozen yet, they're learned from the whole batch before any agenda is written out,
+so every agenda is bucketed against the same snapshot whatever order the agendas finish in.
+Pass a pool to share one set of worker processes between several agencies; otherwise a pool of num_processes is started.
+Returns the list of dates that were parsed successfully.
+'''
+def parsePDFsToLines(agency, dates, num_processes=None, pool=None):
+
+	# split each agenda into tasks covering a range of pages
+	tasks = list()
+	num_tasks = dict()
+	for date in dates:
+		filepath = "docs/" + agency + "/raw_pdfs/" + agency + "_" + date + ".pdf"
+		try:
+			with pdfplumber.open(filepath) as pdf:
+				num_pages = len(pdf.pages)
+		except Exception as e:
+			print("PARSE ERROR")
+			print("Could not open %s: %s" % (filepath, e))
+			continue
+
+		page_starts = range(0, num_pages, PAGES_PER_TASK) or [0]
+		num_tasks[date] = len(page_starts)
+		instrumentation.addCount('pages', num_pages)
+		for page_start in page_starts:
+			tasks.append((filepath, agency, date, page_start, min(page_start + PAGES_PER_TASK, num_pages)))
+
+	# once frozen, the profile's buckets are used as they are. until then, agendas are held back while it learns from all of them
+	layout_profile = loadLayoutProfile(agency)
+	indent_buckets = layout_profile['indent_buckets']
+	held_agendas = list()
+
+	# collect the page chunks for each agenda as they finish
+	page_chunks = dict((date, dict()) for date in num_tasks)
+	failed_dates = set()
+	parsed_dates = list()
+
+	own_pool = pool is None
+	if own_pool:
+		pool = multiprocessing.Pool(num_processes)
+	try:
+		for date, page_start, lines, error in pool.imap_unordered(extractPageRangeTask, tasks):
+
+			if error is not None:
+				if date not in failed_dates:
+					print("PARSE ERROR")
+					print("Could not parse %s agenda from %s:" % (agency, date))
+					print(error)
+				failed_dates.add(date)
+				continue
+
+			page_chunks[date][page_start] = lines
+
+			# once every chunk of an agenda is in, merge them in page order and write out the agenda
+			if len(page_chunks[date]) == num_tasks[date] and date not in failed_dates:
+				agenda_chunks = page_chunks.pop(date)
+				agenda_lines = list()
+				for chunk_start in sorted(agenda_chunks):
+					agenda_lines += agenda_chunks[chunk_start]
+
+				instrumentation.addCount('agendas')
+				instrumentation.addCount('lines', len(agenda_lines))
+
+				if indent_buckets is None:
+					updateLayoutProfile(layout_profile, date, [line['left_inset'] for line in agenda_lines])
+					held_agendas.append((date, pd.DataFrame(agenda_lines)))
+				elif finishAgenda(agenda_lines, agency, date, indent_buckets):
+					parsed_dates.append(date)
+	finally:
+		if own_pool:
+			pool.close()
+			pool.join()
+
+	# freeze the buckets learned from the batch, and bucket the held agendas with them
+	if held_agendas:
+		indent_buckets = getIndentBuckets(layout_profile)
+		writeLayoutProfile(agency, layout_profile)
+		for date, agenda_df in held_agendas:
+			if finishAgenda(agenda_df, agency, date, indent_buckets):
+				parsed_dates.append(date)
+
+	return parsed_dates
+
+
+
+'''
+finishAgenda
+============
+Given the merged lines of an agenda, add the document features with the given indentation buckets and write out the lines.
+Errors are reported rather than raised, so one agenda doesn't stop the rest.
+Returns true if the agenda was written out.
+'''
+def finishAgenda(agenda_lines, agency, date, indent_buckets):
+	try:
+		writeLinesToDisk(addDocumentFeatures(agenda_lines, agency, indent_buckets), agency, date, False)
+		return True
+	except Exception as e:
+		print("PARSE ERROR")
+		print("Could not finish %s agenda from %s: %s" % (agency, date, e))
+		return False
+
+
+
+'''
+extractPageRangeTask
+====================
+Worker for parsePDFsToLines. Given a task tuple with a PDF filepath, agency, date, and a range of pages,
+extract the lines on those pages. Errors are caught and returned so one bad PDF doesn't stop the pool.
+Each task is recorded (and can be profiled) as a parse_pages stage.
+Returns a tuple of the date, first page index, lines, and error message (None on success).
+'''
+def extractPageRangeTask(task):
+	filepath, agency, date, page_start, page_end = task
+	try:
+		with instrumentation.stageTimer(agency, 'parse_pages', date) as record:
+			record['page_range'] = [page_start, page_end]
+			with pdfplumber.open(filepath) as pdf:
+				lines = extractPageLines(pdf, range(page_start, page_end), agency, date)
+		return (date, page_start, lines, None)
+	except Exception:
+		return (date, page_start, None, traceback.format_exc())
+
 
-		return lines
 
 def test_func(obj):
 	if obj['object_type'] == "rect":
@@ -81,6 +334,33 @@ def test_func(obj):
 	else:
 		return True
 
+'''
+buildPageGeometry
+=================
+Collects the drawn lines and rects on a page into numpy arrays, so the crop and the rect exclusion
+can find what they need without walking every object on the page again.
+Returns a dict of the lines and rects along with arrays of their coordinates.
+'''
+def buildPageGeometry(page):
+	lines = page.lines
+	rects = page.rects
+
+	def coords(objs, key):
+		return np.array([float(obj[key]) for obj in objs], dtype=np.float64)
+
+	return {'width': float(page.width), \
+		'height': float(page.height), \
+		'lines': lines, \
+		'line_bottoms': coords(lines, 'bottom'), \
+		'line_y0s': coords(lines, 'y0'), \
+		'rects': rects, \
+		'rect_x0s': coords(rects, 'x0'), \
+		'rect_x1s': coords(rects, 'x1'), \
+		'rect_tops': coords(rects, 'top'), \
+		'rect_bottoms': coords(rects, 'bottom')}
+
+
+
 '''
 cropHeaderAndFooter
 ===================
@@ -88,7 +368,26 @@ Crops out unwanted boilerplate at the top and bottom of each page.
 Tries to determine the area to crop out using lines and rectangles at the top and bottom of each page.
 Returns a cropped version of the page.
 '''
-def cropHeaderAndFooter(page, page_index):
+def cropHeaderAndFooter(page, page_index, geometry=None):
+
+	if geometry is None:
+		geometry = buildPageGeometry(page)
+
+	header_height, footer_height = findHeaderAndFooter(geometry, page_index)
+
+	crop_margins = (0, header_height, page.width, page.height-footer_height)
+
+	return page.crop(crop_margins)
+
+
+
+'''
+findHeaderAndFooter
+===================
+Given the geometry of a page, find how much of the top and bottom of the page to crop out.
+Returns a tuple of the header height and the footer height.
+'''
+def findHeaderAndFooter(geometry, page_index):
 	'''
 	find the topmost line on the page.
 	if it's within the max_header_height from the top of the page,
@@ -100,26 +399,20 @@ def cropHeaderAndFooter(page, page_index):
 
 	# the first page often contains a lot of extra boilerplate
 	if page_index == 0:
-		max_header_height = page.height / 2
+		max_header_height = geometry['height'] / 2
 	else:
 		max_header_height = 100
-		second_top_line_margin = 0
-
-	topmost_line_dist_from_top = page.height
 
-	# try filtering on lines and rectangles
-	rects = [rect for rect in page.rects if (rect['width'] > page.width/2) and (rect['height'] > page.height / 10)]
-	lines_and_rects = page.lines + rects
-	for line in lines_and_rects:
-		line_dist_from_top = line['bottom']
+	# try filtering on lines and big rectangles
+	big_rects = (geometry['rect_x1s'] - geometry['rect_x0s'] > geometry['width'] / 2) & \
+		(geometry['rect_bottoms'] - geometry['rect_tops'] > geometry['height'] / 10)
+	lines_and_rects = geometry['lines'] + [rect for rect, big in zip(geometry['rects'], big_rects) if big]
+	bottoms = np.concatenate((geometry['line_bottoms'], geometry['rect_bottoms'][big_rects]))
 
-		# check if the line is the topmost line found so far
-		if line_dist_from_top < topmost_line_dist_from_top:
-			topmost_line_dist_from_top = line_dist_from_top
-
-			# check if the line is within the max header height
-			if line_dist_from_top < max_header_height:
-				header_height = line_dist_from_top
+	if len(bottoms) > 0:
+		topmost_index = np.argmin(bottoms)
+		if bottoms[topmost_index] < min(max_header_height, geometry['height']):
+			header_height = lines_and_rects[topmost_index]['bottom']
 
 	'''
 	find the bottommost line on the page.
@@ -131,23 +424,13 @@ def cropHeaderAndFooter(page, page_index):
 	footer_height = 0 # default guestimate
 
 	max_footer_height = 200;
-	lowest_line_dist_from_bottom = page.height;
-
-	for line in page.lines:
-		line_dist_from_bottom = line['y0']
-
-		# check if line is the lowest line found so far
-		if line_dist_from_bottom < lowest_line_dist_from_bottom:
-			lowest_line_dist_from_bottom = line_dist_from_bottom
 
-			# check if the line is within the max footer height
-			if line_dist_from_bottom < max_footer_height:
-				footer_height = line['y1']
+	if len(geometry['line_y0s']) > 0:
+		lowest_index = np.argmin(geometry['line_y0s'])
+		if geometry['line_y0s'][lowest_index] < min(max_footer_height, geometry['height']):
+			footer_height = geometry['lines'][lowest_index]['y1']
 
-
-	crop_margins = (0, header_height, page.width, page.height-footer_height)
-
-	return page.crop(crop_margins)
+	return (header_height, footer_height)
 
 
 
@@ -156,13 +439,14 @@ getLinesWithFormatting
 ======================
 Convert the text of a page into a list of dicts (one per line).
 Each dict contains the text of that line, along with features about the formatting of the line (to use in a classifier later).
+Features computed from the text are added for the whole document at once by addDocumentFeatures.
 '''
-def getLinesWithFormatting(page, page_index, agency, date):
-
+def getLinesWithFormatting(page, page_index, agency, date, geometry=None):
 
 	# find rects to exclude
-	rects = [rect for rect in page.rects if (rect['width'] > page.width/2) and (rect['height'] > page.height / 10)]
-	# pp.pprint(rects)
+	if geometry is None:
+		geometry = buildPageGeometry(page)
+	rect_index = buildRectIndex(geometry, page.bbox)
 
 	### vertical tolerance in pixels to separate lines
 	y_tol = 2
@@ -173,11 +457,56 @@ def getLinesWithFormatting(page, page_index, agency, date):
 	# sort list of char dicts by distance from page top
 	sorted_chars = sorted(page.chars, key=itemgetter('top', 'x0'))
 
-	# position indicators
+	### get formatting for each line
+	for line_index, (char, lines_char_objs) in enumerate(groupCharsIntoLines(sorted_chars, rect_index, y_tol)):
+
+		lines_chars = [c['text'] for c in lines_char_objs]
+		line_string = ''.join(lines_chars)
+
+		# add line formatting to the lines_formatting list
+		# assumes that all text on that line have the same formatting
+		line_dict = {'agency': agency, \
+			'meeting_date': date, \
+			'line_id': agency + "_" + date + "_" + str(line_index), \
+			'font_name': char['fontname'], \
+			'font_size': char['size'], \
+			'first_char': char['text'], \
+			'left_inset': round(char['x0']), \
+			'text': line_string}
+
+		# if the line begins with spaces, the left_inset is thrown off.
+		# to handle this, use the inset of the first non-space character.
+		if lines_chars[0] == ' ':
+			for c in lines_char_objs:
+				if c['text'] != ' ':
+					line_dict['left_inset'] = round(c['x0'])
+					break
+
+		# add to list
+		lines.append(line_dict)
+
+	return lines
+
+
+'''
+groupCharsIntoLines
+===================
+Given a list of char dicts sorted by top and x0, group them into lines in a single pass.
+A new line starts at any char more than y_tol away from the start of the previous line, unless
+that char sits inside one of the rects in rect_index. Each line holds every char within y_tol of its first char.
+Yields a tuple of the first char and the list of chars on the line.
+'''
+def groupCharsIntoLines(sorted_chars, rect_index, y_tol):
+
+	# the window of chars within y_tol of the current line start only ever moves down the page,
+	# so track its bounds with two indexes instead of rescanning the whole list for every line
+	window_start = 0
+	window_end = 0
+	num_chars = len(sorted_chars)
+
+	# position indicator
 	current_y_pos = 0
-	line_index = 0
 
-	### get formatting for each line
 	for char in sorted_chars:
 
 		# check if this is a new line based on y position
@@ -185,112 +514,95 @@ def getLinesWithFormatting(page, page_index, agency, date):
 		cur_y_max = current_y_pos + y_tol
 
 		if cur_y_min >= char['top'] or char['top'] >= cur_y_max:
-			if not charInsideRect(char, rects):
-
-				# get all characters on that line
-				lines_char_objs = [c for c in sorted_chars if c['top'] <= (char['top']+y_tol) and c['top'] >= (char['top']-y_tol)]
-				lines_chars = [c['text'] for c in lines_char_objs]
-				line_string = ''.join(lines_chars)
-
-				# print(line_string)
-
-				# add line formatting to the lines_formatting list
-				# assumes that all text on that line have the same formatting
-				line_dict = {'agency': agency, \
-					'meeting_date': date, \
-					'line_id': agency + "_" + date + "_" + str(line_index), \
-					'font_name': char['fontname'], \
-					'font_size': char['size'], \
-					'first_char': char['text'], \
-					'left_inset': round(char['x0']), \
-					'text': line_string}
-
-				# if the line begins with spaces, the left_inset is thrown off.
-				# to handle this, use the inset of the first non-space character.
-				if lines_chars[0] == ' ':
-					for c in lines_char_objs:
-						if c['text'] != ' ':
-							line_dict['left_inset'] = round(c['x0'])
-							break
-
-				# add additional format-based features
-				line_dict = addFormattingFeatures(line_dict)
-
-				# add to list
-				lines.append(line_dict)
-
-				# update position indicators
+			if not charInsideRect(char, rect_index):
+
+				# advance the window to cover all characters on that line
+				while sorted_chars[window_start]['top'] < (char['top']-y_tol):
+					window_start += 1
+				if window_end < window_start:
+					window_end = window_start
+				while window_end < num_chars and sorted_chars[window_end]['top'] <= (char['top']+y_tol):
+					window_end += 1
+
+				yield (char, sorted_chars[window_start:window_end])
+
+				# update position indicator
 				current_y_pos = char['top']
-				line_index += 1
 
-	return lines
+
+
+'''
+buildRectIndex
+==============
+Given the geometry of a page and the bbox the page was cropped to, find the rects to exclude:
+those that, clipped to the bbox, span over half its width and a tenth of its height.
+Sorts them by top and keeps a running max of their bottoms, so charInsideRect only needs one binary search.
+Returns a tuple of the sorted tops and the running max bottoms, as lists.
+'''
+def buildRectIndex(geometry, bbox):
+	x0, top, x1, bottom = [float(coord) for coord in bbox]
+
+	# clip the rects to the bbox, as cropping the page would
+	clipped_tops = np.maximum(geometry['rect_tops'], top)
+	clipped_bottoms = np.minimum(geometry['rect_bottoms'], bottom)
+	clipped_widths = np.minimum(geometry['rect_x1s'], x1) - np.maximum(geometry['rect_x0s'], x0)
+
+	excluded = (clipped_widths > (x1 - x0) / 2) & (clipped_bottoms - clipped_tops > (bottom - top) / 10)
+
+	order = np.argsort(clipped_tops[excluded], kind='mergesort')
+	sorted_tops = clipped_tops[excluded][order]
+	max_bottoms = np.maximum.accumulate(clipped_bottoms[excluded][order]) if len(order) > 0 else sorted_tops
+
+	return (sorted_tops.tolist(), max_bottoms.tolist())
+
 
 
 '''
 charInsideRect
 ===============
-Tests if a character is inside the bounds of any rectangles on the page.
+Tests if a character is inside the bounds of any of the rects in rect_index (from buildRectIndex).
 Returns true if it is, false otherwise.
 '''
-def charInsideRect(char, rects):
-	for rect in rects:
-		if char['top'] >= rect['top'] and char['bottom'] <= rect['bottom']:
-			return True
-	return False
+def charInsideRect(char, rect_index):
+	sorted_tops, max_bottoms = rect_index
+	if len(sorted_tops) == 0:
+		return False
+
+	# of the rects starting at or above the char, check the one reaching furthest down
+	num_above = bisect_right(sorted_tops, float(char['top']))
+	return num_above > 0 and float(char['bottom']) <= max_bottoms[num_above-1]
 
 '''
 addFormattingFeatures
 =====================
-Given a dict with a text string, add new features depending on the properties of that string.
+Given a dataframe of lines, strip the text of each line and add new features depending on the properties of that text.
+Returns the updated dataframe.
 '''
-def addFormattingFeatures(line):
+def addFormattingFeatures(lines_df):
 
 	# strip out whitespace
-	line['text'] = line['text'].strip()
-	
+	text = lines_df['text'].str.strip()
+	lines_df['text'] = text
+
 	# check if line is all caps
-	if line['text'].isupper():
-		line['uppercase'] = 1
-	else:
-		line['uppercase'] = 0
+	lines_df['uppercase'] = text.str.isupper().astype(int)
 
 	# check if line starts with a number
-	re_starts_num = re.compile(r'\d{1,3}\.?\s+')
-	if re_starts_num.match(line['text']) is not None:
-		line['starts_with_number'] = 1
-	else:
-		line['starts_with_number'] = 0
+	lines_df['starts_with_number'] = text.str.contains(RE_STARTS_NUM).astype(int)
 
 	# check if line starts with a sub-number (ex: 1.1)
-	re_starts_subnum = re.compile(r'\d+[\.]\d+\s+')
-	if re_starts_subnum.match(line['text']) is not None:
-		line['starts_with_subnumber'] = 1
-	else:
-		line['starts_with_subnumber'] = 0
+	lines_df['starts_with_subnumber'] = text.str.contains(RE_STARTS_SUBNUM).astype(int)
 
 	# check if line starts with a roman numeral (ex: IV)
-	re_starts_roman_numeral = re.compile(r'(XC|XL|L?X{0,3})(IX|IV|V?I{0,3})\.\s+')
-	if re_starts_roman_numeral.match(line['text']) is not None:
-		line['starts_with_roman_numeral'] = 1
-	else:
-		line['starts_with_roman_numeral'] = 0
+	lines_df['starts_with_roman_numeral'] = text.str.contains(RE_STARTS_ROMAN_NUMERAL).astype(int)
 
 	# check if line starts with an enumerating letter
-	re_starts_enum_letter = re.compile(r'[(]?[A-Za-z][).]?\s+')
-	if re_starts_enum_letter.match(line['text']) is not None:
-		line['starts_with_enum_letter'] = 1
-	else:
-		line['starts_with_enum_letter'] = 0
+	lines_df['starts_with_enum_letter'] = text.str.contains(RE_STARTS_ENUM_LETTER).astype(int)
 
 	# check if line includes a time
-	re_includes_time = re.compile(r'[aA|pP].?[mM].?')
-	if re_includes_time.search(line['text']) is not None:
-		line['includes_time'] = 1
-	else:
-		line['includes_time'] = 0
+	lines_df['includes_time'] = text.str.contains(RE_INCLUDES_TIME).astype(int)
 
-	# return the expanded dict
-	return line
+	return lines_df
 
 
 
@@ -299,16 +611,9 @@ cleanFontNames
 ==============
 Strips prefixes and foundary info from font names.
 '''
-def cleanFontNames(lines):
-	for line in lines:
-		font = line['font_name']
-		if '+' in font:
-			font_parts = font.split('+')
-			font = font_parts[-1]
-		font = re.sub(r'MT', '', font)
-		line['font_name'] = font
-
-	return lines
+def cleanFontNames(lines_df):
+	lines_df['font_name'] = lines_df['font_name'].str.split('+').str[-1].str.replace('MT', '')
+	return lines_df
 
 
 
@@ -317,19 +622,12 @@ assignFontStyles
 ================
 Creates variables indicating if a line is set in either bold or italic type.
 '''
-def assignFontStyles(lines):
-	for line in lines:
-		if 'bold' in line['font_name'].lower():
-			line['font_bold'] = 1
-		else:
-			line['font_bold'] = 0
+def assignFontStyles(lines_df):
+	font_names = lines_df['font_name'].str.lower()
+	lines_df['font_bold'] = font_names.str.contains('bold', regex=False).astype(int)
+	lines_df['font_italic'] = font_names.str.contains('italic', regex=False).astype(int)
 
-		if 'italic' in line['font_name'].lower():
-			line['font_italic'] = 1
-		else:
-			line['font_italic'] = 0
-
-	return lines
+	return lines_df
 
 
 
@@ -337,38 +635,109 @@ def assignFontStyles(lines):
 bucketLeftIndentation
 =========================
 Assigns the left indentation to one of six buckets.
-Returns an updated list of lines.
-'''
-def bucketLeftIndentation(lines, agency):
-
-	# find unique line indentations
-	left_indents = list(set([line['left_inset'] for line in lines])) # intermediate conversion to a list to remove duplicates
-	ranked_left_indents = sorted(left_indents)
-
-	for line in lines:
-
-		# add columns for each bucket
-		line['indent_bucket_0'] = 0
-		line['indent_bucket_1'] = 0
-		line['indent_bucket_2'] = 0
-		line['indent_bucket_3'] = 0
-		line['indent_bucket_4'] = 0
-		line['indent_bucket_5'] = 0
-
-		if line['left_inset'] == ranked_left_indents[0]:
-			line['indent_bucket_0'] = 1
-		elif line['left_inset'] == ranked_left_indents[1]:
-			line['indent_bucket_1'] = 1
-		elif line['left_inset'] == ranked_left_indents[2]:
-			line['indent_bucket_2'] = 1
-		elif line['left_inset'] == ranked_left_indents[3]:
-			line['indent_bucket_3'] = 1
-		elif line['left_inset'] == ranked_left_indents[4]:
-			line['indent_bucket_4'] = 1
-		else:
-			line['indent_bucket_5'] = 1
+Given the indentation buckets of the agency's layout profile, its five smallest common indentations get their own bucket,
+so buckets mean the same thing in every agenda. Without them, the five smallest indentations in the document do.
+Everything else shares the last bucket.
+Returns the updated dataframe.
+'''
+def bucketLeftIndentation(lines_df, indent_buckets=None):
 
-	return lines
+	if indent_buckets is not None:
+		# look up each line's indentation in the profile's buckets
+		line_buckets = lines_df['left_inset'].map(indent_buckets).fillna(5).values
+	else:
+		# rank each line's indentation among the unique indentations
+		ranked_left_indents = np.unique(lines_df['left_inset'].values)
+		indent_ranks = np.searchsorted(ranked_left_indents, lines_df['left_inset'].values)
+		line_buckets = np.minimum(indent_ranks, 5)
+
+	# add columns for each bucket
+	for bucket in range(6):
+		lines_df['indent_bucket_%d' % bucket] = (line_buckets == bucket).astype(int)
+
+	return lines_df
+
+
+
+'''
+loadLayoutProfile
+=================
+Loads the agency's layout profile: counts of the left indentations of the lines it was learned from,
+along with the agendas they came from, and the indentation buckets once they're frozen (None until then).
+Starts an empty profile if there isn't one yet.
+Returns the profile dict.
+'''
+def loadLayoutProfile(agency):
+	profile_filepath = "docs/" + agency + "/data/layout_profile.p"
+
+	if os.path.exists(profile_filepath):
+		try:
+			with open(profile_filepath, 'rb') as profile_file:
+				layout_profile = pickle.load(profile_file)
+			layout_profile.setdefault('indent_buckets', None)
+			return layout_profile
+		except Exception as e:
+			print("Could not load layout profile %s: %s" % (profile_filepath, e))
+
+	return {'dates': set(), 'num_lines': 0, 'left_indents': Counter(), 'indent_buckets': None}
+
+
+
+'''
+updateLayoutProfile
+===================
+Adds the left indentations of one agenda's lines to the layout profile. Agendas already in the profile (like ones being reparsed)
+aren't counted again, and once the buckets are frozen the profile stops learning.
+'''
+def updateLayoutProfile(layout_profile, date, left_insets):
+	if date in layout_profile['dates'] or layout_profile['indent_buckets'] is not None:
+		return
+
+	left_insets = list(left_insets)
+	layout_profile['dates'].add(date)
+	layout_profile['num_lines'] += len(left_insets)
+	layout_profile['left_indents'].update(left_insets)
+
+
+
+'''
+getIndentBuckets
+================
+Given a layout profile, return its frozen indentation buckets. The first time, the buckets are frozen from what the profile
+has learned: the indentations that start at least MIN_INDENT_SHARE of the agency's lines are ranked, and the five smallest get a bucket each.
+From then on every agenda (and the training lines) are bucketed the same way. To relearn them, delete the profile and bump PARSER_VERSION.
+Returns a dict from each of those indentations to its bucket.
+'''
+def getIndentBuckets(layout_profile):
+	if layout_profile['indent_buckets'] is not None:
+		return layout_profile['indent_buckets']
+
+	min_count = MIN_INDENT_SHARE * layout_profile['num_lines']
+	common_indents = sorted(indent for indent, count in layout_profile['left_indents'].items() if count >= min_count)
+	indent_buckets = dict((indent, bucket) for bucket, indent in enumerate(common_indents[:5]))
+
+	# a profile that hasn't seen any lines has nothing to freeze yet
+	if layout_profile['num_lines'] > 0:
+		layout_profile['indent_buckets'] = indent_buckets
+
+	return indent_buckets
+
+
+
+'''
+writeLayoutProfile
+==================
+Writes out the agency's layout profile, via a temp file so an interrupted write doesn't leave a corrupt profile.
+'''
+def writeLayoutProfile(agency, layout_profile):
+	profile_filepath = "docs/" + agency + "/data/layout_profile.p"
+	if not os.path.exists(os.path.dirname(profile_filepath)):
+		os.makedirs(os.path.dirname(profile_filepath))
+
+	temp_filepath = profile_filepath + ".tmp"
+	with open(temp_filepath, 'wb') as profile_file:
+		pickle.dump(layout_profile, profile_file, pickle.HIGHEST_PROTOCOL)
+	os.rename(temp_filepath, profile_filepath)
 
 
 
@@ -432,19 +801,19 @@ def applyClass(line, score):
 
 
 '''
-writeDFtoCSV
-===============
-Save the full DF as a CSV to the appropriate folder.
+writeLinesToDisk
+================
+Save the full DF to the appropriate folder.
+Manually classified lines are saved as a CSV for the training set, and parsed lines in the line store format.
 '''
-def writeDFtoCSV(df, agency, date, manual_classify):
+def writeLinesToDisk(df, agency, date, manual_classify):
 
 	# select storage location based on whether this was manually classified
 	if manual_classify:
 		filepath = "docs/" + agency + "/training_lines/" + agency + "_" + date + "_training_lines.csv"
+		df.to_csv(filepath, encoding="utf-8", index=False)
 	else:
-		filepath = "docs/" + agency + "/parsed_lines/" + agency + "_" + date + "_parsed_lines.csv"
-
-	df.to_csv(filepath, encoding="utf-8", index=False)
+		line_store.writeLines(df, line_store.linesFilepath(agency, date, "parsed_lines"))
 
 
 
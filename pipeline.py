@@ -1,31 +1,97 @@
 import json
 import os
-from scrapers.utils import buildDirectoryStructure, writeAgendaListToDisk
+import threading
+import traceback
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from scrapers.utils import buildDirectoryStructure, writeAgendaListToDisk, downloadAgendas
 from scrapers import gavilan_scraper, board_docs_scraper, cupertino_usd_scraper
 from parsers import board_docs_parser
-from parsers.pdf_parser import parsePDFtoLines
-from parsers.line_classifier import classifyAgendas
-from parsers.line_structurer import structureLines
+from parsers.pdf_parser import parsePDFtoLines, parsePDFsToLines, PARSER_VERSION
+from parsers.line_classifier import classifyAgendas, getModelKey, CLASSES_LIST
+from parsers.line_structurer import structureLines, STRUCTURER_VERSION
+from parsers import line_store
+from pipeline_state import loadStageState, writeStageState, stageIsCurrent, recordStage, hashFile, hashValue, LEGACY_VERSION
+from instrumentation import stageTimer
+
+# number of processes to parse PDFs with (None uses one per CPU)
+NUM_PARSE_PROCESSES = None
+
+# max number of agencies to work on at once. their network stages overlap, while fetches stay limited per host by scrapers.fetch
+MAX_CONCURRENT_AGENCIES = 4
+
+# check recently parsed BoardDocs agendas for amendments, refetching only the items that changed
+DETECT_BOARDDOCS_CHANGES = True
+
+# versions of the scrape and download stages, bumped when they change what they produce
+SCRAPE_VERSION = 1
+DOWNLOAD_VERSION = 1
+
+# versions of the parser and structurer that match the outputs from before the stage state store existed.
+# those outputs are kept until the stage's version moves past these (there's no such version for the classifier's models)
+LEGACY_PARSER_VERSION = 1
+LEGACY_STRUCTURER_VERSION = 1
+
+# classifying already uses every core, so agencies take turns
+classify_lock = threading.Lock()
+
+# only one agency at a time can prompt for training lines
+training_lock = threading.Lock()
 
 def main():
 
 	agencies_list = getAgenciesList()
-	for agency in agencies_list:
+	if len(agencies_list) == 0:
+		return
+
+	# one pool of processes parses the PDFs of every agency. start it before any threads, so the workers fork cleanly
+	parse_pool = multiprocessing.Pool(NUM_PARSE_PROCESSES)
+
+	# each agency runs in its own thread, handing its PDF parsing to the shared pool
+	agency_pool = ThreadPool(min(MAX_CONCURRENT_AGENCIES, len(agencies_list)))
+	try:
+		for agency_id, error in agency_pool.imap_unordered(lambda agency: processAgency(agency, parse_pool), agencies_list):
+			if error is None:
+				print("Finished %s" % agency_id)
+			else:
+				print("PIPELINE ERROR")
+				print("Could not finish %s:" % agency_id)
+				print(error)
+	finally:
+		agency_pool.close()
+		agency_pool.join()
+		parse_pool.close()
+		parse_pool.join()
+
+
+
+'''
+processAgency
+=============
+Run every stage of the pipeline for one agency, parsing PDFs on the given pool of processes.
+Errors are caught so one agency doesn't stop the others.
+Returns a tuple of the agency id and an error message (None on success).
+'''
+def processAgency(agency, parse_pool=None):
+	try:
 		print("=======================================================================")
 		print("Now working on %s..." % agency['agency_id'])
 		buildDirectoryStructure(agency['agency_id'], agency['agenda_type'])
 
-		if agency['agenda_type'] == 'pdf':
-			processPDFs(agency)
+		with stageTimer(agency['agency_id'], 'agency'):
+			if agency['agenda_type'] == 'pdf':
+				processPDFs(agency, NUM_PARSE_PROCESSES, parse_pool)
 
-		elif agency['agenda_type'] == 'boarddocs':
-			processBoardDocs(agency)
+			elif agency['agenda_type'] == 'boarddocs':
+				processBoardDocs(agency)
 
-		else:
-			print("That agenda type is not currently supported")
+			else:
+				print("That agenda type is not currently supported")
 
+	except Exception:
+		return (agency['agency_id'], traceback.format_exc())
 
-	
+	return (agency['agency_id'], None)
 
 
 
@@ -52,59 +118,162 @@ def getAgenciesList():
 processPDFs
 ===========
 Scrape and process PDFs for a given agency.
+Each stage is only rerun for agendas whose input or stage version changed since the last run,
+as recorded in the agency's stage state store.
+PDFs are parsed in parallel on parse_pool if one is passed, otherwise across num_processes processes.
 '''
-def processPDFs(agency):
+def processPDFs(agency, num_processes=None, parse_pool=None):
+
+	agency_id = agency['agency_id']
 
 	# scrape agency
 	print("")
 	print("SCRAPING PDFS...")
-	if agency['agency_id'] == 'gavilan_ccd':
-		agendas_list = gavilan_scraper.gavilanScraper(agency['agency_id'])
-	elif agency['agency_id'] == 'cupertino_usd':
-		agendas_list = cupertino_usd_scraper.scraper(agency['agency_id'])
-	else:
-		print("No scraper has been written for that agency")
-		return
+	with stageTimer(agency_id, 'scrape') as record:
+		if agency_id == 'gavilan_ccd':
+			agendas_list = gavilan_scraper.gavilanScraper(agency_id)
+		elif agency_id == 'cupertino_usd':
+			agendas_list = cupertino_usd_scraper.scraper(agency_id)
+		else:
+			print("No scraper has been written for that agency")
+			return
+		record['counts']['agendas'] = len(agendas_list)
+
+	state = loadStageState(agency_id)
+
+	# record the scrape of each agenda, and redownload any agenda whose url has changed
+	redownload = False
+	for agenda in agendas_list:
+		paths = stagePaths(agency_id, agenda)
+		url_hash = hashValue(agenda['url'])
+		recordStage(state, agenda['agenda_id'], 'scrape', url_hash, paths['scrape'], SCRAPE_VERSION)
+
+		if agenda['downloaded'] and 'download' in state[agenda['agenda_id']] and not stageIsCurrent(state, agenda['agenda_id'], 'download', url_hash, DOWNLOAD_VERSION):
+			agenda['downloaded'] = False
+			redownload = True
+
+	if redownload:
+		with stageTimer(agency_id, 'download'):
+			agendas_list = downloadAgendas(agency_id, agendas_list)
+
+	for agenda in agendas_list:
+		if agenda['downloaded']:
+			recordStage(state, agenda['agenda_id'], 'download', hashValue(agenda['url']), stagePaths(agency_id, agenda)['download'], DOWNLOAD_VERSION)
+
+		# agendas parsed before the state store existed keep their outputs
+		if agenda['parsed'] and 'parse_lines' not in state[agenda['agenda_id']]:
+			adoptExistingOutputs(state, agency_id, agenda)
+
+	writeStageState(agency_id, state)
+
+	parsable_agendas = [agenda for agenda in agendas_list if agenda['downloaded'] and not agenda['scanned']]
 
 	# parse agenda lines
 	print("")
 	print("PARSING PDF LINES...")
-	for agenda in agendas_list:
-		if agenda['downloaded'] and not agenda['scanned'] and not agenda['parsed']:
-			parsePDFtoLines(agency['agency_id'], agenda['meeting_date'], False)
+	pdf_hashes = dict((agenda['meeting_date'], hashFile(stagePaths(agency_id, agenda)['download'])) for agenda in parsable_agendas)
+	agenda_dates = [agenda['meeting_date'] for agenda in parsable_agendas if not stageIsCurrent(state, agenda['agenda_id'], 'parse_lines', pdf_hashes[agenda['meeting_date']], PARSER_VERSION, LEGACY_PARSER_VERSION)]
+	with stageTimer(agency_id, 'parse_lines'):
+		parsed_dates = parsePDFsToLines(agency_id, agenda_dates, num_processes, parse_pool)
+
+	for agenda in parsable_agendas:
+		if agenda['meeting_date'] in parsed_dates:
+			recordStage(state, agenda['agenda_id'], 'parse_lines', pdf_hashes[agenda['meeting_date']], stagePaths(agency_id, agenda)['parse_lines'], PARSER_VERSION)
+	writeStageState(agency_id, state)
+
+	# agendas that failed to parse are left out of the later stages, and retried on the next run
+	if len(parsed_dates) < len(agenda_dates):
+		print("%d of %d agendas failed to parse" % (len(agenda_dates) - len(parsed_dates), len(agenda_dates)))
+	parsable_agendas = [agenda for agenda in parsable_agendas if stageIsCurrent(state, agenda['agenda_id'], 'parse_lines', pdf_hashes[agenda['meeting_date']], PARSER_VERSION, LEGACY_PARSER_VERSION)]
 
 	# train on a sample of agendas
-	training_dir = "docs/%s/training_lines/" % agency['agency_id']
+	training_dir = "docs/%s/training_lines/" % agency_id
 	num_training_files = len([f for f in os.listdir(training_dir) if f.endswith('.csv')])
 	if num_training_files < 3:
-		print("===========================")
-		print("Please classify the lines in some sample agendas to train the classifier:")
+		with training_lock:
+			print("===========================")
+			print("Please classify the lines in some sample agendas to train the classifier:")
+
+			# classify the first, middle, and last agendas
+			possible_training_agendas = [agenda for agenda in agendas_list if agenda['downloaded'] and not agenda['scanned']] # subset to parsable agendas
+			training_agendas = [possible_training_agendas[0], possible_training_agendas[len(possible_training_agendas)//2], possible_training_agendas[-1]]
+			for agenda in training_agendas:
+				training_filename = "docs/%s/training_lines/%s_%s_training_lines.csv" % (agency_id, agency_id, agenda['meeting_date'])
+				if not os.path.isfile(training_filename):
+					parsePDFtoLines(agency_id, agenda['meeting_date'], True)
 
-		# classify the first, middle, and last agendas
-		possible_training_agendas = [agenda for agenda in agendas_list if agenda['downloaded'] and not agenda['scanned']] # subset to parsable agendas
-		training_agendas = [possible_training_agendas[0], possible_training_agendas[len(possible_training_agendas)//2], possible_training_agendas[-1]]
-		for agenda in training_agendas:
-			training_filename = "docs/%s/training_lines/%s_%s_training_lines.csv" % (agency['agency_id'], agency['agency_id'], agenda['meeting_date'])
-			if not os.path.isfile(training_filename):
-				parsePDFtoLines(agency['agency_id'], agenda['meeting_date'], True)
+	# key the model only now: parsing can freeze the agency's layout profile, and training can add lines, and both change it
+	model_key = getModelKey(training_dir, CLASSES_LIST)
 
 	# classify the agenda lines using the training set
 	print("")
 	print("CLASSIFYING PDF LINES...")
-	if len([agenda for agenda in agendas_list if agenda['downloaded'] and not agenda['parsed'] and not agenda['scanned']]):
-		agenda_dates = [agenda['meeting_date'] for agenda in agendas_list if agenda['downloaded'] and not agenda['parsed'] and not agenda['scanned']]
-		classifyAgendas(agency['agency_id'], agenda_dates, False)
+	parsed_hashes = dict((agenda['meeting_date'], hashFile(stagePaths(agency_id, agenda)['parse_lines'])) for agenda in parsable_agendas)
+	classify_dates = [agenda['meeting_date'] for agenda in parsable_agendas if not stageIsCurrent(state, agenda['agenda_id'], 'classify', parsed_hashes[agenda['meeting_date']], model_key)]
+	if len(classify_dates):
+		with classify_lock, stageTimer(agency_id, 'classify'):
+			classifyAgendas(agency_id, classify_dates, False)
+
+	for agenda in parsable_agendas:
+		if agenda['meeting_date'] in classify_dates:
+			recordStage(state, agenda['agenda_id'], 'classify', parsed_hashes[agenda['meeting_date']], stagePaths(agency_id, agenda)['classify'], model_key)
+	writeStageState(agency_id, state)
 
 	# structure the classed agenda lines
 	print("")
 	print("STRUCTURING PDFS...")
-	for agenda in agendas_list:
-		if agenda['downloaded'] and not agenda['parsed'] and not agenda['scanned']:
-			structureLines(agency['agency_id'], agenda['meeting_date'])
-			agenda['parsed'] = True
+	for agenda in parsable_agendas:
+		classed_hash = hashFile(stagePaths(agency_id, agenda)['classify'])
+		if not stageIsCurrent(state, agenda['agenda_id'], 'structure', classed_hash, STRUCTURER_VERSION, LEGACY_STRUCTURER_VERSION):
+			with stageTimer(agency_id, 'structure', agenda['meeting_date']):
+				structureLines(agency_id, agenda['meeting_date'])
+			recordStage(state, agenda['agenda_id'], 'structure', classed_hash, stagePaths(agency_id, agenda)['structure'], STRUCTURER_VERSION)
+			writeStageState(agency_id, state)
+		agenda['parsed'] = True
 
 	# write out the updated agendas list
-	writeAgendaListToDisk(agency['agency_id'], agendas_list)
+	writeAgendaListToDisk(agency_id, agendas_list)
+
+
+
+'''
+stagePaths
+==========
+Given an agency and an agenda, return a dict with the output path of each pipeline stage for that agenda.
+'''
+def stagePaths(agency_id, agenda):
+
+	file_prefix = agency_id + "_" + agenda['meeting_date']
+	return {
+		'scrape': "docs/%s/agenda_list.json" % agency_id,
+		'download': "docs/%s/raw_pdfs/%s.pdf" % (agency_id, agenda['agenda_id']),
+		'parse_lines': line_store.linesFilepath(agency_id, agenda['meeting_date'], "parsed_lines"),
+		'classify': line_store.linesFilepath(agency_id, agenda['meeting_date'], "classed_lines"),
+		'structure': "docs/%s/structured_agendas/%s_meeting_agenda.json" % (agency_id, file_prefix)
+	}
+
+
+
+'''
+adoptExistingOutputs
+====================
+Given an agenda that was parsed before the stage state store existed,
+record its existing parse, classify, and structure outputs with LEGACY_VERSION, so they're only rebuilt
+once a stage's version moves past the one that produced them (see stageIsCurrent).
+Legacy CSV outputs are converted to the line store format first.
+'''
+def adoptExistingOutputs(state, agency_id, agenda):
+
+	paths = stagePaths(agency_id, agenda)
+	for stage in ['parse_lines', 'classify']:
+		csv_filepath = paths[stage][:-len(".npz")] + ".csv"
+		if not os.path.exists(paths[stage]) and os.path.exists(csv_filepath):
+			line_store.convertCSVFile(csv_filepath)
+
+	for stage, input_stage in [('parse_lines', 'download'), ('classify', 'parse_lines'), ('structure', 'classify')]:
+		if not (os.path.exists(paths[input_stage]) and os.path.exists(paths[stage])):
+			break
+		recordStage(state, agenda['agenda_id'], stage, hashFile(paths[input_stage]), paths[stage], LEGACY_VERSION)
 
 
 
@@ -118,12 +287,15 @@ def processBoardDocs(agency):
 	# scrape agency
 	print("")
 	print("SCRAPING AGENDAS...")
-	agendas_list = board_docs_scraper.scrapeBoardDocs(agency['agency_id'], agency['boarddocs_code'])
+	with stageTimer(agency['agency_id'], 'scrape') as record:
+		agendas_list = board_docs_scraper.scrapeBoardDocs(agency['agency_id'], agency['boarddocs_code'])
+		record['counts']['agendas'] = len(agendas_list)
 
 	# parse agendas
 	print("")
 	print("PARSING AGENDAS...")
-	board_docs_parser.parseAgendas(agency['agency_id'], agency['boarddocs_code'])
+	with stageTimer(agency['agency_id'], 'parse'):
+		board_docs_parser.parseAgendas(agency['agency_id'], agency['boarddocs_code'], DETECT_BOARDDOCS_CHANGES)
 
 
 
@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import hashlib
+
+'''
+A per-agency store recording, for each agenda and each pipeline stage,
+the hash of the stage's input, the path of its output, and the version of the code or model that produced it.
+The pipeline uses it to rerun only the stages whose inputs or versions have changed.
+'''
+
+# version recorded for outputs adopted from before the store existed, since the code that produced them isn't known
+LEGACY_VERSION = 0
+
+
+
+'''
+loadStageState
+==============
+Load the saved stage state for the given agency.
+Returns a dict mapping each agenda id to a dict of stage records, or an empty dict if there is no saved state.
+'''
+def loadStageState(agency):
+
+	state = dict()
+	state_filepath = "docs/" + agency + "/pipeline_state.json"
+	if os.path.exists(state_filepath):
+		with open(state_filepath) as state_file:
+			state = json.load(state_file)
+
+	return state
+
+
+
+'''
+writeStageState
+===============
+Given an agency and its stage state, write out the state to disk.
+Writes to a temp file first so a crash never leaves a half-written state file behind.
+'''
+def writeStageState(agency, state):
+
+	state_filepath = "docs/" + agency + "/pipeline_state.json"
+	with open(state_filepath + ".tmp", 'w') as outfile:
+		json.dump(state, outfile, sort_keys = True, indent = 4)
+	os.rename(state_filepath + ".tmp", state_filepath)
+
+
+
+'''
+hashFile
+========
+Return the SHA-1 hash of a file's contents, or None if the file doesn't exist.
+'''
+def hashFile(filepath):
+
+	if not os.path.exists(filepath):
+		return None
+
+	file_hash = hashlib.sha1()
+	with open(filepath, 'rb') as f:
+		for chunk in iter(lambda: f.read(1024 * 1024), b''):
+			file_hash.update(chunk)
+
+	return file_hash.hexdigest()
+
+
+
+'''
+hashValue
+=========
+Return the SHA-1 hash of a JSON-serializable value.
+'''
+def hashValue(value):
+	return hashlib.sha1(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+
+'''
+stageIsCurrent
+==============
+Check if a stage's recorded run for an agenda used the same input and version, and its output still exists.
+A legacy record counts as the same version only while the stage is still at legacy_version, the version of the code
+that produced the legacy outputs (None if that isn't known, so they're always rebuilt).
+'''
+def stageIsCurrent(state, agenda_id, stage, input_hash, version, legacy_version=None):
+
+	record = state.get(agenda_id, {}).get(stage)
+	if record is None or input_hash is None:
+		return False
+
+	if record['version'] == LEGACY_VERSION:
+		same_version = legacy_version is not None and version == legacy_version
+	else:
+		same_version = record['version'] == version
+
+	return record['input_hash'] == input_hash and same_version and os.path.exists(record['output_path'])
+
+
+
+'''
+recordStage
+===========
+Record a completed stage run for an agenda.
+'''
+def recordStage(state, agenda_id, stage, input_hash, output_path, version):
+
+	if agenda_id not in state:
+		state[agenda_id] = dict()
+
+	state[agenda_id][stage] = {
+		'input_hash': input_hash,
+		'output_path': output_path,
+		'version': version,
+		'completed_at': time.strftime('%Y-%m-%d %H:%M:%S')
+	}
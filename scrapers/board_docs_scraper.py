@@ -6,6 +6,7 @@ import datetime
 import os.path
 import json
 from utils import loadExistingAgendaList, writeAgendaListToDisk, downloadAgendas
+from fetch import fetchURL
 
 
 def main():
@@ -42,8 +43,8 @@ return a list of meeting agendas posted on BoardDocs.
 '''
 def getAgendasList(agency, agency_code, agenda_list):
 
-	# get list of meetings
-	r = requests.get('http://www.boarddocs.com/ca/' + agency_code + '/Board.nsf/LT-GetMeetings')
+	# get list of meetings, always checking with the server for new ones
+	r = fetchURL('http://www.boarddocs.com/ca/' + agency_code + '/Board.nsf/LT-GetMeetings', max_age=0)
 	meetings_soup = BeautifulSoup(r.content, "lxml")
 
 	# extract links to agendas
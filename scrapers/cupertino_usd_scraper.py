@@ -4,7 +4,15 @@ import re
 import datetime
 import os.path
 import json
+from multiprocessing.pool import ThreadPool
 from utils import loadExistingAgendaList, writeAgendaListToDisk, downloadAgendas
+from fetch import fetchURL
+
+# number of dates to probe at once
+MAX_PROBE_THREADS = 8
+
+# days after a date before an empty probe is remembered and the date is skipped in future scans
+EMPTY_DATE_RECHECK_DAYS = 14
 
 def main():
 
@@ -33,6 +41,9 @@ def scraper(agency):
 getAgendasList
 ==============
 Scrapes a list of meetings and their agenda PDF urls.
+There is no listing page, so every date since the last known agenda is probed for a PDF,
+using lightweight HEAD requests spread over a pool of threads.
+Dates already probed and found empty are skipped. Only dates with a PDF are added to the list.
 Returns the list.
 '''
 def getAgendasList(agency, agenda_list):
@@ -46,30 +57,29 @@ def getAgendasList(agency, agenda_list):
 	end_date = datetime.date.today()
 	delta = end_date - start_date
 
+	# skip dates already probed and found empty
+	empty_dates = loadEmptyDates(agency)
+	known_dates = set([agenda['meeting_date'] for agenda in agenda_list])
+	probe_dates = list()
 	for i in range(delta.days + 1):
 		date_obj = start_date + datetime.timedelta(days=i)
-		year = int(date_obj.strftime('%y'))
-		prev_year = year - 1
-		next_year = year + 1
-
-		# build urls for either option
-		url_opt_1 = "http://www.cusdk8.org/edline/about/board/agendas/{0}{1}/Board%20Agenda%20-%20Public%20{2}.pdf".format(prev_year, year, date_obj.strftime('%m%d%y'))
-		url_opt_2 = "http://www.cusdk8.org/edline/about/board/agendas/{0}{1}/Board%20Agenda%20-%20Public%20{2}.pdf".format(year, next_year, date_obj.strftime('%m%d%y'))
-
-		# see if either url returns a valid file
-		valid_url = None
-		r = requests.get(url_opt_1)
-		if r.status_code == 200:
-			valid_url = url_opt_1
-		else:
-			r = requests.get(url_opt_2)
-			if r.status_code == 200:
-				valid_url = url_opt_2
+		if date_obj.strftime('%m-%d-%Y') not in known_dates and date_obj.strftime('%m-%d-%Y') not in empty_dates:
+			probe_dates.append(date_obj)
 
-		if valid_url:
-			# extract the meeting date
-			meeting_date = date_obj.strftime('%m-%d-%Y')
+	# probe the dates concurrently
+	pool = ThreadPool(MAX_PROBE_THREADS)
+	try:
+		probe_results = pool.map(probeDate, probe_dates)
+	finally:
+		pool.close()
+		pool.join()
+
+	for date_obj, valid_url in probe_results:
+
+		# extract the meeting date
+		meeting_date = date_obj.strftime('%m-%d-%Y')
 
+		if valid_url:
 			# create an id
 			agenda_id = "%s_%s" % (agency, meeting_date)
 
@@ -77,12 +87,82 @@ def getAgendasList(agency, agenda_list):
 				print("New agenda found: %s, %s" % (agency, meeting_date))
 				agenda_list.append({"agency": agency, "meeting_date": meeting_date, "agenda_id": agenda_id, "url": valid_url, "downloaded": False, "scanned": False, "parsed": False})
 
+		# agendas can be posted a little late, so only remember a date as empty once it is well past
+		elif (end_date - date_obj).days > EMPTY_DATE_RECHECK_DAYS:
+			empty_dates.add(meeting_date)
+
+	writeEmptyDates(agency, empty_dates)
+
 	return agenda_list
-		
-	
 
 
 
+'''
+probeDate
+=========
+Given a date, check both of the urls its agenda PDF could be posted at.
+Returns a tuple of the date and the url that exists, or None if neither does.
+'''
+def probeDate(date_obj):
+	year = int(date_obj.strftime('%y'))
+	prev_year = year - 1
+	next_year = year + 1
+
+	# build urls for either option
+	url_opt_1 = "http://www.cusdk8.org/edline/about/board/agendas/{0}{1}/Board%20Agenda%20-%20Public%20{2}.pdf".format(prev_year, year, date_obj.strftime('%m%d%y'))
+	url_opt_2 = "http://www.cusdk8.org/edline/about/board/agendas/{0}{1}/Board%20Agenda%20-%20Public%20{2}.pdf".format(year, next_year, date_obj.strftime('%m%d%y'))
+
+	# see if either url returns a valid file
+	for url in [url_opt_1, url_opt_2]:
+		if urlExists(url):
+			return (date_obj, url)
+
+	return (date_obj, None)
+
+
+
+'''
+urlExists
+=========
+Check if a url exists without downloading it, using a HEAD request.
+Falls back to requesting just the first byte if the server doesn't support HEAD.
+'''
+def urlExists(url):
+	r = fetchURL(url, method='HEAD', use_cache=False)
+	if r.status_code in (405, 501):
+		r = fetchURL(url, headers={'Range': 'bytes=0-0'}, stream=True)
+		r.close()
+
+	return r.status_code in (200, 206)
+
+
+
+'''
+loadEmptyDates
+==============
+Load the set of dates already probed and found to have no agenda.
+'''
+def loadEmptyDates(agency):
+	empty_dates_filepath = "docs/" + agency + "/data/empty_probe_dates.json"
+	if os.path.exists(empty_dates_filepath):
+		with open(empty_dates_filepath) as data_file:
+			return set(json.load(data_file))
+
+	return set()
+
+
+
+'''
+writeEmptyDates
+===============
+Write out the set of dates already probed and found to have no agenda.
+'''
+def writeEmptyDates(agency, empty_dates):
+	empty_dates_filepath = "docs/" + agency + "/data/empty_probe_dates.json"
+	with open(empty_dates_filepath, 'w') as outfile:
+		json.dump(sorted(empty_dates), outfile, indent = 4)
+
+
 
 
 
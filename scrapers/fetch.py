@@ -0,0 +1,258 @@
+import time
+import threading
+import requests
+from collections import Counter
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+from requests.adapters import HTTPAdapter
+import http_cache
+try:
+	from urlparse import urlparse
+except ImportError:
+	from urllib.parse import urlparse
+
+# max number of requests in flight at once from fetchAll
+MAX_WORKERS = 8
+
+# max number of requests in flight at once to any one host
+MAX_REQUESTS_PER_HOST = 4
+
+# max number of requests in flight at once across all hosts, when several agencies are scraped together
+MAX_REQUESTS_IN_FLIGHT = 16
+
+# max number of file downloads streaming from any one host at once
+MAX_DOWNLOADS_PER_HOST = 2
+
+# min seconds between the start of two requests to the same host
+MIN_REQUEST_INTERVAL = 0.05
+
+# retry settings for failed requests
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# shared keep-alive session and per-host limits
+_session = None
+_session_lock = threading.Lock()
+_host_limits = dict()
+_host_limits_lock = threading.Lock()
+_download_limits = dict()
+_request_slots = threading.BoundedSemaphore(MAX_REQUESTS_IN_FLIGHT)
+
+# running totals of requests made and bytes received, for instrumentation
+_counters = Counter()
+_counters_lock = threading.Lock()
+
+
+
+'''
+getSession
+==========
+Return the shared requests session, creating it on first use.
+The session keeps connections alive, with a connection pool big enough for MAX_REQUESTS_IN_FLIGHT requests.
+'''
+def getSession():
+	global _session
+	with _session_lock:
+		if _session is None:
+			_session = requests.Session()
+			adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_REQUESTS_IN_FLIGHT)
+			_session.mount('http://', adapter)
+			_session.mount('https://', adapter)
+
+	return _session
+
+
+
+'''
+countRequest
+============
+Add to the running totals of HTTP activity (http_requests, http_bytes, http_cache_hits, http_not_modified).
+'''
+def countRequest(**counts):
+	with _counters_lock:
+		_counters.update(counts)
+
+
+
+'''
+getCounters
+===========
+Returns a copy of the running totals of HTTP activity.
+'''
+def getCounters():
+	with _counters_lock:
+		return dict(_counters)
+
+
+
+'''
+hostSlot
+========
+Context manager that waits for a free request slot on the url's host.
+Limits each host to MAX_REQUESTS_PER_HOST concurrent requests,
+started at least MIN_REQUEST_INTERVAL seconds apart, and all hosts together to MAX_REQUESTS_IN_FLIGHT.
+'''
+@contextmanager
+def hostSlot(url):
+	host = urlparse(url).netloc
+
+	with _host_limits_lock:
+		if host not in _host_limits:
+			_host_limits[host] = {'semaphore': threading.Semaphore(MAX_REQUESTS_PER_HOST), 'lock': threading.Lock(), 'next_request': 0}
+		host_limit = _host_limits[host]
+
+	host_limit['semaphore'].acquire()
+	_request_slots.acquire()
+	try:
+		# reserve the next start time for this host, then wait for it
+		with host_limit['lock']:
+			now = time.time()
+			start_time = max(now, host_limit['next_request'])
+			host_limit['next_request'] = start_time + MIN_REQUEST_INTERVAL
+		if start_time > now:
+			time.sleep(start_time - now)
+
+		yield
+	finally:
+		_request_slots.release()
+		host_limit['semaphore'].release()
+
+
+
+'''
+downloadSlot
+============
+Context manager that waits for a free download slot on the url's host, limiting each host
+to MAX_DOWNLOADS_PER_HOST streaming downloads at once. Hold it for the whole transfer.
+'''
+@contextmanager
+def downloadSlot(url):
+	host = urlparse(url).netloc
+
+	with _host_limits_lock:
+		if host not in _download_limits:
+			_download_limits[host] = threading.Semaphore(MAX_DOWNLOADS_PER_HOST)
+		semaphore = _download_limits[host]
+
+	semaphore.acquire()
+	try:
+		yield
+	finally:
+		semaphore.release()
+
+
+
+'''
+fetchURL
+========
+Request a url through the shared session, respecting the per-host limits.
+GET responses go through the on-disk cache: a cached response younger than max_age seconds
+(CACHE_TTL if None) is served directly, an older one is revalidated with the server, and in
+offline mode only the cache is used. Pass use_cache=False for requests that shouldn't be cached,
+and stream=True (which also skips the cache) to read the body lazily.
+Returns the response.
+'''
+def fetchURL(url, params=None, method='GET', headers=None, timeout=30, use_cache=True, max_age=None, stream=False):
+
+	use_cache = use_cache and method == 'GET' and not stream
+	cache_entry = None
+	if use_cache:
+		cache_entry = http_cache.lookup(url, params)
+		if cache_entry is not None and (http_cache.OFFLINE or http_cache.isFresh(cache_entry, max_age)):
+			cached_response = http_cache.buildResponse(cache_entry)
+			if cached_response is not None:
+				countRequest(http_cache_hits=1)
+				return cached_response
+
+			# evicted since it was looked up
+			cache_entry = None
+
+	if http_cache.OFFLINE:
+		raise http_cache.CacheMissError("No cached response for %s %s" % (url, params))
+
+	# ask the server to confirm the cached copy is still current instead of resending it
+	request_headers = dict(headers or {})
+	if cache_entry is not None:
+		request_headers.update(http_cache.revalidationHeaders(cache_entry))
+
+	response = requestWithRetries(url, params, method, request_headers, timeout, stream)
+
+	if use_cache:
+		if response.status_code == 304 and cache_entry is not None:
+			countRequest(http_not_modified=1)
+			http_cache.markRevalidated(cache_entry)
+			cached_response = http_cache.buildResponse(cache_entry)
+			if cached_response is not None:
+				return cached_response
+
+			# the body was evicted while it was being revalidated, so fetch it in full
+			response = requestWithRetries(url, params, method, dict(headers or {}), timeout, stream)
+
+		if response.status_code == 200:
+			http_cache.store(url, params, response)
+
+	# streamed bodies are counted by whoever reads them
+	if not stream:
+		countRequest(http_bytes=len(response.content))
+
+	return response
+
+
+
+'''
+requestWithRetries
+==================
+Make a request through the shared session, respecting the per-host limits.
+Connection errors and RETRY_STATUS_CODES responses are retried with exponential backoff.
+Returns the response, or raises the last connection error if every attempt failed.
+'''
+def requestWithRetries(url, params, method, headers, timeout, stream=False):
+
+	session = getSession()
+
+	for attempt in range(MAX_RETRIES + 1):
+		response = None
+		with hostSlot(url):
+			try:
+				response = session.request(method, url, params=params, headers=headers, timeout=timeout, stream=stream)
+				countRequest(http_requests=1)
+			except requests.RequestException as e:
+				error = e
+
+		if response is not None and response.status_code not in RETRY_STATUS_CODES:
+			return response
+
+		if attempt < MAX_RETRIES:
+			# free up the connection held by a failed streamed response before retrying
+			if response is not None:
+				response.close()
+			time.sleep(BACKOFF_FACTOR * (2 ** attempt))
+
+	if response is None:
+		raise error
+
+	return response
+
+
+
+'''
+fetchAll
+========
+Given a list of (url, params) tuples, fetch them all concurrently using up to max_workers threads.
+max_age is passed on to fetchURL for every request.
+Returns the list of responses, in the same order as the requests.
+'''
+def fetchAll(requests_list, max_workers=MAX_WORKERS, max_age=None):
+
+	if len(requests_list) == 0:
+		return list()
+
+	pool = ThreadPool(min(max_workers, len(requests_list)))
+	try:
+		responses = pool.map(lambda request: fetchURL(request[0], request[1], max_age=max_age), requests_list)
+	finally:
+		pool.close()
+		pool.join()
+
+	return responses
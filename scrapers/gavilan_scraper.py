@@ -5,6 +5,7 @@ import datetime
 import os.path
 import json
 from utils import loadExistingAgendaList, writeAgendaListToDisk, downloadAgendas
+from fetch import fetchURL
 
 def main():
 
@@ -39,8 +40,8 @@ def getAgendasList(agency, agenda_list):
 
 	base_url = "http://www.gavilan.edu/board/"
 
-	# scrape meeting list page
-	r = requests.get('http://www.gavilan.edu/board/agenda.php')
+	# scrape meeting list page, always checking with the server for new meetings
+	r = fetchURL('http://www.gavilan.edu/board/agenda.php', max_age=0)
 	meetings_soup = BeautifulSoup(r.content, "lxml")
 
 	agenda_table = meetings_soup.find(id="agenda").find("table")
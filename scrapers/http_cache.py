@@ -0,0 +1,327 @@
+import os
+import json
+import time
+import atexit
+import hashlib
+import threading
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# directory holding the cached response bodies and their index
+CACHE_DIR = "docs/.http_cache"
+
+# seconds a cached response is served without checking back with the server
+CACHE_TTL = 24 * 60 * 60
+
+# max total size of the cached bodies, before the least recently used responses are evicted
+MAX_CACHE_BYTES = 500 * 1024 * 1024
+
+# min seconds between writes of the cache index while storing responses (it's also written at exit)
+INDEX_FLUSH_INTERVAL = 60
+
+# response headers worth keeping with a cached body
+CACHED_HEADERS = ['content-type', 'etag', 'last-modified']
+
+# in offline mode every request is served from the cache, however old, and never from the network
+OFFLINE = os.environ.get('AGENDAMINER_OFFLINE', '') not in ('', '0')
+
+_index = None
+_index_dirty = False
+_index_written_at = 0
+_body_refs = None
+_cache_bytes = 0
+_cache_lock = threading.RLock()
+
+
+
+'''
+CacheMissError
+==============
+Raised in offline mode when a request has no cached response.
+'''
+class CacheMissError(IOError):
+	pass
+
+
+
+'''
+setOfflineMode
+==============
+Turn offline replay mode on or off.
+'''
+def setOfflineMode(offline):
+	global OFFLINE
+	OFFLINE = offline
+
+
+
+'''
+requestKey
+==========
+Given a url and its query params, return a key identifying the request.
+'''
+def requestKey(url, params):
+	params_string = json.dumps(params or {}, sort_keys=True)
+	return hashlib.sha1((url + "?" + params_string).encode('utf-8')).hexdigest()
+
+
+
+'''
+loadIndex
+=========
+Load the cache index from disk on first use.
+The index maps each request key to the hash of its body and the info needed to revalidate it.
+Also counts the entries pointing at each body and the total size of the bodies, which are kept up to date from then on.
+Returns the index dict.
+'''
+def loadIndex():
+	global _index, _body_refs, _cache_bytes
+	with _cache_lock:
+		if _index is None:
+			index_filepath = os.path.join(CACHE_DIR, "index.json")
+			_index = dict()
+			if os.path.exists(index_filepath):
+				try:
+					with open(index_filepath) as index_file:
+						_index = json.load(index_file)
+				except ValueError:
+					print("Cache index %s is corrupt, starting a new one" % index_filepath)
+
+			_body_refs = dict()
+			_cache_bytes = 0
+			for entry in _index.values():
+				addBodyRef(entry)
+
+	return _index
+
+
+
+'''
+writeIndexToDisk
+================
+Write the cache index out to disk if it has changed.
+Writes to a temp file first so a crash never leaves a half-written index behind.
+'''
+def writeIndexToDisk():
+	global _index_dirty, _index_written_at
+	with _cache_lock:
+		if _index is None or not _index_dirty:
+			return
+
+		if not os.path.exists(CACHE_DIR):
+			os.makedirs(CACHE_DIR)
+
+		index_filepath = os.path.join(CACHE_DIR, "index.json")
+		with open(index_filepath + ".tmp", 'w') as index_file:
+			json.dump(_index, index_file)
+		os.rename(index_filepath + ".tmp", index_filepath)
+		_index_dirty = False
+		_index_written_at = time.time()
+
+atexit.register(writeIndexToDisk)
+
+
+
+'''
+lookup
+======
+Given a url and its query params, find the cached entry for that request, if any.
+Returns the entry dict, or None.
+'''
+def lookup(url, params):
+	global _index_dirty
+	with _cache_lock:
+		entry = loadIndex().get(requestKey(url, params))
+		if entry is not None:
+			if not os.path.exists(bodyFilepath(entry['body_hash'])):
+				return None
+			entry['last_used'] = time.time()
+			_index_dirty = True
+
+	return entry
+
+
+
+'''
+isFresh
+=======
+Check if a cached entry is young enough to serve without revalidating it.
+A max_age of None uses CACHE_TTL.
+'''
+def isFresh(entry, max_age=None):
+	if max_age is None:
+		max_age = CACHE_TTL
+	return time.time() - entry['fetched_at'] < max_age
+
+
+
+'''
+revalidationHeaders
+===================
+Build the conditional request headers that let the server answer 304 Not Modified
+if the cached entry is still current.
+'''
+def revalidationHeaders(entry):
+	headers = dict()
+	if entry['headers'].get('etag'):
+		headers['If-None-Match'] = entry['headers']['etag']
+	if entry['headers'].get('last-modified'):
+		headers['If-Modified-Since'] = entry['headers']['last-modified']
+	return headers
+
+
+
+'''
+store
+=====
+Save a successful response to the cache, storing its body under the hash of its contents.
+Evicts the least recently used entries if the cache grows past MAX_CACHE_BYTES. The index is written out
+at most every INDEX_FLUSH_INTERVAL seconds, and at exit.
+Returns the new entry.
+'''
+def store(url, params, response):
+	global _index_dirty
+
+	body = response.content
+	body_hash = hashlib.sha1(body).hexdigest()
+	body_filepath = bodyFilepath(body_hash)
+
+	with _cache_lock:
+		if not os.path.exists(body_filepath):
+			body_dir = os.path.dirname(body_filepath)
+			if not os.path.exists(body_dir):
+				os.makedirs(body_dir)
+			with open(body_filepath + ".tmp", 'wb') as body_file:
+				body_file.write(body)
+			os.rename(body_filepath + ".tmp", body_filepath)
+
+		now = time.time()
+		entry = {
+			'url': url,
+			'params': params,
+			'status_code': response.status_code,
+			'headers': dict((header, response.headers[header]) for header in CACHED_HEADERS if header in response.headers),
+			'body_hash': body_hash,
+			'size': len(body),
+			'fetched_at': now,
+			'last_used': now
+		}
+		index = loadIndex()
+		key = requestKey(url, params)
+		old_entry = index.get(key)
+		index[key] = entry
+		_index_dirty = True
+
+		# count the new body before releasing the old one, in case they're the same
+		addBodyRef(entry)
+		if old_entry is not None:
+			removeBodyRef(old_entry)
+
+		if _cache_bytes > MAX_CACHE_BYTES:
+			evictEntries()
+		if now - _index_written_at >= INDEX_FLUSH_INTERVAL:
+			writeIndexToDisk()
+
+	return entry
+
+
+
+'''
+markRevalidated
+===============
+Record that the server confirmed a cached entry is still current, restarting its TTL.
+'''
+def markRevalidated(entry):
+	global _index_dirty
+	with _cache_lock:
+		entry['fetched_at'] = time.time()
+		_index_dirty = True
+
+
+
+'''
+evictEntries
+============
+Remove the least recently used entries until the cached bodies fit in MAX_CACHE_BYTES.
+Body files are only deleted once no remaining entry points at them.
+'''
+def evictEntries():
+	global _index_dirty
+	with _cache_lock:
+		index = loadIndex()
+		if _cache_bytes <= MAX_CACHE_BYTES:
+			return
+
+		for key, entry in sorted(index.items(), key=lambda item: item[1]['last_used']):
+			if _cache_bytes <= MAX_CACHE_BYTES:
+				break
+
+			del index[key]
+			_index_dirty = True
+			removeBodyRef(entry)
+
+
+
+'''
+addBodyRef
+==========
+Count a new index entry pointing at its body, adding the body's size to the cache total if it's the first.
+'''
+def addBodyRef(entry):
+	global _cache_bytes
+	with _cache_lock:
+		_body_refs[entry['body_hash']] = _body_refs.get(entry['body_hash'], 0) + 1
+		if _body_refs[entry['body_hash']] == 1:
+			_cache_bytes += entry['size']
+
+
+
+'''
+removeBodyRef
+=============
+Stop counting an index entry that was replaced or evicted. If no entry points at its body any more,
+the body's size comes off the cache total and its file is deleted.
+'''
+def removeBodyRef(entry):
+	global _cache_bytes
+	with _cache_lock:
+		_body_refs[entry['body_hash']] -= 1
+		if _body_refs[entry['body_hash']] == 0:
+			del _body_refs[entry['body_hash']]
+			_cache_bytes -= entry['size']
+			if os.path.exists(bodyFilepath(entry['body_hash'])):
+				os.remove(bodyFilepath(entry['body_hash']))
+
+
+
+'''
+buildResponse
+=============
+Rebuild a requests Response object from a cached entry, so callers can't tell it apart from a live one.
+Returns None if the body was evicted since the entry was looked up, which callers treat as a cache miss.
+'''
+def buildResponse(entry):
+	try:
+		with open(bodyFilepath(entry['body_hash']), 'rb') as body_file:
+			body = body_file.read()
+	except IOError:
+		return None
+
+	response = Response()
+	response.status_code = entry['status_code']
+	response.headers = CaseInsensitiveDict(entry['headers'])
+	response.encoding = get_encoding_from_headers(response.headers)
+	response.url = entry['url']
+	response._content = body
+	return response
+
+
+
+'''
+bodyFilepath
+============
+Return the path of the file holding the body with the given hash.
+'''
+def bodyFilepath(body_hash):
+	return os.path.join(CACHE_DIR, "bodies", body_hash[:2], body_hash)
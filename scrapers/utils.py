@@ -1,6 +1,14 @@
 import json
 import os
 import requests
+from multiprocessing.pool import ThreadPool
+from fetch import fetchURL, downloadSlot, countRequest
+
+# number of pdfs to download at once
+MAX_DOWNLOAD_THREADS = 4
+
+# bytes to read from the network at a time when downloading
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
 
 
 '''
@@ -60,12 +68,14 @@ writeAgendaListToDisk
 =====================
 Given an agency and JSON-formatted agenda list,
 write out the list to disk.
+Writes to a temp file first so an interrupted write never leaves a truncated list behind.
 '''
 def writeAgendaListToDisk(agency, agenda_list):
 
 	agenda_list_filepath = "docs/" + agency + "/agenda_list.json"
-	with open(agenda_list_filepath, 'wb') as outfile:
+	with open(agenda_list_filepath + ".tmp", 'wb') as outfile:
 		json.dump(agenda_list, outfile, sort_keys = True, indent = 4, ensure_ascii=False)
+	os.rename(agenda_list_filepath + ".tmp", agenda_list_filepath)
 
 
 
@@ -73,18 +83,77 @@ def writeAgendaListToDisk(agency, agenda_list):
 downloadAgendas
 ===============
 Given a list of agendas and the URLs of their pdfs, scrapes any agendas that haven't
-yet been downloaded. Updates the agenda list, and returns it.
+yet been downloaded, several at a time. Each agenda is marked downloaded, and the agenda list written out,
+as soon as its pdf is safely on disk. Updates the agenda list, and returns it.
 '''
 def downloadAgendas(agency, agenda_list):
-	for agenda in agenda_list:
 
-		if not agenda['downloaded']:
+	pending_agendas = [agenda for agenda in agenda_list if not agenda['downloaded']]
+	if len(pending_agendas) == 0:
+		return agenda_list
+
+	pool = ThreadPool(min(MAX_DOWNLOAD_THREADS, len(pending_agendas)))
+	try:
+		for agenda, error in pool.imap_unordered(lambda agenda: downloadAgendaPDF(agency, agenda), pending_agendas):
+			if error is None:
+				agenda['downloaded'] = True
+				writeAgendaListToDisk(agency, agenda_list)
+			else:
+				print("DOWNLOAD ERROR")
+				print("Could not download %s: %s" % (agenda['url'], error))
+	finally:
+		pool.close()
+		pool.join()
+
+	return agenda_list
 
-			r = requests.get(agenda['url'])
-			pdf_filepath = "docs/" + agency + "/raw_pdfs/" + agenda['agenda_id'] + ".pdf"
-			with open(pdf_filepath, 'wb') as f:
-				f.write(r.content)
 
-			agenda['downloaded'] = True
 
-	return agenda_list
\ No newline at end of file
+'''
+downloadAgendaPDF
+=================
+Given an agenda, stream its pdf to a temp file in chunks, check it, and then move it into place,
+so an interrupted download never leaves a truncated pdf behind.
+Returns a tuple of the agenda and an error message (None on success).
+'''
+def downloadAgendaPDF(agency, agenda):
+
+	pdf_filepath = "docs/" + agency + "/raw_pdfs/" + agenda['agenda_id'] + ".pdf"
+	temp_filepath = pdf_filepath + ".part"
+
+	try:
+		with downloadSlot(agenda['url']):
+			r = fetchURL(agenda['url'], stream=True)
+			bytes_written = 0
+			try:
+				if r.status_code != 200:
+					raise IOError("status code %d" % r.status_code)
+
+				file_start = b''
+				with open(temp_filepath, 'wb') as f:
+					for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+						f.write(chunk)
+						bytes_written += len(chunk)
+						if len(file_start) < 1024:
+							file_start += chunk[:1024]
+			finally:
+				r.close()
+				countRequest(http_bytes=bytes_written)
+
+		# make sure the whole file arrived (the length can't be checked if the transfer was compressed)
+		expected_length = r.headers.get('Content-Length')
+		if expected_length is not None and r.headers.get('Content-Encoding', 'identity') == 'identity' and int(expected_length) != bytes_written:
+			raise IOError("expected %s bytes, got %d" % (expected_length, bytes_written))
+
+		# make sure it's a pdf
+		if b'%PDF' not in file_start[:1024]:
+			raise IOError("file is not a pdf")
+
+		os.rename(temp_filepath, pdf_filepath)
+
+	except Exception as e:
+		if os.path.exists(temp_filepath):
+			os.remove(temp_filepath)
+		return (agenda, str(e))
+
+	return (agenda, None)